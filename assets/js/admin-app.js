@@ -34,6 +34,7 @@ let allUsers = [];
 let currentDoubtId = null;
 let currentUserId = null;
 let currentTestId = null;
+let currentTestQuestions = [];      // Questions shown in the Manage Questions modal
 let currentQuestionImageFile = null;
 let currentQuestionImageURL = null;
 let currentSolutionImageFile = null;
@@ -1043,7 +1044,7 @@ function displayTests(tests) {
                 <td>${escapeHtml(test.name)}</td>
                 <td>${escapeHtml(test.subject)}</td>
                 <td><span class="badge badge-${test.type}">${test.type}</span></td>
-                <td>${test.questions?.length || 0}</td>
+                <td>${test.questionCount ?? test.questions?.length ?? 0}</td>
                 <td>${calculatedTotalMarks}</td>
                 <td>${test.duration} min</td>
                 <td>${formatDate(test.createdAt)}</td>
@@ -1620,6 +1621,7 @@ function displayTestQuestions(questions, totalMarks) {
     const countElement = document.getElementById('questionCount');
     const totalMarksElement = document.getElementById('testTotalMarksDisplay');
 
+    currentTestQuestions = questions;
     countElement.textContent = questions.length;
     totalMarksElement.textContent = totalMarks;
 
@@ -1873,9 +1875,8 @@ async function handleAddQuestion(e) {
 
 // Delete a Question (UPDATED)
 window.deleteQuestion = async function(testId, questionIndex) {
-    // Find the specific question to get its marks before deleting
-    const test = allTests.find(t => t.id === testId);
-    const questionToDelete = test?.questions?.[questionIndex];
+    // Find the specific question from the list currently shown in the modal
+    const questionToDelete = currentTestQuestions[questionIndex];
 
     if (!questionToDelete) {
          showToast('Could not find question to delete.', 'error');
@@ -1889,7 +1890,11 @@ window.deleteQuestion = async function(testId, questionIndex) {
     showLoading('Deleting question...');
     try {
         const idToken = await auth.currentUser.getIdToken();
-        const response = await fetch(`${API_BASE_URL}/api/tests/${testId}/questions/${questionIndex}`, {
+        // Migrated questions are deleted by ID; legacy ones by index
+        const questionPath = questionToDelete.id != null
+            ? `questions/${encodeURIComponent(questionToDelete.id)}`
+            : `questions-by-index/${questionIndex}`;
+        const response = await fetch(`${API_BASE_URL}/api/tests/${testId}/${questionPath}`, {
             method: 'DELETE',
             headers: {
                 'Authorization': `Bearer ${idToken}`
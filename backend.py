@@ -5,22 +5,53 @@
 # ===================================
 import re 
 import os
+import sys
+import asyncio
+import contextvars
+import io
+import csv
 import json
+import logging
+import hashlib
+import math
+import time
+import atexit
+import uuid
+import socket
+import queue
+import random
+import threading
+import multiprocessing
+import sqlite3
 import requests
+import jwt
 from datetime import datetime, timedelta
-from functools import wraps
+from logging.handlers import QueueHandler, QueueListener
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FuturesTimeoutError
+from collections import OrderedDict
+from functools import wraps, lru_cache
 from dotenv import load_dotenv
-from firebase_admin import credentials, firestore, auth, storage
-from flask import Flask, request, jsonify, Response
-from flask_cors import CORS
+from flask import Flask, request, jsonify, Response, g, has_request_context
+from werkzeug.middleware.proxy_fix import ProxyFix
 import firebase_admin
-from firebase_admin import credentials, firestore, auth, storage
+from firebase_admin import credentials, firestore, auth
+from google.api_core.exceptions import NotFound, PreconditionFailed, FailedPrecondition
+from google.cloud import storage as gcs_storage
+from cryptography import x509
+from PIL import UnidentifiedImageError
 from urllib.parse import urlparse
-import traceback
+from urllib3.util.retry import Retry
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess
+)
+import image_pipeline
 
 # Load environment variables
 load_dotenv()
 
+_module_started_at = time.perf_counter()  # Reported by warm_up as module load time
+
 # ===================================
 # FLASK APP INITIALIZATION
 # ===================================
@@ -28,102 +59,918 @@ load_dotenv()
 app = Flask(__name__)
 
 # ===================================
-# CORS CONFIGURATION - UPDATED FOR TUS
+# STRUCTURED LOGGING
 # ===================================
+# Log calls never touch stdout on the calling thread. QueueHandler formats
+# the record as one JSON line, attaching request id, route, uid and latency
+# while the request is still in context, and drops it (counted) if the queue
+# is full. A per-process QueueListener thread does the actual writing.
+# LOG_LEVEL sets the app level; LOG_LEVELS takes "logger=LEVEL,..." overrides.
+# Routine success lines pass extra=SAMPLED and are kept at LOG_SUCCESS_SAMPLE_RATE.
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO').upper()
+LOG_LEVELS = os.getenv('LOG_LEVELS', '')
+LOG_SUCCESS_SAMPLE_RATE = float(os.getenv('LOG_SUCCESS_SAMPLE_RATE', 1.0))
+LOG_QUEUE_SIZE = int(os.getenv('LOG_QUEUE_SIZE', 10000))
+SAMPLED = {'sampled': True}
+
+
+class JsonLogFormatter(logging.Formatter):
+    """One JSON object per line"""
+
+    def format(self, record):
+        entry = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S', time.gmtime(record.created)) + f'.{int(record.msecs):03d}Z',
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'pid': record.process
+        }
+        for field in ('requestId', 'method', 'route', 'uid', 'latencyMs', 'status'):
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, ensure_ascii=False)
+
+
+class RequestContextFilter(logging.Filter):
+    """Attach request context on the calling thread; apply success sampling"""
+
+    def filter(self, record):
+        if getattr(record, 'sampled', False) and random.random() >= LOG_SUCCESS_SAMPLE_RATE:
+            return False
+        if has_request_context():
+            record.requestId = g.get('request_id')
+            record.method = request.method
+            record.route = request.url_rule.rule if request.url_rule is not None else request.path
+            record.uid = getattr(request, 'uid', None)
+            started_at = g.get('metrics_started_at')
+            if started_at is not None and getattr(record, 'latencyMs', None) is None:
+                record.latencyMs = round((time.perf_counter() - started_at) * 1000, 1)
+        return True
+
+
+class NonBlockingQueueHandler(QueueHandler):
+    """QueueHandler that drops instead of blocking, and (re)starts its listener per process"""
+
+    def __init__(self, log_queue, target_handler):
+        super().__init__(log_queue)
+        self.target_handler = target_handler
+        self.dropped = 0
+        self._listener = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def ensure_listener(self):
+        if self._listener is not None and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._listener is None or self._pid != os.getpid():
+                if self._pid is not None:
+                    # Forked child: the inherited queue's locks may be held by a thread that no longer exists
+                    self.queue = queue.Queue(LOG_QUEUE_SIZE)
+                self._listener = QueueListener(self.queue, self.target_handler)
+                self._listener.start()
+                self._pid = os.getpid()
+
+    def enqueue(self, record):
+        self.ensure_listener()
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def stop(self):
+        if self._listener is not None and self._pid == os.getpid():
+            self._listener.stop()  # Drains what is already queued
+
+
+def configure_logging():
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter('%(message)s'))  # Already JSON
+
+    queue_handler = NonBlockingQueueHandler(queue.Queue(LOG_QUEUE_SIZE), stream_handler)
+    queue_handler.setFormatter(JsonLogFormatter())
+    queue_handler.addFilter(RequestContextFilter())
+
+    root = logging.getLogger()
+    root.handlers[:] = [queue_handler]
+    root.setLevel(logging.WARNING)  # Third-party libraries stay quiet unless overridden
+    logging.getLogger('geocatalyst').setLevel(LOG_LEVEL)
+    for override in filter(None, (item.strip() for item in LOG_LEVELS.split(','))):
+        name, _, level = override.partition('=')
+        logging.getLogger(name.strip()).setLevel(level.strip().upper())
+
+    atexit.register(queue_handler.stop)
+    return queue_handler
+
+
+log_handler = configure_logging()
+logger = logging.getLogger('geocatalyst')
+
+
+@app.before_request
+def assign_request_id():
+    g.request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+
+
+@app.after_request
+def log_request(response):
+    response.headers['X-Request-ID'] = g.get('request_id', '')
+    logger.log(
+        logging.WARNING if response.status_code >= 500 else logging.INFO,
+        f"{request.method} {request.path} {response.status_code}",
+        extra={'status': response.status_code, **(SAMPLED if response.status_code < 400 else {})}
+    )
+    return response
+
+# ===================================
+# REQUEST METRICS (PROMETHEUS)
+# ===================================
+# Registered before every other hook so each request, including preflights
+# answered early, is timed. Labels use the matched URL rule (never the raw
+# path) to keep cardinality bounded. Under gunicorn, set
+# PROMETHEUS_MULTIPROC_DIR and every worker writes to shared files that
+# /api/metrics aggregates (gunicorn.conf.py wipes the dir and reaps dead workers).
+
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')  # Optional bearer token for scrapers
+METRICS_LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+METRICS_SIZE_BUCKETS = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304)
+
+REQUEST_LATENCY = Histogram(
+    'geocatalyst_http_request_duration_seconds', 'Time spent handling a request',
+    ['route', 'method'], buckets=METRICS_LATENCY_BUCKETS
+)
+REQUEST_COUNT = Counter(
+    'geocatalyst_http_requests_total', 'Requests handled, by response status',
+    ['route', 'method', 'status']
+)
+RESPONSE_SIZE = Histogram(
+    'geocatalyst_http_response_size_bytes', 'Response body size (non-streamed responses)',
+    ['route', 'method'], buckets=METRICS_SIZE_BUCKETS
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    'geocatalyst_http_requests_in_flight', 'Requests currently being handled',
+    multiprocess_mode='livesum'
+)
+
+
+def metrics_route():
+    """Matched URL rule for the current request, e.g. /api/tests/<test_id>"""
+    return request.url_rule.rule if request.url_rule is not None else 'unmatched'
+
+
+@app.before_request
+def start_request_metrics():
+    g.metrics_started_at = time.perf_counter()
+    REQUESTS_IN_FLIGHT.inc()
 
-CORS(app, resources={
-    r"/api/*": {
-        "origins": [
-            "https://literate-capybara-5gxqv4r6prvjf4x4r-5500.app.github.dev",
-            "https://literate-capybara-5gxqv4r6prvjf4x4r-5000.app.github.dev",
-            "https://geocatalyst-admin.web.app",  # Firebase production - ADMIN
-            "https://geocatalyst-admin.firebaseapp.com",  # Firebase alternative - ADMIN
-            "http://localhost:5500",
-            "http://127.0.0.1:5500",
-            os.getenv('FRONTEND_URL', '')
-        ],
-        "methods": ["GET", "POST", "PUT", "DELETE", "OPTIONS", "HEAD", "PATCH"],
-        "allow_headers": [
-            "Content-Type", 
-            "Authorization", 
-            "Tus-Resumable", 
-            "Upload-Length", 
-            "Upload-Metadata", 
-            "Upload-Offset", 
-            "Upload-Concat",
-            "X-Requested-With"
-        ],
-        "expose_headers": [
-            "Location", 
-            "Upload-Offset", 
-            "Upload-Length", 
-            "Tus-Resumable",
-            "Tus-Version",
-            "Tus-Extension",
-            "stream-media-id",
-            "X-Video-UID"
-        ],
-        "supports_credentials": True
-    }
-})
+
+@app.after_request
+def record_request_metrics(response):
+    started_at = g.get('metrics_started_at')
+    if started_at is not None:
+        route = metrics_route()
+        REQUEST_LATENCY.labels(route, request.method).observe(time.perf_counter() - started_at)
+        REQUEST_COUNT.labels(route, request.method, response.status_code).inc()
+        if not response.is_streamed and response.content_length is not None:
+            RESPONSE_SIZE.labels(route, request.method).observe(response.content_length)
+    return response
+
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    # teardown always runs, so the gauge cannot drift on unhandled errors
+    if g.pop('metrics_started_at', None) is not None:
+        REQUESTS_IN_FLIGHT.dec()
+
+
+@app.route('/api/metrics', methods=['GET'])
+def prometheus_metrics():
+    """Prometheus text exposition of the request metrics (all workers)"""
+    if METRICS_TOKEN and request.headers.get('Authorization') != f'Bearer {METRICS_TOKEN}':
+        return jsonify({'error': 'Unauthorized'}), 401
+
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry), mimetype=CONTENT_TYPE_LATEST)
+
+# ===================================
+# CORS CONFIGURATION - UPDATED FOR TUS
+# ===================================
+# One policy, compiled at import: origins are a frozenset and every header
+# value is a precomputed tuple. Preflights are answered in before_request,
+# ahead of routing and auth, and carry Access-Control-Max-Age so browsers
+# reuse them instead of preflighting every admin call.
+
+CORS_ALLOWED_ORIGINS = frozenset(origin for origin in (
+    "https://literate-capybara-5gxqv4r6prvjf4x4r-5500.app.github.dev",
+    "https://literate-capybara-5gxqv4r6prvjf4x4r-5000.app.github.dev",
+    "https://geocatalyst-admin.web.app",  # Firebase production - ADMIN
+    "https://geocatalyst-admin.firebaseapp.com",  # Firebase alternative - ADMIN
+    "http://localhost:5500",
+    "http://127.0.0.1:5500",
+    os.getenv('FRONTEND_URL', '')
+) if origin)
+CORS_MAX_AGE_SECONDS = int(os.getenv('CORS_MAX_AGE_SECONDS', 86400))  # Browsers cap this (Chrome: 2h)
+
+CORS_RESPONSE_HEADERS = (
+    ('Access-Control-Allow-Credentials', 'true'),
+    ('Access-Control-Expose-Headers', 'Location,Upload-Offset,Upload-Length,Tus-Resumable,Tus-Version,Tus-Extension,stream-media-id,X-Video-UID,X-Firestore-Reads,X-Firestore-Writes,X-Firestore-RPCs,Server-Timing,Retry-After')
+)
+CORS_PREFLIGHT_HEADERS = (
+    ('Access-Control-Allow-Methods', 'GET,POST,PUT,DELETE,OPTIONS,HEAD,PATCH'),
+    ('Access-Control-Allow-Headers', 'Content-Type,Authorization,Tus-Resumable,Upload-Length,Upload-Metadata,Upload-Offset,Upload-Concat,X-Requested-With'),
+    ('Access-Control-Max-Age', str(CORS_MAX_AGE_SECONDS))
+)
 
 app.config['SECRET_KEY'] = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-change-in-production')
 app.config['MAX_CONTENT_LENGTH'] = int(os.getenv('MAX_VIDEO_SIZE_MB', 2000)) * 1024 * 1024
 
+@app.before_request
+def answer_cors_preflight():
+    """Answer OPTIONS preflights before routing and auth run"""
+    if request.method == 'OPTIONS' and request.path.startswith('/api/'):
+        response = Response(status=204)
+        if request.headers.get('Origin') in CORS_ALLOWED_ORIGINS:
+            response.headers.extend(CORS_PREFLIGHT_HEADERS)
+        return response  # after_request adds the origin headers
+
 @app.after_request
 def after_request(response):
-    """Add CORS headers to all responses"""
+    """Add CORS headers to all responses (error handlers included)"""
+    response.vary.add('Origin')
     origin = request.headers.get('Origin')
-    allowed_origins = [
-        "https://literate-capybara-5gxqv4r6prvjf4x4r-5500.app.github.dev",
-        "https://literate-capybara-5gxqv4r6prvjf4x4r-5000.app.github.dev",
-        "https://geocatalyst-admin.web.app",  # Firebase production - ADMIN
-        "https://geocatalyst-admin.firebaseapp.com",  # Firebase alternative - ADMIN
-        "http://localhost:5500",
-        "http://127.0.0.1:5500"
-    ]
-    
-    if origin in allowed_origins:
+    if origin in CORS_ALLOWED_ORIGINS:
         response.headers['Access-Control-Allow-Origin'] = origin
-        response.headers['Access-Control-Allow-Credentials'] = 'true'
-        response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS,HEAD,PATCH'
-        response.headers['Access-Control-Allow-Headers'] = 'Content-Type,Authorization,Tus-Resumable,Upload-Length,Upload-Metadata,Upload-Offset,Upload-Concat,X-Requested-With'
-        response.headers['Access-Control-Expose-Headers'] = 'Location,Upload-Offset,Upload-Length,Tus-Resumable,Tus-Version,Tus-Extension,stream-media-id,X-Video-UID'
+        response.headers.extend(CORS_RESPONSE_HEADERS)
     
     return response
 
 
+# ===================================
+# RATE LIMITING AND ADMISSION CONTROL
+# ===================================
+# Token buckets per principal and route: uid once a request is authenticated
+# (checked inside require_auth / require_student_auth), client IP for calls
+# without an Authorization header. Until a token is verified only the IP is
+# known, so every failed authentication spends from a per-IP bucket and IPs
+# that emptied it are refused before their tokens are even checked. Client
+# IPs come from ProxyFix, trusting TRUSTED_PROXY_HOPS proxies in front of us.
+# Budgets are (burst, tokens per second); routes not listed in
+# RATE_LIMIT_ROUTES use their role's default. Buckets live in process
+# memory, or in a SQLite file shared by every worker on the host when
+# RATE_LIMIT_STORE_PATH is set. Independently, when MAX_IN_FLIGHT_REQUESTS
+# is set each worker admits at most that many requests at once and sheds the
+# rest with 503; set it below the worker's thread count to keep a thread
+# free for health checks and metrics scrapes. Unset, nothing is shed: only
+# the deployment knows its real concurrency (sync worker, threads, dev server).
+
+RATE_LIMIT_ENABLED = os.getenv('RATE_LIMIT_ENABLED', 'true').lower() == 'true'
+RATE_LIMIT_STORE_PATH = os.getenv('RATE_LIMIT_STORE_PATH')  # e.g. /tmp/geocatalyst-ratelimit.db
+RATE_LIMIT_MAX_KEYS = int(os.getenv('RATE_LIMIT_MAX_KEYS', 50000))
+RATE_LIMIT_IDLE_SECONDS = 3600  # Shared-store rows untouched this long are pruned
+TRUSTED_PROXY_HOPS = int(os.getenv('TRUSTED_PROXY_HOPS', 1))  # 0 when clients connect directly
+MAX_IN_FLIGHT_REQUESTS = int(os.getenv('MAX_IN_FLIGHT_REQUESTS', 0))  # 0 disables load shedding
+ADMISSION_EXEMPT_PATHS = frozenset(['/api/health', '/api/metrics'])
+LOAD_SHED_RETRY_AFTER_SECONDS = 1
+
+RATE_LIMIT_DEFAULTS = {
+    'anonymous': (30, 0.5),
+    'student': (60, 1.0),
+    'admin': (300, 5.0)
+}
+AUTH_FAILURE_BUDGET = (20, 0.2)  # Per IP, across all routes
+RATE_LIMIT_ROUTES = {
+    'GET /api/student/videos': (20, 0.2),
+    'GET /api/student/materials': (20, 0.2),
+    'GET /api/student/materials/<material_id>': (30, 0.5),  # Each call signs a URL
+    'POST /api/student/videos/<video_id>/view': (30, 0.5),
+    'POST /api/student/doubts': (5, 1 / 60),
+    'PUT /api/student/profile': (10, 0.1)
+}
+
+RATE_LIMITED = Counter(
+    'geocatalyst_rate_limited_total', 'Requests rejected with 429 by the token buckets',
+    ['route', 'scope']
+)
+LOAD_SHED = Counter(
+    'geocatalyst_load_shed_total', 'Requests rejected with 503 by the in-flight limit'
+)
+
+
+class TokenBucketStore:
+    """In-process token buckets, least recently used keys evicted past max_keys"""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, capacity, refill_per_second, cost=1):
+        """
+        Spend cost tokens if at least one is available (cost=0 only checks).
+        Returns 0 if allowed, else seconds until a token is available.
+        """
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated_at = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated_at) * refill_per_second)
+            retry_after = 0 if tokens >= 1 else (1 - tokens) / refill_per_second
+            self._buckets[key] = (tokens - cost if tokens >= 1 else tokens, now)
+            self._buckets.move_to_end(key)
+            while len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+        return retry_after
+
+
+class SqliteTokenBucketStore:
+    """
+    Token buckets in a local SQLite file, so every gunicorn worker on the host
+    draws from the same budget. Each take is one IMMEDIATE transaction; on any
+    database error the request is allowed (fail open) rather than rejected.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+
+    def _connection(self):
+        # Per thread and per process: sqlite connections must not cross a fork
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=1, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=OFF')
+            connection.execute(
+                'CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL, updated_at REAL)'
+            )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def take(self, key, capacity, refill_per_second, cost=1):
+        now = time.time()
+        try:
+            connection = self._connection()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                row = connection.execute('SELECT tokens, updated_at FROM buckets WHERE key = ?', (key,)).fetchone()
+                tokens, updated_at = row if row else (capacity, now)
+                tokens = min(capacity, tokens + max(0, now - updated_at) * refill_per_second)
+                retry_after = 0 if tokens >= 1 else (1 - tokens) / refill_per_second
+                connection.execute(
+                    'INSERT OR REPLACE INTO buckets (key, tokens, updated_at) VALUES (?, ?, ?)',
+                    (key, tokens - cost if tokens >= 1 else tokens, now)
+                )
+                if random.random() < 0.001:
+                    connection.execute('DELETE FROM buckets WHERE updated_at < ?', (now - RATE_LIMIT_IDLE_SECONDS,))
+                connection.execute('COMMIT')
+            except Exception:
+                connection.execute('ROLLBACK')
+                raise
+            return retry_after
+        except sqlite3.Error as e:
+            logger.warning(f"Rate limit store unavailable, allowing request: {e}")
+            return 0
+
+
+rate_limit_store = SqliteTokenBucketStore(RATE_LIMIT_STORE_PATH) if RATE_LIMIT_STORE_PATH else TokenBucketStore(RATE_LIMIT_MAX_KEYS)
+admission_slots = threading.BoundedSemaphore(MAX_IN_FLIGHT_REQUESTS) if MAX_IN_FLIGHT_REQUESTS > 0 else None
+
+
+# X-Forwarded-For is client-controlled except for the hops our own proxies
+# append, so only those are trusted; request.remote_addr is then the client.
+app.wsgi_app = ProxyFix(app.wsgi_app, x_for=TRUSTED_PROXY_HOPS)
+
+
+def client_ip():
+    return request.remote_addr or 'unknown'
+
+
+def too_many_requests(retry_after, scope):
+    RATE_LIMITED.labels(metrics_route(), scope).inc()
+    response = jsonify({'error': 'Too many requests', 'retryAfter': math.ceil(retry_after)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(math.ceil(retry_after))
+    return response
+
+
+def rate_limit_response(principal, role):
+    """
+    Spend a token from principal's bucket for the current route.
+    Returns a 429 response when the bucket is empty, else None.
+    """
+    if not RATE_LIMIT_ENABLED:
+        return None
+
+    route = f"{request.method} {metrics_route()}"
+    capacity, refill_per_second = RATE_LIMIT_ROUTES.get(route, RATE_LIMIT_DEFAULTS[role])
+    retry_after = rate_limit_store.take(f'{principal}|{route}', capacity, refill_per_second)
+    return too_many_requests(retry_after, role) if retry_after else None
+
+
+def record_auth_failure():
+    """Spend from the caller IP's auth-failure bucket (checked in admit_request)"""
+    if RATE_LIMIT_ENABLED:
+        rate_limit_store.take(f'ip:{client_ip()}|auth-failures', *AUTH_FAILURE_BUDGET)
+
+
+@app.before_request
+def admit_request():
+    """Shed load past the in-flight limit, and rate limit unauthenticated calls by IP"""
+    if request.method == 'OPTIONS' or request.path in ADMISSION_EXEMPT_PATHS:
+        return None
+
+    if admission_slots is not None and not admission_slots.acquire(blocking=False):
+        LOAD_SHED.inc()
+        logger.warning(f"Shedding {request.method} {request.path}: {MAX_IN_FLIGHT_REQUESTS} requests in flight")
+        response = jsonify({'error': 'Server busy, please retry'})
+        response.status_code = 503
+        response.headers['Retry-After'] = str(LOAD_SHED_RETRY_AFTER_SECONDS)
+        return response
+    g.admission_slot = admission_slots is not None
+
+    if 'Authorization' not in request.headers:
+        return rate_limit_response(f'ip:{client_ip()}', 'anonymous')
+
+    # No uid yet: refuse IPs whose recent tokens kept failing, without
+    # spending (cost=0); valid tokens are then limited by uid in the decorators
+    if RATE_LIMIT_ENABLED:
+        retry_after = rate_limit_store.take(f'ip:{client_ip()}|auth-failures', *AUTH_FAILURE_BUDGET, cost=0)
+        if retry_after:
+            return too_many_requests(retry_after, 'authFailures')
+    return None
+
+
+@app.teardown_request
+def release_admission_slot(error=None):
+    if g.pop('admission_slot', None):
+        admission_slots.release()
+
+# ===================================
+# SINGLE-FLIGHT REQUEST COALESCING
+# ===================================
+# Identical read requests that arrive while one is already being computed
+# wait for it and get a copy of its response instead of repeating the same
+# Firestore queries. The key is the route, its URL and normalized query
+# args, and a scope naming everything else the response depends on: the
+# admin role, or the student's entitlement as check_user_access sees it.
+# Only concurrent requests share work; nothing is kept once the leader
+# finishes. Coalescing is per worker process and only happens between its
+# threads, so it needs GUNICORN_THREADS > 1 (gunicorn.conf.py defaults to 4);
+# the dev server is threaded already.
+
+SINGLE_FLIGHT_ENABLED = os.getenv('SINGLE_FLIGHT_ENABLED', 'true').lower() == 'true'
+SINGLE_FLIGHT_TIMEOUT_SECONDS = float(os.getenv('SINGLE_FLIGHT_TIMEOUT_SECONDS', 30))
+FULL_ACCESS_PACKAGES = frozenset(['Master Package', 'Test Series'])
+
+SINGLE_FLIGHT_REQUESTS = Counter(
+    'geocatalyst_single_flight_requests_total',
+    'Coalescable requests by outcome: leader computed, follower shared, timeout computed alone',
+    ['route', 'outcome']
+)
+
+
+class Flight:
+    """One in-progress computation and the requests waiting on it"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.response = None  # (body, status, headers)
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, compute):
+        """
+        Return compute()'s response, or a copy of the one an identical
+        in-flight call produces. Exceptions raised by the leader are
+        re-raised in every follower.
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = Flight()
+
+        route = key[0]
+        if not leader:
+            if flight.done.wait(SINGLE_FLIGHT_TIMEOUT_SECONDS):
+                SINGLE_FLIGHT_REQUESTS.labels(route, 'follower').inc()
+                if flight.error is not None:
+                    raise flight.error
+                body, status, headers = flight.response
+                # Each follower gets its own Response; after_request hooks mutate headers
+                return Response(body, status=status, headers=headers)
+            SINGLE_FLIGHT_REQUESTS.labels(route, 'timeout').inc()
+            logger.warning(f"Single-flight wait timed out on {route}, computing independently")
+            return compute()
+
+        SINGLE_FLIGHT_REQUESTS.labels(route, 'leader').inc()
+        try:
+            response = app.make_response(compute())
+            flight.response = (response.get_data(), response.status_code, list(response.headers))
+            return response
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.done.set()
+
+
+single_flight = SingleFlight()
+
+
+def admin_scope():
+    """Admin reads do not depend on which active admin asks"""
+    return 'admin'
+
+
+def student_entitlement_scope():
+    """The part of request.user_data that check_user_access reads"""
+    subjects = set()
+    for sub in request.user_data.get('subscriptions', []):
+        if not sub.get('isActive', False):
+            continue
+        if sub.get('subject') in FULL_ACCESS_PACKAGES:
+            return 'all'
+        subjects.add(sub.get('subject'))
+    return ','.join(sorted(str(subject) for subject in subjects))
+
+
+def coalesce_requests(scope):
+    """
+    Decorator (placed under the auth decorator) sharing one computation
+    among identical concurrent requests; scope() names the caller's view
+    of the data.
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            if not SINGLE_FLIGHT_ENABLED:
+                return f(*args, **kwargs)
+            query = tuple(sorted(
+                (name, tuple(value for value in values if value))
+                for name, values in request.args.lists()
+                if any(values)
+            ))
+            key = (metrics_route(), request.path, query, scope())
+            return single_flight.run(key, lambda: f(*args, **kwargs))
+        return decorated_function
+    return decorator
+
 # ============================================
 # FIREBASE INITIALIZATION
 # ============================================
+# Nothing is created at import time. The Firebase app is initialized on first
+# use, and the Firestore and Storage clients are built per process (pid-checked)
+# so their channels are never inherited across a gunicorn fork (--preload safe).
 
 # Check if credentials are in environment variable (Render deployment)
 FIREBASE_CREDENTIALS = os.environ.get('FIREBASE_CREDENTIALS')
+FIREBASE_STORAGE_BUCKET = os.getenv('FIREBASE_STORAGE_BUCKET', 'geocatalyst-production.firebasestorage.app')
 
-try:
-    if FIREBASE_CREDENTIALS:
-        # Production: Credentials are in environment variable
-        import json
-        credentials_dict = json.loads(FIREBASE_CREDENTIALS)
-        cred = credentials.Certificate(credentials_dict)
-        print("✅ Using Firebase credentials from environment variable")
-    else:
-        # Development: Credentials are in file
-        FIREBASE_CREDENTIALS_PATH = os.environ.get('FIREBASE_CREDENTIALS_PATH', 'firebase-admin-key.json')
-        cred = credentials.Certificate(FIREBASE_CREDENTIALS_PATH)
-        print(f"✅ Using Firebase credentials from file: {FIREBASE_CREDENTIALS_PATH}")
-    
-    # Initialize Firebase with the credentials
-    firebase_admin.initialize_app(cred, {
-        'storageBucket': 'geocatalyst-production.firebasestorage.app'
-    })
-    db = firestore.client()
-    bucket = storage.bucket()
-    print("✅ Firebase Admin SDK initialized successfully")
-except Exception as e:
-    print(f"⚠️ Firebase initialization error: {e}")
-    db = None
-    bucket = None
+_firebase_init_lock = threading.Lock()
+
+
+def get_firebase_app():
+    """The default Firebase app, initialized from env or file credentials on first call"""
+    try:
+        return firebase_admin.get_app()
+    except ValueError:
+        pass
+
+    with _firebase_init_lock:
+        try:
+            return firebase_admin.get_app()
+        except ValueError:
+            pass
+
+        if FIREBASE_CREDENTIALS:
+            # Production: Credentials are in environment variable
+            cred = credentials.Certificate(json.loads(FIREBASE_CREDENTIALS))
+            logger.info("Using Firebase credentials from environment variable")
+        else:
+            # Development: Credentials are in file
+            FIREBASE_CREDENTIALS_PATH = os.environ.get('FIREBASE_CREDENTIALS_PATH', 'firebase-admin-key.json')
+            cred = credentials.Certificate(FIREBASE_CREDENTIALS_PATH)
+            logger.info(f"Using Firebase credentials from file: {FIREBASE_CREDENTIALS_PATH}")
+
+        # Initialize Firebase with the credentials
+        firebase_app = firebase_admin.initialize_app(cred, {
+            'storageBucket': FIREBASE_STORAGE_BUCKET
+        })
+        logger.info("Firebase Admin SDK initialized successfully")
+        return firebase_app
+
+
+LAZY_CLIENT_RETRY_SECONDS = 30  # After a failed build, callers fail fast until this passes
+
+
+class LazyProcessClient:
+    """Stands in for a client object, building the real one on first use in each process"""
+
+    def __init__(self, name, factory):
+        self._name = name
+        self._factory = factory
+        self._client = None
+        self._pid = None
+        self._error = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def initialized(self):
+        """True once this process has built the client (never triggers a build)"""
+        return self._client is not None and self._pid == os.getpid()
+
+    @property
+    def status(self):
+        if self.initialized:
+            return 'ready'
+        if self._error is not None and self._pid == os.getpid():
+            return 'failed'
+        return 'notInitialized'
+
+    def resolve(self):
+        client = self._client
+        if client is not None and self._pid == os.getpid():
+            return client
+        with self._lock:
+            if self._client is not None and self._pid == os.getpid():
+                return self._client
+            if (self._error is not None and self._pid == os.getpid()
+                    and time.monotonic() - self._failed_at < LAZY_CLIENT_RETRY_SECONDS):
+                raise RuntimeError(f"{self._name} unavailable: {self._error}")
+            self._pid = os.getpid()
+            try:
+                self._client = self._factory()
+            except Exception as e:
+                self._client = None
+                self._error = str(e)
+                self._failed_at = time.monotonic()
+                logger.warning(f"{self._name} unavailable: {e}")  # Once per retry window
+                raise
+            self._error = None
+            logger.info(f"{self._name} client created in process {self._pid}")
+            return self._client
+
+    def reset(self):
+        with self._lock:
+            self._client = None
+            self._pid = None
+            self._error = None
+            self._failed_at = None
+
+    def __getattr__(self, attr):
+        return getattr(self.resolve(), attr)
+
+    def __bool__(self):
+        # Keeps the existing "if not bucket:" availability checks working
+        try:
+            self.resolve()
+            return True
+        except Exception:
+            return False  # resolve() already logged the failure
+
+
+def _create_firestore_client():
+    firebase_app = get_firebase_app()
+    return firestore.Client(project=firebase_app.project_id, credentials=firebase_app.credential.get_credential())
+
+
+def _create_storage_bucket():
+    firebase_app = get_firebase_app()
+    client = gcs_storage.Client(project=firebase_app.project_id, credentials=firebase_app.credential.get_credential())
+    return client.bucket(firebase_app.options.get('storageBucket'))
+
+
+db = LazyProcessClient('Firestore', _create_firestore_client)
+bucket = LazyProcessClient('Storage', _create_storage_bucket)
+
+
+def reset_firebase_clients():
+    """Forget clients built before a fork (called from gunicorn's post_fork)"""
+    db.reset()
+    bucket.reset()
+
+# ===================================
+# FIRESTORE OPERATION TRACING
+# ===================================
+# The Firestore client classes are wrapped once per process. While a
+# request is active, every RPC they issue is recorded on that request's
+# FirestoreTrace: documents read and written, RPC round trips and time.
+# Responses carry X-Firestore-* and Server-Timing headers. Repeated point
+# reads on one collection are reported as a likely N+1, and slow requests
+# log their full operation trace. Outside a request (background threads)
+# the wrappers only add one ContextVar lookup.
+
+FIRESTORE_TRACE_ENABLED = os.getenv('FIRESTORE_TRACE_ENABLED', 'true').lower() == 'true'
+FIRESTORE_N_PLUS_ONE_THRESHOLD = int(os.getenv('FIRESTORE_N_PLUS_ONE_THRESHOLD', 5))
+SLOW_REQUEST_MS = int(os.getenv('SLOW_REQUEST_MS', 1000))
+FIRESTORE_TRACE_MAX_OPS = 200  # Per request, keeps the slow log bounded
+
+
+class FirestoreTrace:
+    """Firestore usage of one request"""
+
+    def __init__(self):
+        self.started_at = time.perf_counter()
+        self.reads = 0
+        self.writes = 0
+        self.rpcs = 0
+        self.rpc_seconds = 0.0
+        self.point_reads = {}  # collection path -> DocumentReference.get() calls
+        self.ops = []
+
+    def record(self, op, path, reads=0, writes=0, seconds=0.0):
+        self.rpcs += 1
+        self.reads += reads
+        self.writes += writes
+        self.rpc_seconds += seconds
+        if op == 'get':
+            self.point_reads[path] = self.point_reads.get(path, 0) + 1
+        if len(self.ops) < FIRESTORE_TRACE_MAX_OPS:
+            self.ops.append({'op': op, 'path': path, 'reads': reads, 'writes': writes, 'ms': round(seconds * 1000, 1)})
+
+
+current_firestore_trace = contextvars.ContextVar('current_firestore_trace', default=None)
+
+
+def _query_path(query):
+    parent = getattr(query, '_parent', None)
+    return getattr(parent, 'id', None) or '?'
+
+
+def _collection_of(document_ref):
+    return document_ref.path.rsplit('/', 1)[0]
+
+
+def _traced_iterator(trace, op, path, iterator, fixed_reads=None):
+    started = time.perf_counter()
+    docs = 0
+    try:
+        for item in iterator:
+            docs += 1
+            yield item
+    finally:
+        # An empty query is still billed one read
+        reads = fixed_reads if fixed_reads is not None else max(docs, 1)
+        trace.record(op, path, reads=reads, seconds=time.perf_counter() - started)
+
+
+async def _traced_async_iterator(trace, op, path, iterator, fixed_reads=None):
+    started = time.perf_counter()
+    docs = 0
+    try:
+        async for item in iterator:
+            docs += 1
+            yield item
+    finally:
+        reads = fixed_reads if fixed_reads is not None else max(docs, 1)
+        trace.record(op, path, reads=reads, seconds=time.perf_counter() - started)
+
+
+def _trace_document_get(original):
+    @wraps(original)
+    def get(self, *args, **kwargs):
+        trace = current_firestore_trace.get()
+        if trace is None:
+            return original(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            trace.record('get', _collection_of(self), reads=1, seconds=time.perf_counter() - started)
+    return get
+
+
+def _trace_async_document_get(original):
+    @wraps(original)
+    async def get(self, *args, **kwargs):
+        trace = current_firestore_trace.get()
+        if trace is None:
+            return await original(self, *args, **kwargs)
+        started = time.perf_counter()
+        try:
+            return await original(self, *args, **kwargs)
+        finally:
+            trace.record('get', _collection_of(self), reads=1, seconds=time.perf_counter() - started)
+    return get
+
+
+def _trace_query_stream(original, is_async=False):
+    @wraps(original)
+    def stream(self, *args, **kwargs):
+        trace = current_firestore_trace.get()
+        if trace is None:
+            return original(self, *args, **kwargs)
+        wrap = _traced_async_iterator if is_async else _traced_iterator
+        return wrap(trace, 'query', _query_path(self), original(self, *args, **kwargs))
+    return stream
+
+
+def _trace_get_all(original, is_async=False):
+    @wraps(original)
+    def get_all(self, references, *args, **kwargs):
+        trace = current_firestore_trace.get()
+        if trace is None:
+            return original(self, references, *args, **kwargs)
+        references = list(references)
+        path = ','.join(sorted({_collection_of(ref) for ref in references})) or '?'
+        wrap = _traced_async_iterator if is_async else _traced_iterator
+        return wrap(trace, 'get_all', path, original(self, references, *args, **kwargs), fixed_reads=len(references))
+    return get_all
+
+
+def _trace_commit(original, op):
+    @wraps(original)
+    def commit(self, *args, **kwargs):
+        trace = current_firestore_trace.get()
+        if trace is None:
+            return original(self, *args, **kwargs)
+        writes = len(getattr(self, '_write_pbs', ()))
+        started = time.perf_counter()
+        try:
+            return original(self, *args, **kwargs)
+        finally:
+            trace.record(op, '-', writes=writes, seconds=time.perf_counter() - started)
+    return commit
+
+
+def install_firestore_tracing():
+    """Wrap the sync and async client classes (idempotent)"""
+    from google.cloud.firestore_v1 import (
+        async_client, async_document, async_query, batch, client, document, query, transaction
+    )
+    if getattr(document.DocumentReference.get, '_firestore_traced', False):
+        return
+    patches = [
+        (document.DocumentReference, 'get', _trace_document_get),
+        (query.Query, 'stream', _trace_query_stream),
+        (client.Client, 'get_all', _trace_get_all),
+        (batch.WriteBatch, 'commit', lambda fn: _trace_commit(fn, 'commit')),
+        (transaction.Transaction, '_commit', lambda fn: _trace_commit(fn, 'transaction')),
+        (async_document.AsyncDocumentReference, 'get', _trace_async_document_get),
+        (async_query.AsyncQuery, 'stream', lambda fn: _trace_query_stream(fn, is_async=True)),
+        (async_client.AsyncClient, 'get_all', lambda fn: _trace_get_all(fn, is_async=True))
+    ]
+    for cls, name, wrapper in patches:
+        traced = wrapper(getattr(cls, name))
+        traced._firestore_traced = True
+        setattr(cls, name, traced)
+
+
+if FIRESTORE_TRACE_ENABLED:
+    install_firestore_tracing()
+
+
+@app.before_request
+def start_firestore_trace():
+    if FIRESTORE_TRACE_ENABLED:
+        g.firestore_trace_token = current_firestore_trace.set(FirestoreTrace())
+
+
+@app.after_request
+def report_firestore_trace(response):
+    trace = current_firestore_trace.get()
+    if trace is None:
+        return response
+
+    elapsed_ms = (time.perf_counter() - trace.started_at) * 1000
+    response.headers['X-Firestore-Reads'] = str(trace.reads)
+    response.headers['X-Firestore-Writes'] = str(trace.writes)
+    response.headers['X-Firestore-RPCs'] = str(trace.rpcs)
+    response.headers.add('Server-Timing', f'firestore;dur={trace.rpc_seconds * 1000:.1f};desc="{trace.rpcs} RPCs"')
+    response.headers.add('Server-Timing', f'app;dur={elapsed_ms:.1f}')
+
+    route = request.url_rule.rule if request.url_rule is not None else request.path
+    for collection_path, count in trace.point_reads.items():
+        if count > FIRESTORE_N_PLUS_ONE_THRESHOLD:
+            logger.warning(f"Possible N+1: {request.method} {route} made {count} point reads on '{collection_path}' - batch them with get_all")
+    if elapsed_ms > SLOW_REQUEST_MS:
+        logger.warning(f"Slow request {request.method} {route}: {elapsed_ms:.0f}ms, "
+                       f"{trace.rpcs} RPCs, {trace.reads} reads, {trace.writes} writes - trace: {json.dumps(trace.ops)}")
+    return response
+
+
+@app.teardown_request
+def end_firestore_trace(error=None):
+    token = g.pop('firestore_trace_token', None)
+    if token is not None:
+        current_firestore_trace.reset(token)
 
 # ===================================
 # CLOUDFLARE STREAM CONFIGURATION
@@ -131,60 +978,1076 @@ except Exception as e:
 
 CLOUDFLARE_ACCOUNT_ID = os.getenv('CLOUDFLARE_ACCOUNT_ID')
 CLOUDFLARE_API_TOKEN = os.getenv('CLOUDFLARE_API_TOKEN')
-CLOUDFLARE_STREAM_API_URL = 'https://api.cloudflare.com/client/v4/accounts'
+CLOUDFLARE_STREAM_API_URL = os.getenv('CLOUDFLARE_STREAM_API_URL', 'https://api.cloudflare.com/client/v4/accounts')
 
 BACKEND_PUBLIC_URL = os.getenv('BACKEND_PUBLIC_URL')
 if not BACKEND_PUBLIC_URL:
-    print("⚠️ WARNING: BACKEND_PUBLIC_URL is not set in .env. Uploads will likely fail.")
+    logger.warning("BACKEND_PUBLIC_URL is not set in .env. Uploads will likely fail.")
+
+# ===================================
+# OUTBOUND HTTP CLIENT
+# ===================================
+# Every call to an external API goes through http_client: one keep-alive
+# connection pool per host, retries with jittered exponential backoff for
+# idempotent methods, default timeouts and per-host usage counters.
+
+OUTBOUND_POOL_SIZE = int(os.getenv('OUTBOUND_POOL_SIZE', int(os.getenv('GUNICORN_THREADS', 1)) + 2))
+OUTBOUND_MAX_HOSTS = int(os.getenv('OUTBOUND_MAX_HOSTS', 10))
+OUTBOUND_RETRIES = int(os.getenv('OUTBOUND_RETRIES', 3))
+OUTBOUND_BACKOFF_FACTOR = float(os.getenv('OUTBOUND_BACKOFF_FACTOR', 0.5))
+OUTBOUND_TIMEOUT = (
+    float(os.getenv('OUTBOUND_CONNECT_TIMEOUT_SECONDS', 5)),
+    float(os.getenv('OUTBOUND_READ_TIMEOUT_SECONDS', 30))
+)
+OUTBOUND_RETRY_STATUSES = frozenset([429, 500, 502, 503, 504])
+IDEMPOTENT_METHODS = frozenset(['GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'])
+
+
+class JitteredRetry(Retry):
+    """urllib3 Retry with 'full jitter': sleep a random time up to the backoff"""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class OutboundHTTPClient:
+    """
+    Pooled, retrying requests.Session wrapper with per-host metrics.
+
+    Pass retry=False for requests whose body is a stream: a consumed
+    stream cannot be replayed, so those go through a single-attempt pool.
+    """
+
+    def __init__(self, pool_size, max_hosts, retries, backoff_factor, timeout):
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.session, self._adapter = self._build_session(max_hosts, JitteredRetry(
+            total=retries,
+            connect=retries,
+            read=retries,
+            status=retries,
+            backoff_factor=backoff_factor,
+            status_forcelist=OUTBOUND_RETRY_STATUSES,
+            allowed_methods=IDEMPOTENT_METHODS,
+            respect_retry_after_header=True,
+            raise_on_status=False
+        ))
+        self.single_attempt_session, self._single_attempt_adapter = self._build_session(max_hosts, 0)
+        self._lock = threading.Lock()
+        self._host_stats = {}
+
+    def _build_session(self, max_hosts, max_retries):
+        session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(
+            pool_connections=max_hosts,
+            pool_maxsize=self.pool_size,
+            max_retries=max_retries
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session, adapter
+
+    def request(self, method, url, timeout=None, retry=True, **kwargs):
+        """requests.Session.request with the default timeout and accounting"""
+        session = self.session if retry else self.single_attempt_session
+        host = urlparse(url).netloc
+        with self._lock:
+            stats = self._host_stats.setdefault(host, {
+                'requests': 0, 'errors': 0, 'inFlight': 0, 'peakInFlight': 0, 'totalSeconds': 0.0
+            })
+            stats['requests'] += 1
+            stats['inFlight'] += 1
+            stats['peakInFlight'] = max(stats['peakInFlight'], stats['inFlight'])
+
+        started = time.perf_counter()
+        try:
+            response = session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            if response.status_code >= 500:
+                with self._lock:
+                    stats['errors'] += 1
+            return response
+        except requests.exceptions.RequestException:
+            with self._lock:
+                stats['errors'] += 1
+            raise
+        finally:
+            with self._lock:
+                stats['inFlight'] -= 1
+                stats['totalSeconds'] += time.perf_counter() - started
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def head(self, url, **kwargs):
+        return self.request('HEAD', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def put(self, url, **kwargs):
+        return self.request('PUT', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
+
+    def stats(self):
+        """Per-host request counters plus connection pool usage"""
+        with self._lock:
+            hosts = {host: dict(values) for host, values in self._host_stats.items()}
+
+        for adapter in (self._adapter, self._single_attempt_adapter):
+            for pool_key in list(adapter.poolmanager.pools.keys()):
+                pool = adapter.poolmanager.pools.get(pool_key)
+                if pool is None:
+                    continue
+                host = pool.host if pool.port in (None, 80, 443) else f"{pool.host}:{pool.port}"
+                pool_stats = hosts.setdefault(host, {}).setdefault('pool', {
+                    'maxSize': self.pool_size,
+                    'connectionsOpened': 0,
+                    'requestsServed': 0,
+                    'idleConnections': 0
+                })
+                pool_stats['connectionsOpened'] += pool.num_connections
+                pool_stats['requestsServed'] += pool.num_requests
+                pool_stats['idleConnections'] += pool.pool.qsize() if pool.pool is not None else 0
+        return hosts
+
+
+http_client = OutboundHTTPClient(
+    OUTBOUND_POOL_SIZE,
+    OUTBOUND_MAX_HOSTS,
+    OUTBOUND_RETRIES,
+    OUTBOUND_BACKOFF_FACTOR,
+    OUTBOUND_TIMEOUT
+)
+
+# ===================================
+# WRITE-BEHIND TELEMETRY BUFFER
+# ===================================
+
+TELEMETRY_FLUSH_INTERVAL = float(os.getenv('TELEMETRY_FLUSH_INTERVAL_SECONDS', 5))
+TELEMETRY_FLUSH_MAX_EVENTS = int(os.getenv('TELEMETRY_FLUSH_MAX_EVENTS', 200))
+FIRESTORE_BATCH_LIMIT = 500  # Firestore max operations per batch commit
+
+
+class IncrementBuffer:
+    """
+    Coalesces counter increments in memory and flushes them as batched
+    firestore.Increment writes.
+
+    Increments are aggregated per (collection, document) and per field, so
+    100 views of the same video become a single write of Increment(100).
+    A background thread flushes every TELEMETRY_FLUSH_INTERVAL seconds, an
+    enqueue that reaches TELEMETRY_FLUSH_MAX_EVENTS wakes it early, and an
+    atexit hook drains whatever is left when the worker shuts down.
+    """
+
+    def __init__(self, flush_interval, max_events):
+        self.flush_interval = flush_interval
+        self.max_events = max_events
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._pending = {}  # (collection, doc_id) -> {field_path: delta}
+        self._event_count = 0
+        self._thread = None
+        self._pid = None
+
+    def increment(self, collection, doc_id, fields):
+        """Queue {field_path: delta} increments for collection/doc_id"""
+        with self._lock:
+            doc_fields = self._pending.setdefault((collection, doc_id), {})
+            for field_path, delta in fields.items():
+                if not delta:
+                    continue
+                doc_fields[field_path] = doc_fields.get(field_path, 0) + delta
+            self._event_count += 1
+            should_wake = self._event_count >= self.max_events
+
+        self._ensure_thread()
+        if should_wake:
+            self._wake.set()
+
+    def _ensure_thread(self):
+        # Started lazily (and restarted after a fork) so each gunicorn
+        # worker owns its own flusher thread.
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='telemetry-flusher', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                logger.warning(f"Telemetry flush failed: {e}")
+
+    def _drain(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._event_count = 0
+        return pending
+
+    def _requeue(self, items):
+        with self._lock:
+            for key, fields in items:
+                doc_fields = self._pending.setdefault(key, {})
+                for field_path, delta in fields.items():
+                    doc_fields[field_path] = doc_fields.get(field_path, 0) + delta
+
+    def flush(self):
+        """Write all pending increments to Firestore, returns docs written"""
+        # Checked first so an idle process never initializes Firebase just to exit
+        if not self._pending or not db:
+            return 0
+
+        with self._flush_lock:
+            pending = self._drain()
+            items = [(key, fields) for key, fields in pending.items() if fields]
+            written = 0
+
+            for start in range(0, len(items), FIRESTORE_BATCH_LIMIT):
+                chunk = items[start:start + FIRESTORE_BATCH_LIMIT]
+                batch = db.batch()
+                for (collection, doc_id), fields in chunk:
+                    batch.update(
+                        db.collection(collection).document(doc_id),
+                        {field_path: firestore.Increment(delta) for field_path, delta in fields.items()}
+                    )
+                try:
+                    batch.commit()
+                    written += len(chunk)
+                except Exception as e:
+                    # One missing document fails the whole batch, so retry
+                    # the chunk document by document and drop the missing ones.
+                    logger.warning(f"Telemetry batch commit failed ({e}), retrying individually")
+                    written += self._flush_individually(chunk)
+
+            if written:
+                logger.info(f"Telemetry flushed: {written} document(s)")
+            return written
+
+    def _flush_individually(self, chunk):
+        written = 0
+        failed = []
+        for key, fields in chunk:
+            collection, doc_id = key
+            try:
+                db.collection(collection).document(doc_id).update(
+                    {field_path: firestore.Increment(delta) for field_path, delta in fields.items()}
+                )
+                written += 1
+            except NotFound:
+                logger.warning(f"Dropping telemetry for missing document {collection}/{doc_id}")
+            except Exception as e:
+                logger.warning(f"Telemetry write failed for {collection}/{doc_id}: {e}")
+                failed.append((key, fields))
+        if failed:
+            self._requeue(failed)
+        return written
+
+
+telemetry_buffer = IncrementBuffer(TELEMETRY_FLUSH_INTERVAL, TELEMETRY_FLUSH_MAX_EVENTS)
+atexit.register(telemetry_buffer.flush)
+
+# ===================================
+# BACKGROUND JOBS - CASCADING DELETES
+# ===================================
+
+JOBS_COLLECTION = 'backgroundJobs'
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL_SECONDS', 30))
+JOB_LEASE_SECONDS = float(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 5))
+
+# Dependent documents removed when a parent is deleted, in order.
+# '{id}' in a collection path is replaced by the deleted parent's ID;
+# a field of None means every document in that (sub)collection.
+CASCADE_DELETE_PLANS = {
+    'test': [
+        {'name': 'questions', 'collection': 'tests/{id}/questions', 'field': None},
+        {'name': 'testAttempts', 'collection': 'testAttempts', 'field': 'testId'},
+        {'name': 'testAccessGrants', 'collection': 'testAccessGrants', 'field': 'testId'},
+    ],
+    'user': [
+        {'name': 'testAttempts', 'collection': 'testAttempts', 'field': 'userId'},
+        {'name': 'doubts', 'collection': 'doubts', 'field': 'userId'},
+        {'name': 'testAccessGrants', 'collection': 'testAccessGrants', 'field': 'userId'},
+    ],
+}
+
+
+class CascadeDeleteRunner:
+    """
+    Deletes documents that depend on a deleted test or user in the background.
+
+    Each cascade is a job document in JOBS_COLLECTION that records the
+    current step and per-collection delete counts, so the admin UI can poll
+    it. Jobs are claimed with a lease; if a worker dies mid-job the lease
+    expires and any worker picks it up again from the recorded step. Every
+    page re-queries what is left, so re-running a page is harmless.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def worker_id(self):
+        return f"{socket.gethostname()}-{os.getpid()}"
+
+    def enqueue(self, kind, target_id, created_by=None):
+        """Create (or restart) the cascade job for a deleted parent"""
+        plan = CASCADE_DELETE_PLANS[kind]
+        # Deterministic ID: deleting the same parent twice reuses one job
+        job_ref = db.collection(JOBS_COLLECTION).document(f'cascade-{kind}-{target_id}')
+        job_ref.set({
+            'type': 'cascadeDelete',
+            'targetKind': kind,
+            'targetId': target_id,
+            'status': 'pending',
+            'steps': [step['name'] for step in plan],
+            'stepIndex': 0,
+            'deleted': {step['name']: 0 for step in plan},
+            'totalDeleted': 0,
+            'attempts': 0,
+            'leaseOwner': None,
+            'leaseExpiresAt': 0,
+            'error': None,
+            'createdBy': created_by,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+            'completedAt': None
+        })
+        logger.info(f"Queued cascade delete job: {job_ref.id}")
+
+        self.ensure_started()
+        self._wake.set()
+        return job_ref.id
+
+    def ensure_started(self):
+        # Started lazily (and restarted after a fork) so each gunicorn
+        # worker owns its runner; pending jobs resume once the worker's
+        # Firestore client exists (warm_up or the first request using it).
+        # Checking the flag never builds the client from this hook.
+        if not db.initialized:
+            return
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='cascade-delete-runner', daemon=True)
+            self._thread.start()
+            self._wake.set()  # Check for unfinished jobs straight away
+
+    def _run(self):
+        while True:
+            self._wake.wait(JOB_POLL_INTERVAL)
+            self._wake.clear()
+            try:
+                self.run_pending()
+            except Exception as e:
+                logger.warning(f"Cascade delete runner error: {e}")
+
+    def run_pending(self):
+        """Claim and process every job that is pending or whose lease expired"""
+        jobs_query = db.collection(JOBS_COLLECTION) \
+            .where('type', '==', 'cascadeDelete') \
+            .where('status', 'in', ['pending', 'running'])
+        for snapshot in jobs_query.stream():
+            job = self._claim(snapshot.reference)
+            if job:
+                self._process(snapshot.reference, job)
+
+    def _claim(self, job_ref):
+        worker_id = self.worker_id
+
+        @firestore.transactional
+        def claim_job(transaction):
+            snapshot = job_ref.get(transaction=transaction)
+            if not snapshot.exists:
+                return None
+            job = snapshot.to_dict()
+            if job.get('status') not in ('pending', 'running'):
+                return None
+            if (job.get('status') == 'running'
+                    and job.get('leaseOwner') != worker_id
+                    and job.get('leaseExpiresAt', 0) > time.time()):
+                return None  # Another worker holds a live lease
+
+            transaction.update(job_ref, {
+                'status': 'running',
+                'leaseOwner': worker_id,
+                'leaseExpiresAt': time.time() + JOB_LEASE_SECONDS,
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            return job
+
+        return claim_job(db.transaction())
+
+    def _process(self, job_ref, job):
+        kind = job.get('targetKind')
+        target_id = job.get('targetId')
+        plan = CASCADE_DELETE_PLANS.get(kind, [])
+
+        try:
+            for step_index in range(job.get('stepIndex', 0), len(plan)):
+                step = plan[step_index]
+                query = db.collection(step['collection'].format(id=target_id))
+                if step['field']:
+                    query = query.where(step['field'], '==', target_id)
+
+                while True:
+                    # Only document references are needed
+                    docs = list(query.select([]).limit(FIRESTORE_BATCH_LIMIT).stream())
+                    if not docs:
+                        break
+                    batch = db.batch()
+                    for doc in docs:
+                        batch.delete(doc.reference)
+                    batch.commit()
+
+                    job_ref.update({
+                        f"deleted.{step['name']}": firestore.Increment(len(docs)),
+                        'totalDeleted': firestore.Increment(len(docs)),
+                        'leaseExpiresAt': time.time() + JOB_LEASE_SECONDS,
+                        'updatedAt': firestore.SERVER_TIMESTAMP
+                    })
+
+                job_ref.update({
+                    'stepIndex': step_index + 1,
+                    'updatedAt': firestore.SERVER_TIMESTAMP
+                })
+
+            job_ref.update({
+                'status': 'completed',
+                'leaseOwner': None,
+                'leaseExpiresAt': 0,
+                'completedAt': firestore.SERVER_TIMESTAMP,
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            logger.info(f"Cascade delete job completed: {job_ref.id}")
+
+        except Exception as e:
+            attempts = job.get('attempts', 0) + 1
+            # Put the job back for a later poll until it keeps failing
+            job_ref.update({
+                'status': 'failed' if attempts >= JOB_MAX_ATTEMPTS else 'pending',
+                'attempts': attempts,
+                'error': str(e),
+                'leaseOwner': None,
+                'leaseExpiresAt': 0,
+                'updatedAt': firestore.SERVER_TIMESTAMP
+            })
+            logger.error(f"Cascade delete job {job_ref.id} failed (attempt {attempts}): {e}")
+
+
+cascade_runner = CascadeDeleteRunner()
+
+
+@app.before_request
+def start_background_workers():
+    """Make sure this worker's job runner and signing key refresher are alive"""
+    cascade_runner.ensure_started()
+    id_token_verifier.ensure_started()
+
+# ===================================
+# USER STATS RECONCILIATION
+# ===================================
+
+STATS_FLOAT_TOLERANCE = 1e-6
+STATS_REPORT_SAMPLE_SIZE = 20
+
+
+def _stat_differs(current, expected):
+    if not isinstance(current, (int, float)) or isinstance(current, bool):
+        return True
+    return abs(current - expected) > STATS_FLOAT_TOLERANCE
+
+
+def _expected_stats(tests_attempted, total_percentage_sum):
+    return {
+        'testsAttempted': tests_attempted,
+        'totalPercentageSum': total_percentage_sum,
+        'avgScore': (total_percentage_sum / tests_attempted) if tests_attempted > 0 else 0
+    }
+
+
+def _stats_drifted(stats, expected):
+    return any(_stat_differs(stats.get(field), value) for field, value in expected.items())
+
+
+@firestore.transactional
+def reconcile_user_in_transaction(transaction, user_ref):
+    """
+    Recount one user's attempts and rewrite their stats if they still differ.
+
+    The user doc and their attempts are read inside the transaction, so an
+    attempt (and its stats increment) committed since the bulk scan is
+    counted rather than overwritten. Returns True if the stats were written.
+    """
+    user_snapshot = user_ref.get(transaction=transaction)
+    if not user_snapshot.exists:
+        return False
+
+    attempts_query = db.collection('testAttempts').where('userId', '==', user_ref.id).select(['percentage'])
+    tests_attempted = 0
+    total_percentage_sum = 0.0
+    for attempt_doc in transaction.get(attempts_query):
+        tests_attempted += 1
+        total_percentage_sum += attempt_doc.to_dict().get('percentage', 0) or 0
+
+    expected = _expected_stats(tests_attempted, total_percentage_sum)
+    if not _stats_drifted(user_snapshot.to_dict().get('stats') or {}, expected):
+        return False
+
+    transaction.update(user_ref, {f'stats.{field}': value for field, value in expected.items()})
+    return True
+
+
+def reconcile_user_stats(dry_run=True, job_ref=None):
+    """
+    Recompute every user's test stats from testAttempts in a single pass.
+
+    testAttempts is streamed once and aggregated per userId in memory, then
+    users are streamed once and compared against the aggregates. The scan
+    can be minutes old by the end, so each drifted user is then re-checked
+    and written in its own transaction (reconcile_user_in_transaction);
+    nothing is written in dry-run mode. Returns a report dict.
+    """
+    last_heartbeat = [0.0]
+
+    def heartbeat(phase=None):
+        # Extends the job lease while scanning; see expire_stale_job
+        if job_ref is None:
+            return
+        if phase is None and time.time() - last_heartbeat[0] < JOB_LEASE_SECONDS / 3:
+            return
+        update = {'leaseExpiresAt': time.time() + JOB_LEASE_SECONDS, 'updatedAt': firestore.SERVER_TIMESTAMP}
+        if phase is not None:
+            update['phase'] = phase
+        job_ref.update(update)
+        last_heartbeat[0] = time.time()
+
+    def set_phase(phase):
+        heartbeat(phase)
+
+    # 1. One pass over all attempts: userId -> [count, percentage sum]
+    set_phase('scanningAttempts')
+    totals = {}
+    attempts_scanned = 0
+    for attempt_doc in db.collection('testAttempts').select(['userId', 'percentage']).stream():
+        attempt_data = attempt_doc.to_dict()
+        user_id = attempt_data.get('userId')
+        if not user_id:
+            continue
+        entry = totals.setdefault(user_id, [0, 0.0])
+        entry[0] += 1
+        entry[1] += attempt_data.get('percentage', 0) or 0
+        attempts_scanned += 1
+        heartbeat()
+
+    # 2. One pass over users, collecting only the drifted ones
+    set_phase('scanningUsers')
+    users_scanned = 0
+    drifted = []
+    for user_doc in db.collection('users').select(['stats']).stream():
+        users_scanned += 1
+        heartbeat()
+        stats = user_doc.to_dict().get('stats') or {}
+        expected = _expected_stats(*totals.get(user_doc.id, (0, 0.0)))
+        if _stats_drifted(stats, expected):
+            drifted.append((user_doc, stats, expected))
+
+    # 3. Re-check and write drifted users only, one transaction each
+    users_updated = 0
+    if not dry_run:
+        set_phase('writing')
+        for user_doc, _, _ in drifted:
+            if reconcile_user_in_transaction(db.transaction(), user_doc.reference):
+                users_updated += 1
+            heartbeat()
+
+    return {
+        'dryRun': dry_run,
+        'attemptsScanned': attempts_scanned,
+        'usersScanned': users_scanned,
+        'usersWithAttempts': len(totals),
+        'usersDrifted': len(drifted),
+        'usersUpdated': users_updated,
+        'sample': [
+            {
+                'userId': user_doc.id,
+                'current': {field: stats.get(field) for field in expected},
+                'expected': expected
+            }
+            for user_doc, stats, expected in drifted[:STATS_REPORT_SAMPLE_SIZE]
+        ]
+    }
+
+
+def run_stats_reconciliation_job(job_ref, dry_run):
+    """Thread target: run reconcile_user_stats and record the report on the job"""
+    try:
+        job_ref.update({
+            'status': 'running',
+            'leaseOwner': f"{socket.gethostname()}-{os.getpid()}",
+            'leaseExpiresAt': time.time() + JOB_LEASE_SECONDS,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        report = reconcile_user_stats(dry_run=dry_run, job_ref=job_ref)
+        job_ref.update({
+            'status': 'completed',
+            'phase': 'done',
+            'report': report,
+            'completedAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        logger.info(f"Stats reconciliation {'(dry run) ' if dry_run else ''}complete: {report['usersDrifted']} drifted, {report['usersUpdated']} updated")
+    except Exception as e:
+        job_ref.update({
+            'status': 'failed',
+            'error': str(e),
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        logger.exception(f"Stats reconciliation job {job_ref.id} failed: {e}")
+
+
+def expire_stale_job(job_doc):
+    """
+    Mark a reconciliation job failed if its worker stopped heartbeating.
+
+    These jobs run in a thread of the worker that started them, so a
+    restart leaves them 'running' forever. Reconciliation is idempotent,
+    so it is not resumed; the admin just starts a new one. Returns the
+    job data as it now stands.
+    """
+    job_data = job_doc.to_dict()
+    if (job_data.get('type') != 'statsReconciliation'
+            or job_data.get('status') not in ('pending', 'running')
+            or job_data.get('leaseExpiresAt', 0) > time.time()):
+        return job_data
+
+    update = {
+        'status': 'failed',
+        'error': 'The worker running this job stopped before it finished; start a new job',
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    }
+    try:
+        # Conditional, so a job that completes meanwhile is left alone
+        job_doc.reference.update(update, option=db.write_option(last_update_time=job_doc.update_time))
+        logger.warning(f"Stats reconciliation job {job_doc.id} lost its worker, marked failed")
+    except FailedPrecondition:
+        pass
+    return job_doc.reference.get().to_dict()
+
+
+# ===================================
+# YOUTUBE METADATA ENRICHMENT
+# ===================================
+# After a video is saved its youtubeId is queued; a background thread
+# fetches duration, thumbnails and channel through http_client and writes
+# them back to the video doc. Results are cached on disk per youtubeId,
+# so repeated IDs and re-imports never hit YouTube again.
+# With YOUTUBE_API_KEY set the Data API is used (50 IDs per call),
+# otherwise oEmbed (no duration). Both URLs can point at a local stand-in.
+
+YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY')
+YOUTUBE_DATA_API_URL = os.getenv('YOUTUBE_DATA_API_URL', 'https://www.googleapis.com/youtube/v3/videos')
+YOUTUBE_OEMBED_URL = os.getenv('YOUTUBE_OEMBED_URL', 'https://www.youtube.com/oembed')
+YOUTUBE_CACHE_DIR = os.getenv('YOUTUBE_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.cache', 'youtube'))
+YOUTUBE_CACHE_TTL_SECONDS = int(os.getenv('YOUTUBE_CACHE_TTL_DAYS', 30)) * 86400
+YOUTUBE_BATCH_SIZE = 50  # Data API maximum IDs per videos.list call
+
+ISO8601_DURATION_PATTERN = re.compile(
+    r'^P(?:(?P<days>\d+)D)?(?:T(?:(?P<hours>\d+)H)?(?:(?P<minutes>\d+)M)?(?:(?P<seconds>\d+)S)?)?$'
+)
+
+
+def parse_iso8601_duration(value):
+    """'PT1H2M3S' -> 3723 seconds (None if unparseable)"""
+    match = ISO8601_DURATION_PATTERN.match(value or '')
+    if not match:
+        return None
+    parts = {name: int(amount) for name, amount in match.groupdict().items() if amount}
+    return (parts.get('days', 0) * 86400 + parts.get('hours', 0) * 3600
+            + parts.get('minutes', 0) * 60 + parts.get('seconds', 0))
+
+
+class YouTubeMetadataCache:
+    """One JSON file per youtubeId, written atomically so workers can share it"""
+
+    def __init__(self, directory, ttl_seconds):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+
+    def _path(self, youtube_id):
+        # IDs become file names, so anything but a bare ID (e.g. '../x') is refused
+        if not isinstance(youtube_id, str) or not YOUTUBE_BARE_ID_PATTERN.fullmatch(youtube_id):
+            raise ValueError(f'Invalid YouTube video ID: {youtube_id!r}')
+        return os.path.join(self.directory, f"{youtube_id}.json")
+
+    def get(self, youtube_id):
+        try:
+            with open(self._path(youtube_id), 'r', encoding='utf-8') as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if time.time() - entry.get('cachedAt', 0) > self.ttl_seconds:
+            return None
+        return entry.get('metadata')
+
+    def set(self, youtube_id, metadata):
+        os.makedirs(self.directory, exist_ok=True)
+        tmp_path = f"{self._path(youtube_id)}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            json.dump({'cachedAt': time.time(), 'metadata': metadata}, cache_file)
+        os.replace(tmp_path, self._path(youtube_id))
+
+
+def fetch_youtube_metadata_batch(youtube_ids):
+    """Fetch metadata for up to YOUTUBE_BATCH_SIZE IDs, returns {youtubeId: metadata}"""
+    results = {}
+    if YOUTUBE_API_KEY:
+        response = http_client.get(YOUTUBE_DATA_API_URL, params={
+            'part': 'snippet,contentDetails',
+            'id': ','.join(youtube_ids),
+            'key': YOUTUBE_API_KEY
+        })
+        response.raise_for_status()
+        for item in response.json().get('items', []):
+            snippet = item.get('snippet', {})
+            results[item['id']] = {
+                'durationSeconds': parse_iso8601_duration(item.get('contentDetails', {}).get('duration')),
+                'thumbnails': {size: thumb.get('url') for size, thumb in snippet.get('thumbnails', {}).items()},
+                'channelTitle': snippet.get('channelTitle'),
+                'channelId': snippet.get('channelId'),
+                'youtubeTitle': snippet.get('title'),
+                'metadataSource': 'youtube-data-api'
+            }
+        return results
+
+    for youtube_id in youtube_ids:
+        response = http_client.get(YOUTUBE_OEMBED_URL, params={
+            'url': f'https://www.youtube.com/watch?v={youtube_id}',
+            'format': 'json'
+        })
+        if response.status_code in (401, 403, 404):
+            continue  # Private, embedding disabled or removed
+        response.raise_for_status()
+        oembed = response.json()
+        results[youtube_id] = {
+            'durationSeconds': None,  # Not provided by oEmbed
+            'thumbnails': {
+                'default': f'https://i.ytimg.com/vi/{youtube_id}/default.jpg',
+                'medium': f'https://i.ytimg.com/vi/{youtube_id}/mqdefault.jpg',
+                'high': oembed.get('thumbnail_url') or f'https://i.ytimg.com/vi/{youtube_id}/hqdefault.jpg'
+            },
+            'channelTitle': oembed.get('author_name'),
+            'channelUrl': oembed.get('author_url'),
+            'youtubeTitle': oembed.get('title'),
+            'metadataSource': 'oembed'
+        }
+    return results
+
+
+class YouTubeEnrichmentWorker:
+    """Background thread draining queued (videoDocId, youtubeId) pairs"""
+
+    def __init__(self, cache):
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    def enqueue(self, video_id, youtube_id):
+        if not isinstance(youtube_id, str) or not YOUTUBE_BARE_ID_PATTERN.fullmatch(youtube_id):
+            logger.warning(f"Not enriching video {video_id}: invalid YouTube ID {youtube_id!r}")
+            return
+        self._queue.put((video_id, youtube_id))
+        self._ensure_thread()
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='youtube-enrichment', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            pending = [self._queue.get()]
+            while len(pending) < YOUTUBE_BATCH_SIZE:
+                try:
+                    pending.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.enrich(pending)
+            except Exception as e:
+                logger.warning(f"YouTube enrichment failed for {len(pending)} video(s): {e}")
+
+    def enrich(self, pending):
+        """Resolve metadata (cache first) and write it to each video doc"""
+        metadata_by_id = {}
+        missing = []
+        for _, youtube_id in pending:
+            if youtube_id in metadata_by_id or youtube_id in missing:
+                continue
+            cached = self.cache.get(youtube_id)
+            if cached is not None:
+                metadata_by_id[youtube_id] = cached
+            else:
+                missing.append(youtube_id)
+
+        if missing:
+            fetched = fetch_youtube_metadata_batch(missing)
+            for youtube_id, metadata in fetched.items():
+                self.cache.set(youtube_id, metadata)
+            metadata_by_id.update(fetched)
+
+        updates = [
+            (db.collection('videos').document(video_id), {**metadata_by_id[youtube_id], 'metadataFetchedAt': firestore.SERVER_TIMESTAMP})
+            for video_id, youtube_id in pending
+            if youtube_id in metadata_by_id
+        ]
+        writes = len(updates)
+        if writes:
+            batch = db.batch()
+            for video_ref, fields in updates:
+                batch.update(video_ref, fields)
+            try:
+                batch.commit()
+            except NotFound:
+                # A video was deleted while queued - write the rest one by one
+                for video_ref, fields in updates:
+                    try:
+                        video_ref.update(fields)
+                    except NotFound:
+                        writes -= 1
+            logger.info(f"YouTube metadata written for {writes} video(s) ({len(missing)} fetched, {len(pending) - len(missing)} cached)")
+
+
+youtube_enrichment = YouTubeEnrichmentWorker(YouTubeMetadataCache(YOUTUBE_CACHE_DIR, YOUTUBE_CACHE_TTL_SECONDS))
 
 # ===================================
 # AUTHENTICATION MIDDLEWARE
 # ===================================
+# Firebase ID tokens are RS256 JWTs signed with Google's securetoken keys.
+# The keys are kept in memory and refreshed by a background thread ahead of
+# their Cache-Control max-age, so verifying a token is pure CPU.
+
+SECURETOKEN_CERTS_URL = os.getenv(
+    'SECURETOKEN_CERTS_URL',
+    'https://www.googleapis.com/robot/v1/metadata/x509/securetoken@system.gserviceaccount.com'
+)
+ID_TOKEN_CLOCK_SKEW_SECONDS = int(os.getenv('ID_TOKEN_CLOCK_SKEW_SECONDS', 10))
+SIGNING_KEYS_MIN_REFRESH_SECONDS = 60
+SIGNING_KEYS_RETRY_SECONDS = 30
+SIGNING_KEYS_DEFAULT_MAX_AGE = 3600
+CACHE_CONTROL_MAX_AGE_PATTERN = re.compile(r'max-age=(\d+)')
+
+
+class FirebaseTokenVerifier:
+    """Local replacement for auth.verify_id_token (same claims, plus 'uid')"""
+
+    def __init__(self, certs_url, project_id=None):
+        self.certs_url = certs_url
+        self._project_id = project_id
+        self._keys = {}
+        self._fetched_at = 0
+        self._refresh_lock = threading.Lock()
+        self._thread_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+
+    @property
+    def project_id(self):
+        if self._project_id is None:
+            self._project_id = os.getenv('FIREBASE_PROJECT_ID') or get_firebase_app().project_id
+        return self._project_id
+
+    def set_keys(self, certificates):
+        """Install {kid: PEM certificate} (also the hook for locally generated test keys)"""
+        self._keys = {
+            kid: x509.load_pem_x509_certificate(pem.encode('utf-8')).public_key()
+            for kid, pem in certificates.items()
+        }
+        self._fetched_at = time.time()
+
+    def refresh_keys(self):
+        """Fetch the current certificates, returns their max-age in seconds"""
+        with self._refresh_lock:
+            response = http_client.get(self.certs_url)
+            response.raise_for_status()
+            match = CACHE_CONTROL_MAX_AGE_PATTERN.search(response.headers.get('Cache-Control', ''))
+            self.set_keys(response.json())
+            return int(match.group(1)) if match else SIGNING_KEYS_DEFAULT_MAX_AGE
+
+    def ensure_started(self):
+        """Start this process's refresh thread (re-started after a fork)"""
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._thread_lock:
+            if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._thread = threading.Thread(target=self._run, name='id-token-keys', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                max_age = self.refresh_keys()
+                # Refresh well before the published keys expire
+                delay = max(SIGNING_KEYS_MIN_REFRESH_SECONDS, int(max_age * 0.9))
+            except Exception as e:
+                logger.warning(f"ID token signing key refresh failed: {e}")
+                delay = SIGNING_KEYS_RETRY_SECONDS
+            time.sleep(delay)
+
+    def _public_key(self, kid):
+        key = self._keys.get(kid)
+        if key is None and time.time() - self._fetched_at > SIGNING_KEYS_MIN_REFRESH_SECONDS:
+            # Cold start or a key newer than our copy - fetch once on this thread
+            self.refresh_keys()
+            key = self._keys.get(kid)
+        if key is None:
+            raise jwt.InvalidTokenError(f'ID token has an unknown key id: {kid}')
+        return key
+
+    def verify(self, token):
+        if os.getenv('FIREBASE_AUTH_EMULATOR_HOST'):
+            return auth.verify_id_token(token, app=get_firebase_app())  # Emulator tokens are unsigned
+
+        self.ensure_started()
+        header = jwt.get_unverified_header(token)
+        if header.get('alg') != 'RS256':
+            raise jwt.InvalidTokenError('ID token must be signed with RS256')
+
+        claims = jwt.decode(
+            token,
+            self._public_key(header.get('kid')),
+            algorithms=['RS256'],
+            audience=self.project_id,
+            issuer=f'https://securetoken.google.com/{self.project_id}',
+            leeway=ID_TOKEN_CLOCK_SKEW_SECONDS,
+            options={'require': ['exp', 'iat', 'aud', 'iss', 'sub']}
+        )
+
+        subject = claims['sub']
+        if not isinstance(subject, str) or not subject or len(subject) > 128:
+            raise jwt.InvalidTokenError('ID token has an invalid subject')
+        # PyJWT only checks iat is numeric, so issued-in-the-future is checked here
+        if claims['iat'] > time.time() + ID_TOKEN_CLOCK_SKEW_SECONDS:
+            raise jwt.ImmatureSignatureError('ID token iat is in the future')
+        if claims.get('auth_time', 0) > time.time() + ID_TOKEN_CLOCK_SKEW_SECONDS:
+            raise jwt.InvalidTokenError('ID token auth_time is in the future')
+
+        claims['uid'] = subject
+        return claims
+
+
+id_token_verifier = FirebaseTokenVerifier(SECURETOKEN_CERTS_URL)
+
+# Verified token claims are cached (keyed by a SHA-256 of the token) until
+# the token's own exp, and admin/user docs for PRINCIPAL_CACHE_TTL_SECONDS.
+# Both caches are per process: writes through this API invalidate the local
+# entry, and the short TTL bounds staleness in other workers.
+
+AUTH_TOKEN_CACHE_SIZE = int(os.getenv('AUTH_TOKEN_CACHE_SIZE', 4096))
+PRINCIPAL_CACHE_SIZE = int(os.getenv('PRINCIPAL_CACHE_SIZE', 4096))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv('PRINCIPAL_CACHE_TTL_SECONDS', 30))
+
+
+class ExpiringLRUCache:
+    """Bounded LRU where every entry carries its own absolute expiry (epoch seconds)"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+verified_token_cache = ExpiringLRUCache(AUTH_TOKEN_CACHE_SIZE)
+principal_cache = ExpiringLRUCache(PRINCIPAL_CACHE_SIZE)
+
+
+def verify_id_token_cached(token):
+    """Verify a token, skipped while a previous verification of the same token is unexpired"""
+    token_key = hashlib.sha256(token.encode('utf-8')).hexdigest()
+    decoded_token = verified_token_cache.get(token_key)
+    if decoded_token is None:
+        decoded_token = id_token_verifier.verify(token)
+        verified_token_cache.set(token_key, decoded_token, decoded_token['exp'])
+    return decoded_token
+
+
+def get_principal(collection, uid):
+    """admins/{uid} or users/{uid} as a dict (None if missing), cached briefly"""
+    principal = principal_cache.get((collection, uid))
+    if principal is None:
+        principal_doc = db.collection(collection).document(uid).get()
+        if not principal_doc.exists:
+            return None  # Not cached, so a doc created right after sign-up is seen at once
+        principal = principal_doc.to_dict()
+        principal_cache.set((collection, uid), principal, time.time() + PRINCIPAL_CACHE_TTL_SECONDS)
+    return dict(principal)
+
+
+def invalidate_principal(collection, *uids):
+    """Drop cached principal docs after they are written or deleted"""
+    for uid in uids:
+        if uid:
+            principal_cache.pop((collection, uid))
+
 
 def require_auth(f):
     """Decorator to require admin authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Allow OPTIONS requests without authentication (CORS preflight)
-        if request.method == 'OPTIONS':
-            # This is the preflight request. We must send back the
-            # same CORS headers that our @after_request hook would.
-            response = Response("", 204) # Create an empty response
-            
-            # Get the origin from the request
-            origin = request.headers.get('Origin')
-            
-            # Use the same allowed list as your @after_request
-            allowed_origins = [
-                "https://literate-capybara-5gxqv4r6prvjf4x4r-5500.app.github.dev",
-                "https://literate-capybara-5gxqv4r6prvjf4x4r-5000.app.github.dev",
-                "https://geocatalyst-admin.web.app",  # Firebase production - ADMIN
-                "https://geocatalyst-admin.firebaseapp.com",  # Firebase alternative - ADMIN
-                "http://localhost:5500",
-                "http://127.0.0.1:5500",
-                os.getenv('FRONTEND_URL', '')
-            ]
-            
-            if origin in allowed_origins:
-                response.headers['Access-Control-Allow-Origin'] = origin
-                response.headers['Access-Control-Allow-Credentials'] = 'true'
-                response.headers['Access-Control-Allow-Methods'] = 'GET,POST,PUT,DELETE,OPTIONS,HEAD,PATCH'
-                
-                # These headers are what the browser is ASKING PERMISSION FOR
-                response.headers['Access-Control-Allow-Headers'] = (
-                    'Content-Type,Authorization,Tus-Resumable,Upload-Length,'
-                    'Upload-Metadata,Upload-Offset,Upload-Concat,X-Requested-With'
-                )
-                
-                # These headers are what the browser will be ALLOWED TO READ
-                response.headers['Access-Control-Expose-Headers'] = (
-                    'Location,Upload-Offset,Upload-Length,Tus-Resumable,'
-                    'Tus-Version,Tus-Extension,stream-media-id,X-Video-UID'
-                )
-            
-            return response # Return the new response with headers
-        
-        # --- This is the original auth logic for non-OPTIONS requests ---
+        # OPTIONS preflights never get here - see answer_cors_preflight
         auth_header = request.headers.get('Authorization')
         
         if not auth_header:
@@ -192,23 +2055,33 @@ def require_auth(f):
         
         try:
             token = auth_header.split('Bearer ')[1] if 'Bearer ' in auth_header else auth_header
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = verify_id_token_cached(token)
             uid = decoded_token['uid']
-            
-            admin_ref = db.collection('admins').document(uid)
-            admin_doc = admin_ref.get()
-            
-            if not admin_doc.exists or not admin_doc.to_dict().get('isActive', False):
-                return jsonify({'error': 'Unauthorized - Admin access required'}), 403
-            
-            request.uid = uid
-            request.admin_data = admin_doc.to_dict()
-            
-            return f(*args, **kwargs)
-            
         except Exception as e:
-            print(f"Auth error: {str(e)}")
+            logger.warning(f"Auth error: {str(e)}")
+            record_auth_failure()
             return jsonify({'error': 'Invalid or expired token'}), 401
+        
+        try:
+            admin_data = get_principal('admins', uid)
+        except Exception as e:
+            # Firestore trouble is not the caller's fault: no auth-failure charge
+            logger.exception(f"Admin lookup failed for {uid}: {str(e)}")
+            return jsonify({'error': 'Authentication service unavailable'}), 503
+        
+        if not admin_data or not admin_data.get('isActive', False):
+            record_auth_failure()
+            return jsonify({'error': 'Unauthorized - Admin access required'}), 403
+        
+        request.uid = uid
+        request.admin_data = admin_data
+        
+        limited = rate_limit_response(f'uid:{uid}', 'admin')
+        if limited is not None:
+            return limited
+        
+        # Outside the try blocks: view errors are the view's to handle
+        return f(*args, **kwargs)
     
     return decorated_function
 
@@ -223,171 +2096,215 @@ def health_check():
         'status': 'healthy',
         'timestamp': datetime.utcnow().isoformat(),
         'service': 'GeoCatalyst Admin API',
-        'firebase': db is not None,
+        'firebase': db.status,  # ready / failed / notInitialized (never triggers a build)
         'cloudflare': bool(CLOUDFLARE_ACCOUNT_ID and CLOUDFLARE_API_TOKEN)
     }), 200
 
+
+@app.route('/api/admin/outbound-stats', methods=['GET'])
+@require_auth
+def get_outbound_stats():
+    """Per-host outbound HTTP counters and connection pool usage"""
+    return jsonify({
+        'poolSize': http_client.pool_size,
+        'hosts': http_client.stats()
+    }), 200
+
+# ===================================
+# STREAMING HELPERS
+# ===================================
+
+STREAM_BLOCK_SIZE = 64 * 1024
+
+
+class BoundedStream:
+    """
+    Sized iterable over the next `length` bytes of a request body stream.
+
+    Having __len__ lets requests send a Content-Length instead of chunked
+    encoding, and since there is no read() the HTTP client iterates it,
+    so at most one `block_size` block is in memory at a time.
+    """
+
+    def __init__(self, stream, length, block_size=STREAM_BLOCK_SIZE):
+        self._stream = stream
+        self._length = length
+        self._block_size = block_size
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        remaining = self._length
+        while remaining > 0:
+            block = self._stream.read(min(self._block_size, remaining))
+            if not block:
+                return
+            remaining -= len(block)
+            yield block
+
+
 # ===================================
 # VIDEO UPLOAD - TUS PROXY ENDPOINT
-# ✅ THIS IS THE NEW IMPLEMENTATION
 # ===================================
 
-# @app.route('/api/tus-upload-endpoint', defaults={'cf_path': ''}, methods=['POST', 'OPTIONS', 'HEAD', 'PATCH'])
-# @app.route('/api/tus-upload-endpoint/<path:cf_path>', methods=['POST', 'OPTIONS', 'HEAD', 'PATCH'])
-# @require_auth
-# def tus_upload_proxy(cf_path):
-#     """
-#     TUS Upload Proxy Endpoint
+TUS_PROXY_CHUNK_SIZE = int(os.getenv('TUS_PROXY_CHUNK_SIZE_KB', 256)) * 1024
+CLOUDFLARE_TUS_EDGE_URL = os.getenv('CLOUDFLARE_TUS_EDGE_URL', 'https://edge-production.gateway.api.cloudflare.com')
+
+
+@app.route('/api/tus-upload-endpoint', defaults={'cf_path': ''}, methods=['POST', 'OPTIONS', 'HEAD', 'PATCH'])
+@app.route('/api/tus-upload-endpoint/<path:cf_path>', methods=['POST', 'OPTIONS', 'HEAD', 'PATCH'])
+@require_auth
+def tus_upload_proxy(cf_path):
+    """
+    TUS Upload Proxy Endpoint
     
-#     This endpoint acts as a proxy between the TUS client and Cloudflare Stream.
-#     It forwards all TUS protocol requests to Cloudflare while adding authentication.
+    This endpoint acts as a streaming proxy between the TUS client and
+    Cloudflare Stream. It forwards all TUS protocol requests to Cloudflare
+    while adding authentication.
     
-#     It handles BOTH:
-#     1. POST (creation) requests to /api/tus-upload-endpoint
-#     2. PATCH/HEAD (chunk/status) requests to /api/tus-upload-endpoint/<path:...>
+    It handles BOTH:
+    1. POST (creation) requests to /api/tus-upload-endpoint
+    2. PATCH/HEAD (chunk/status) requests to /api/tus-upload-endpoint/<path:...>
     
-#     It rewrites the 'Location' header from Cloudflare to keep the client
-#     talking to this proxy, ensuring the auth token is always added.
-#     """
+    Request bodies are piped from request.stream and responses are piped
+    back in TUS_PROXY_CHUNK_SIZE blocks, so memory stays O(chunk) however
+    large the lecture is.
     
-#     try:
-#         # 1. Determine the target Cloudflare URL
-#         if request.method == 'POST' and not cf_path:
-#             # --- This is the CREATE request ---
-#             cloudflare_target_url = f"{CLOUDFLARE_STREAM_API_URL}/{CLOUDFLARE_ACCOUNT_ID}/stream"
-#             print(f"\n{'='*60}")
-#             print(f"🎬 TUS Upload Request (CREATE)")
-#             print(f"{'='*60}")
-#         elif cf_path:
-#             # --- This is a CHUNK/STATUS request ---
-#             # cf_path will be "client/v4/accounts/ACC_ID/media/VID_ID"
-#             # We reconstruct the full absolute URL Cloudflare expects
-#             cloudflare_target_url = f"https://edge-production.gateway.api.cloudflare.com/{cf_path}"
-#             print(f"\n{'='*60}")
-#             print(f"🎬 TUS Upload Request (CHUNK/STATUS)")
-#             print(f"{'='*60}")
-#         else:
-#             print(f"❌ Invalid TUS request: {request.method} to {request.path}")
-#             return jsonify({'error': 'Invalid TUS request path'}), 400
-        
-#         print(f"Method: {request.method}")
-#         print(f"Cloudflare Endpoint: {cloudflare_target_url}")
-        
-#         # Prepare headers to forward to Cloudflare
-#         headers_to_forward = {
-#             'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
-#         }
+    It rewrites the 'Location' header from Cloudflare to keep the client
+    talking to this proxy, ensuring the auth token is always added.
+    """
+    
+    try:
+        # 1. Determine the target Cloudflare URL
+        if request.method == 'POST' and not cf_path:
+            # --- This is the CREATE request ---
+            cloudflare_target_url = f"{CLOUDFLARE_STREAM_API_URL}/{CLOUDFLARE_ACCOUNT_ID}/stream"
+            logger.debug(f"TUS Upload Request (CREATE): {request.method} -> {cloudflare_target_url}")
+        elif cf_path:
+            # --- This is a CHUNK/STATUS request ---
+            # cf_path will be "client/v4/accounts/ACC_ID/media/VID_ID"
+            # We reconstruct the full absolute URL Cloudflare expects
+            cloudflare_target_url = f"{CLOUDFLARE_TUS_EDGE_URL}/{cf_path}"
+            logger.debug(f"TUS Upload Request (CHUNK/STATUS): {request.method} -> {cloudflare_target_url}")
+        else:
+            logger.error(f"Invalid TUS request: {request.method} to {request.path}")
+            return jsonify({'error': 'Invalid TUS request path'}), 400
         
-#         # Forward all TUS-specific headers from client
-#         tus_headers = [
-#             'Tus-Resumable',
-#             'Upload-Length',
-#             'Upload-Metadata',
-#             'Upload-Offset',
-#             'Upload-Concat',
-#             'Content-Type',
-#             'Content-Length'
-#         ]
-        
-#         for header in tus_headers:
-#             if header in request.headers:
-#                 headers_to_forward[header] = request.headers[header]
-#                 print(f"  {header}: {request.headers[header]}")
-        
-#         # Forward the request body (for PATCH requests with video data)
-#         body = request.get_data()
-        
-#         # Make request to Cloudflare
-#         print(f"📤 Forwarding to Cloudflare...")
-        
-#         cloudflare_response = requests.request(
-#             method=request.method,
-#             url=cloudflare_target_url, # Use the DYNAMIC target URL
-#             headers=headers_to_forward,
-#             data=body,
-#             timeout=300,  # 5 minute timeout for large uploads
-#             stream=True
-#         )
-        
-#         print(f"📥 Cloudflare Response: {cloudflare_response.status_code}")
-        
-#         # Extract headers to return to client
-#         response_headers = {}
-#         headers_to_return = [
-#             # 'Location', # We handle this manually below
-#             'Upload-Offset',
-#             'Upload-Length',
-#             'Tus-Resumable',
-#             'Tus-Version',
-#             'Tus-Extension',
-#             'Tus-Max-Size',
-#             'stream-media-id'
-#         ]
-        
-#         for header in headers_to_return:
-#             if header in cloudflare_response.headers:
-#                 response_headers[header] = cloudflare_response.headers[header]
-#                 print(f"  {header}: {cloudflare_response.headers[header]}")
-        
-#         # --- CRITICAL: LOCATION HEADER REWRITE ---
-#         if 'Location' in cloudflare_response.headers:
-#             cf_location = cloudflare_response.headers['Location']
-#             print(f"  Original Location: {cf_location}")
-            
-#             try:
-#                 # Parse the path from the absolute CF URL
-#                 # e.g., "client/v4/accounts/ACC_ID/media/VID_ID"
-#                 parsed_url = urlparse(cf_location)
-#                 path_part = parsed_url.path.lstrip('/')
-
-#                 # --- NEW ROBUST LOGIC ---
-#                 # Use the configured public URL from .env, not request.host
-#                 if BACKEND_PUBLIC_URL:
-#                     # Ensure it doesn't have a trailing slash
-#                     proxy_base_url = BACKEND_PUBLIC_URL.rstrip('/')
-#                 else:
-#                     # Fallback to the (unreliable) host-stripping logic as a last resort
-#                     print("⚠️ Falling back to request.host logic...")
-#                     host_without_port = request.host.split(':')[0]
-#                     proxy_base_url = f"{request.scheme}://{host_without_port}"
-
-#                 # Build the new proxied location
-#                 proxy_location = f"{proxy_base_url}/api/tus-upload-endpoint/{path_part}"
-#                 # --- END NEW LOGIC ---
-
-#                 response_headers['Location'] = proxy_location
-#                 print(f"  Rewritten Location: {proxy_location}")
-            
-#             except Exception as e:
-#                 print(f"❌ FAILED TO REWRITE LOCATION HEADER: {e}")
-#                 # Fallback, but this will likely fail in the browser
-#                 response_headers['Location'] = cf_location
-#         # --- END LOCATION REWRITE ---
-
-#         # Get the video UID from stream-media-id header
-#         video_uid = cloudflare_response.headers.get('stream-media-id', '')
-#         if video_uid:
-#             print(f"✅ Video UID: {video_uid}")
-#             response_headers['X-Video-UID'] = video_uid  # Custom header for easy access
+        # Prepare headers to forward to Cloudflare
+        headers_to_forward = {
+            'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}',
+        }
         
-#         # Create response
-#         response = Response(
-#             cloudflare_response.content,
-#             status=cloudflare_response.status_code,
-#             headers=response_headers
-#         )
+        # Forward all TUS-specific headers from client
+        tus_headers = [
+            'Tus-Resumable',
+            'Upload-Length',
+            'Upload-Metadata',
+            'Upload-Offset',
+            'Upload-Concat',
+            'Content-Type'
+        ]
         
-#         print(f"{'='*60}\n")
+        for header in tus_headers:
+            if header in request.headers:
+                headers_to_forward[header] = request.headers[header]
+        
+        # Stream the request body (PATCH requests carry the video data)
+        body = None
+        if request.content_length:
+            body = BoundedStream(request.stream, request.content_length, TUS_PROXY_CHUNK_SIZE)
+        
+        # Pooled client: chunk requests reuse the TLS connection. Streamed
+        # bodies cannot be replayed, so only bodiless requests are retried
+        cloudflare_response = http_client.request(
+            method=request.method,
+            retry=body is None,
+            url=cloudflare_target_url, # Use the DYNAMIC target URL
+            headers=headers_to_forward,
+            data=body,
+            timeout=(10, 300),  # 5 minute read timeout for large uploads
+            stream=True
+        )
         
-#         return response
+        logger.debug(f"Cloudflare Response: {cloudflare_response.status_code}")
+        
+        # Extract headers to return to client
+        response_headers = {}
+        headers_to_return = [
+            # 'Location', # We handle this manually below
+            'Upload-Offset',
+            'Upload-Length',
+            'Tus-Resumable',
+            'Tus-Version',
+            'Tus-Extension',
+            'Tus-Max-Size',
+            'stream-media-id'
+        ]
         
-#     except requests.exceptions.Timeout:
-#         print("⏱️ Timeout connecting to Cloudflare")
-#         return jsonify({'error': 'Upload timeout'}), 504
+        for header in headers_to_return:
+            if header in cloudflare_response.headers:
+                response_headers[header] = cloudflare_response.headers[header]
         
-#     except Exception as e:
-#         print(f"❌ TUS Upload Error: {str(e)}")
-#         return jsonify({'error': str(e)}), 500
+        # --- CRITICAL: LOCATION HEADER REWRITE ---
+        if 'Location' in cloudflare_response.headers:
+            cf_location = cloudflare_response.headers['Location']
+            
+            try:
+                # Parse the path from the absolute CF URL
+                # e.g., "client/v4/accounts/ACC_ID/media/VID_ID"
+                parsed_url = urlparse(cf_location)
+                path_part = parsed_url.path.lstrip('/')
+
+                # Use the configured public URL from .env, not request.host
+                if BACKEND_PUBLIC_URL:
+                    # Ensure it doesn't have a trailing slash
+                    proxy_base_url = BACKEND_PUBLIC_URL.rstrip('/')
+                else:
+                    # Fallback to the (unreliable) host-stripping logic as a last resort
+                    logger.warning("Falling back to request.host logic...")
+                    host_without_port = request.host.split(':')[0]
+                    proxy_base_url = f"{request.scheme}://{host_without_port}"
+
+                # Build the new proxied location
+                proxy_location = f"{proxy_base_url}/api/tus-upload-endpoint/{path_part}"
+
+                response_headers['Location'] = proxy_location
+                logger.debug(f"  Rewritten Location: {cf_location} -> {proxy_location}")
+            
+            except Exception as e:
+                logger.error(f"FAILED TO REWRITE LOCATION HEADER: {e}")
+                # Fallback, but this will likely fail in the browser
+                response_headers['Location'] = cf_location
+        # --- END LOCATION REWRITE ---
+
+        # Get the video UID from stream-media-id header
+        video_uid = cloudflare_response.headers.get('stream-media-id', '')
+        if video_uid:
+            logger.info(f"Video UID: {video_uid}", extra=SAMPLED)
+            response_headers['X-Video-UID'] = video_uid  # Custom header for easy access
+        
+        def stream_cloudflare_body():
+            try:
+                for block in cloudflare_response.iter_content(chunk_size=TUS_PROXY_CHUNK_SIZE):
+                    yield block
+            finally:
+                # Hands the connection back to the pool
+                cloudflare_response.close()
+        
+        return Response(
+            stream_cloudflare_body(),
+            status=cloudflare_response.status_code,
+            headers=response_headers
+        )
+        
+    except requests.exceptions.Timeout:
+        logger.warning("Timeout connecting to Cloudflare")
+        return jsonify({'error': 'Upload timeout'}), 504
+        
+    except Exception as e:
+        logger.error(f"TUS Upload Error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
 
 # ===================================
 # VIDEO MANAGEMENT ENDPOINTS
@@ -409,7 +2326,7 @@ def get_videos():
         return jsonify(videos), 200
         
     except Exception as e:
-        print(f"❌ Error fetching videos: {str(e)}")
+        logger.error(f"Error fetching videos: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # @app.route('/api/videos', methods=['POST'])
@@ -445,6 +2362,38 @@ def get_videos():
 #         return jsonify({'error': str(e)}), 500
 
 
+YOUTUBE_ID_PATTERNS = (
+    re.compile(r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([a-zA-Z0-9_-]{11})'),
+    re.compile(r'youtube\.com\/watch\?.*v=([a-zA-Z0-9_-]{11})'),
+    re.compile(r'youtube\.com\/(?:shorts|live)\/([a-zA-Z0-9_-]{11})')
+)
+YOUTUBE_BARE_ID_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{11}$')
+FIRESTORE_IN_QUERY_LIMIT = 30  # Max values in a single 'in' filter
+BULK_IMPORT_MAX_VIDEOS = 200
+
+
+def extract_youtube_id(value):
+    """Video ID from a YouTube URL or a bare 11-character ID, else None"""
+    value = (value or '').strip()
+    if YOUTUBE_BARE_ID_PATTERN.fullmatch(value):
+        return value
+    for pattern in YOUTUBE_ID_PATTERNS:
+        match = pattern.search(value)
+        if match:
+            return match.group(1)
+    return None
+
+
+def find_existing_youtube_ids(youtube_ids):
+    """Subset of youtube_ids already stored, one 'in' query per chunk"""
+    existing = set()
+    for start in range(0, len(youtube_ids), FIRESTORE_IN_QUERY_LIMIT):
+        chunk = youtube_ids[start:start + FIRESTORE_IN_QUERY_LIMIT]
+        query = db.collection('videos').where('youtubeId', 'in', chunk).select(['youtubeId'])
+        existing.update(doc.get('youtubeId') for doc in query.stream())
+    return existing
+
+
 @app.route('/api/videos', methods=['POST'])
 @require_auth
 def save_video_metadata():
@@ -462,18 +2411,9 @@ def save_video_metadata():
         youtube_id = data.get('youtubeId')
         youtube_url = data.get('youtubeUrl')
         
-        if not youtube_id and youtube_url:
-            # Extract ID from URL as fallback
-            import re
-            patterns = [
-                r'(?:youtube\.com\/watch\?v=|youtu\.be\/|youtube\.com\/embed\/)([a-zA-Z0-9_-]{11})',
-                r'youtube\.com\/watch\?.*v=([a-zA-Z0-9_-]{11})'
-            ]
-            for pattern in patterns:
-                match = re.search(pattern, youtube_url)
-                if match:
-                    youtube_id = match.group(1)
-                    break
+        # Accept a bare ID or any YouTube URL form; anything else is rejected
+        youtube_id = extract_youtube_id(youtube_id if isinstance(youtube_id, str) else '') \
+            or extract_youtube_id(youtube_url if isinstance(youtube_url, str) else '')
         
         if not youtube_id:
             return jsonify({'error': 'Invalid YouTube URL - could not extract video ID'}), 400
@@ -500,7 +2440,10 @@ def save_video_metadata():
         # Save to Firestore
         doc_ref = db.collection('videos').add(video_data)
         
-        print(f"✅ YouTube video metadata saved: {doc_ref[1].id} - {youtube_id}")
+        logger.info(f"YouTube video metadata saved: {doc_ref[1].id} - {youtube_id}", extra=SAMPLED)
+        
+        # Duration, thumbnails and channel are filled in asynchronously
+        youtube_enrichment.enqueue(doc_ref[1].id, youtube_id)
         
         return jsonify({
             'id': doc_ref[1].id,
@@ -509,7 +2452,132 @@ def save_video_metadata():
         }), 201
         
     except Exception as e:
-        print(f"❌ Error saving video metadata: {str(e)}")
+        logger.error(f"Error saving video metadata: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/videos:bulkImport', methods=['POST'])
+@require_auth
+def bulk_import_videos():
+    """
+    Add a whole chapter of YouTube videos in one request.
+
+    Body: {"subject", "chapter", "access"?, "tags"?, and either
+    "videos": [url | {"url"/"youtubeId", "title"?, "description"?}, ...]
+    or "urls": newline-separated text such as a playlist export}.
+    IDs already stored (or repeated in the request) are skipped, order
+    continues after the chapter's current last video, and everything is
+    written with batch commits.
+    """
+    try:
+        data = request.get_json(silent=True) or {}
+        
+        for field in ('subject', 'chapter'):
+            if not data.get(field):
+                return jsonify({'error': f'Missing required field: {field}'}), 400
+        
+        entries = data.get('videos')
+        if entries is None and isinstance(data.get('urls'), str):
+            entries = [line for line in data['urls'].splitlines() if line.strip()]
+        if not isinstance(entries, list) or not entries:
+            return jsonify({'error': 'Provide "videos" (a list) or "urls" (newline-separated text)'}), 400
+        if len(entries) > BULK_IMPORT_MAX_VIDEOS:
+            return jsonify({'error': f'Too many videos, maximum is {BULK_IMPORT_MAX_VIDEOS} per import'}), 400
+        
+        # --- Extract IDs ---
+        candidates = []
+        errors = []
+        seen = set()
+        for row_number, entry in enumerate(entries, start=1):
+            if isinstance(entry, str):
+                entry = {'url': entry}
+            if not isinstance(entry, dict):
+                errors.append({'row': row_number, 'error': 'Entry must be a URL or an object'})
+                continue
+            youtube_url = entry.get('url') or entry.get('youtubeUrl') or ''
+            youtube_url = youtube_url.strip() if isinstance(youtube_url, str) else ''
+            entry_id = entry.get('youtubeId')
+            youtube_id = extract_youtube_id((entry_id if isinstance(entry_id, str) else '') or youtube_url)
+            if not youtube_id:
+                errors.append({'row': row_number, 'error': 'Could not extract a YouTube video ID'})
+                continue
+            if youtube_id in seen:
+                continue
+            seen.add(youtube_id)
+            candidates.append((youtube_id, youtube_url or f'https://www.youtube.com/watch?v={youtube_id}', entry))
+        
+        # --- Dedupe against stored videos ---
+        existing = find_existing_youtube_ids([youtube_id for youtube_id, _, _ in candidates])
+        new_videos = [candidate for candidate in candidates if candidate[0] not in existing]
+        
+        # --- Continue ordering after the chapter's last video ---
+        chapter_query = (db.collection('videos')
+                         .where('subject', '==', data['subject'])
+                         .where('chapter', '==', data['chapter'])
+                         .select(['order']))
+        next_order = max((doc.to_dict().get('order') or 0 for doc in chapter_query.stream()), default=0) + 1
+        
+        uploaded_by_name = data.get('uploadedByName', request.admin_data.get('name', 'Admin'))
+        created = []
+        for start in range(0, len(new_videos), FIRESTORE_BATCH_LIMIT):
+            batch = db.batch()
+            for youtube_id, youtube_url, entry in new_videos[start:start + FIRESTORE_BATCH_LIMIT]:
+                video_ref = db.collection('videos').document()
+                batch.set(video_ref, {
+                    'youtubeId': youtube_id,
+                    'youtubeUrl': youtube_url,
+                    'title': entry.get('title') or f"{data['chapter']} - Part {next_order}",
+                    'subject': data['subject'],
+                    'chapter': data['chapter'],
+                    'order': next_order,
+                    'description': entry.get('description', ''),
+                    'access': entry.get('access', data.get('access', 'premium')),
+                    'tags': entry.get('tags', data.get('tags', [])),
+                    'uploadedBy': request.uid,
+                    'uploadedByName': uploaded_by_name,
+                    'views': 0,
+                    'isActive': True,
+                    'uploadedAt': firestore.SERVER_TIMESTAMP,
+                    'createdAt': firestore.SERVER_TIMESTAMP
+                })
+                created.append({'id': video_ref.id, 'youtubeId': youtube_id, 'order': next_order})
+                next_order += 1
+            batch.commit()
+        
+        for video in created:
+            youtube_enrichment.enqueue(video['id'], video['youtubeId'])
+        
+        logger.info(f"Bulk imported {len(created)} video(s) into {data['subject']} / {data['chapter']} ({len(existing)} already present, {len(errors)} invalid)", extra=SAMPLED)
+        
+        return jsonify({
+            'imported': len(created),
+            'skippedExisting': sorted(existing),
+            'failed': len(errors),
+            'errors': errors,
+            'videos': created
+        }), 201 if created else 200
+        
+    except Exception as e:
+        logger.exception(f"Error bulk importing videos: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/videos/enrich-metadata', methods=['POST'])
+@require_auth
+def enrich_video_metadata():
+    """Queue every YouTube video without fetched metadata (the queue does not survive restarts)"""
+    try:
+        queued = 0
+        for video_doc in db.collection('videos').select(['youtubeId', 'metadataFetchedAt']).stream():
+            video = video_doc.to_dict()
+            if video.get('youtubeId') and not video.get('metadataFetchedAt'):
+                youtube_enrichment.enqueue(video_doc.id, video['youtubeId'])
+                queued += 1
+        
+        logger.info(f"Queued {queued} video(s) for YouTube metadata enrichment", extra=SAMPLED)
+        
+        return jsonify({'queued': queued}), 202
+        
+    except Exception as e:
+        logger.error(f"Error queueing video metadata enrichment: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/videos/<video_id>', methods=['PUT'])
@@ -534,12 +2602,12 @@ def update_video(video_id):
         # Update in Firestore
         db.collection('videos').document(video_id).update(data)
         
-        print(f"✅ Video updated: {video_id}")
+        logger.info(f"Video updated: {video_id}", extra=SAMPLED)
         
         return jsonify({'message': 'Video updated successfully'}), 200
         
     except Exception as e:
-        print(f"❌ Error updating video: {str(e)}")
+        logger.error(f"Error updating video: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # @app.route('/api/videos/<video_id>', methods=['DELETE'])
@@ -561,7 +2629,7 @@ def update_video(video_id):
 #             delete_url = f"{CLOUDFLARE_STREAM_API_URL}/{CLOUDFLARE_ACCOUNT_ID}/stream/{cloudflare_uid}"
 #             headers = {'Authorization': f'Bearer {CLOUDFLARE_API_TOKEN}'}
             
-#             cloudflare_response = requests.delete(delete_url, headers=headers, timeout=30)
+#             cloudflare_response = http_client.delete(delete_url, headers=headers, timeout=30)
             
 #             if cloudflare_response.status_code == 200:
 #                 print(f"✅ Video deleted from Cloudflare: {cloudflare_uid}")
@@ -596,8 +2664,8 @@ def delete_video(video_id):
         # Delete from Firestore
         db.collection('videos').document(video_id).delete()
         
-        print(f"✅ Video reference deleted from Firestore: {video_id}")
-        print(f"ℹ️  Note: YouTube video still exists - delete manually if needed")
+        logger.info(f"Video reference deleted from Firestore: {video_id}", extra=SAMPLED)
+        logger.info(f"Note: YouTube video still exists - delete manually if needed")
         
         return jsonify({
             'message': 'Video deleted successfully from database',
@@ -605,7 +2673,7 @@ def delete_video(video_id):
         }), 200
         
     except Exception as e:
-        print(f"❌ Error deleting video: {str(e)}")
+        logger.error(f"Error deleting video: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # @app.route('/api/videos/status/<video_uid>', methods=['GET'])
@@ -619,7 +2687,7 @@ def delete_video(video_id):
 #             'Content-Type': 'application/json'
 #         }
         
-#         response = requests.get(url, headers=headers, timeout=30)
+#         response = http_client.get(url, headers=headers, timeout=30)
         
 #         if response.status_code != 200:
 #             error_data = response.json()
@@ -650,12 +2718,197 @@ def delete_video(video_id):
         
 #         return jsonify(status_info), 200
 
-#     except requests.exceptions.Timeout:
-#         return jsonify({'error': 'Request timeout'}), 504
-        
-#     except Exception as e:
-#         print(f"❌ Error getting video status: {str(e)}")
-#         return jsonify({'error': str(e)}), 500
+#     except requests.exceptions.Timeout:
+#         return jsonify({'error': 'Request timeout'}), 504
+        
+#     except Exception as e:
+#         print(f"❌ Error getting video status: {str(e)}")
+#         return jsonify({'error': str(e)}), 500
+
+# ===================================
+# TEST QUESTION STORAGE HELPERS
+# ===================================
+# Questions live in tests/{testId}/questions/{questionId} and are ordered
+# by an integer 'order' field. The parent test document only carries the
+# counters (questionCount, totalMarks, nextOrder), so edits touch the one
+# question doc plus the parent instead of rewriting an embedded array.
+
+# Questions plus the parent counter update must fit in one commit
+BULK_IMPORT_MAX_QUESTIONS = FIRESTORE_BATCH_LIMIT - 1
+
+
+def questions_collection(test_ref):
+    """Return the questions subcollection of a test document"""
+    return test_ref.collection('questions')
+
+
+def validate_question_data(question_data):
+    """Validate a question payload, returns an error message or None"""
+    if not isinstance(question_data, dict):
+        return 'Question must be a JSON object'
+
+    required_fields = ['type', 'question', 'markValue', 'marks', 'negativeMarks', 'difficulty']
+    for field in required_fields:
+        if field not in question_data:
+            return f'Missing required question field: {field}'
+
+    q_type = question_data.get('type')
+
+    marks = question_data.get('marks')
+    if isinstance(marks, bool) or not isinstance(marks, (int, float)):
+        return 'Invalid marks value, must be a number'
+
+    # Type-specific validation (more robust checks can be added)
+    if q_type in ['mcq', 'msq'] and (not isinstance(question_data.get('options'), dict) or not question_data['options']):
+        return 'Missing or invalid options for MCQ/MSQ'
+    if q_type == 'mcq' and 'correctAnswer' not in question_data:
+        return 'Missing correctAnswer for MCQ'
+    if q_type == 'msq' and (not isinstance(question_data.get('correctAnswers'), list) or not question_data['correctAnswers']):
+        return 'Missing or invalid correctAnswers array for MSQ'
+    if q_type == 'numerical' and 'correctAnswer' not in question_data: # Consider checking type too
+        return 'Missing or invalid correctAnswer for Numerical'
+    if q_type == 'true-false' and not isinstance(question_data.get('correctAnswer'), bool): # Check for boolean
+        return 'Missing or invalid boolean correctAnswer for True/False'
+
+    return None
+
+
+def coerce_csv_question(row):
+    """Convert a CSV row (all strings) into a question payload"""
+    question = {}
+    options = {}
+    for column, value in row.items():
+        if column is None or value is None:
+            continue
+        column = column.strip()
+        value = value.strip()
+        if not value:
+            continue
+        # optionA, optionB, ... columns become the options map
+        if column.lower().startswith('option') and len(column) > len('option'):
+            options[column[len('option'):].upper()] = value
+        else:
+            question[column] = value
+
+    if options:
+        question['options'] = options
+
+    q_type = question.get('type', '').lower()
+    if q_type:
+        question['type'] = q_type
+
+    for field, cast in (('markValue', int), ('marks', float), ('negativeMarks', float), ('tolerance', float)):
+        if field in question:
+            try:
+                question[field] = cast(question[field])
+            except ValueError:
+                pass  # Left as a string, validation reports it
+    if isinstance(question.get('marks'), float) and question['marks'].is_integer():
+        question['marks'] = int(question['marks'])
+
+    if 'correctAnswers' in question:
+        question['correctAnswers'] = [a.strip().upper() for a in re.split(r'[;,]', question['correctAnswers']) if a.strip()]
+    if 'correctAnswer' in question:
+        answer = question['correctAnswer']
+        if q_type == 'numerical':
+            try:
+                question['correctAnswer'] = float(answer)
+            except ValueError:
+                pass
+        elif q_type == 'true-false':
+            if answer.lower() in ('true', 'false'):
+                question['correctAnswer'] = answer.lower() == 'true'
+        elif q_type == 'mcq':
+            question['correctAnswer'] = answer.upper()
+
+    return question
+
+
+def load_test_questions(test_ref):
+    """Fetch all questions of a test in display order with one query"""
+    questions = []
+    for doc in questions_collection(test_ref).order_by('order').stream():
+        question_data = doc.to_dict()
+        question_data['id'] = doc.id
+        questions.append(question_data)
+    return questions
+
+
+MIGRATION_MAX_ATTEMPTS = 3
+
+
+def migrate_test_questions(test_ref, snapshot=None):
+    """
+    Move a legacy embedded 'questions' array into the questions subcollection.
+
+    Question doc IDs are derived from the array index and the array is only
+    removed in the final batch, so an interrupted migration can simply be
+    re-run. That batch is conditional on the parent being unchanged since
+    the snapshot, so a concurrent migration (and the adds that follow it)
+    is never overwritten with stale counters. Returns the number of
+    questions moved (0 if already migrated).
+    """
+    for _ in range(MIGRATION_MAX_ATTEMPTS):
+        if snapshot is None:
+            snapshot = test_ref.get()
+        if not snapshot.exists:
+            return 0
+        try:
+            return _migrate_test_questions_from(test_ref, snapshot)
+        except FailedPrecondition:
+            # The parent changed after our read; re-read to see whether
+            # another request already migrated it
+            snapshot = None
+    raise RuntimeError(f"Test {test_ref.id} kept changing during question migration")
+
+
+def _migrate_test_questions_from(test_ref, snapshot):
+    """One migration attempt from snapshot; FailedPrecondition if the parent has since changed"""
+    legacy_questions = snapshot.to_dict().get('questions')
+    if not isinstance(legacy_questions, list):
+        return 0
+
+    questions_ref = questions_collection(test_ref)
+    batch = db.batch()
+    ops = 0
+    for index, question in enumerate(legacy_questions):
+        question_doc = dict(question)
+        question_doc['order'] = index
+        batch.set(questions_ref.document(f'legacy-{index:04d}'), question_doc)
+        ops += 1
+        if ops == FIRESTORE_BATCH_LIMIT - 1:
+            batch.commit()
+            batch = db.batch()
+            ops = 0
+
+    batch.update(test_ref, {
+        'questions': firestore.DELETE_FIELD,
+        'questionCount': len(legacy_questions),
+        'nextOrder': len(legacy_questions),
+        'totalMarks': sum(q.get('marks', 0) or 0 for q in legacy_questions)
+    }, option=db.write_option(last_update_time=snapshot.update_time))
+    batch.commit()
+
+    logger.info(f"Migrated {len(legacy_questions)} question(s) to subcollection for test: {test_ref.id}")
+    return len(legacy_questions)
+
+
+@firestore.transactional
+def remove_question_in_transaction(transaction, test_ref, question_ref):
+    """Delete one question doc and decrement the parent counters"""
+    question_snapshot = question_ref.get(transaction=transaction)
+    if not question_snapshot.exists:
+        raise FileNotFoundError("Question not found!")
+
+    marks_to_decrement = question_snapshot.to_dict().get('marks', 0)
+
+    transaction.delete(question_ref)
+    transaction.update(test_ref, {
+        'questionCount': firestore.Increment(-1),
+        'totalMarks': firestore.Increment(-marks_to_decrement)
+    })
+    return marks_to_decrement
+
 
 # ===================================
 # TEST MANAGEMENT ENDPOINTS
@@ -673,13 +2926,14 @@ def get_tests():
             test_data['id'] = doc.id
             # Ensure totalMarks is present, default to 0 if missing
             test_data.setdefault('totalMarks', 0)
+            # Migrated tests keep only the counter; legacy tests still embed the array
+            test_data.setdefault('questionCount', len(test_data.get('questions') or []))
             # Optionally remove the full 'questions' array for the list view to save bandwidth
             # test_data.pop('questions', None)
             tests.append(test_data)
         return jsonify(tests), 200
     except Exception as e:
-        print(f"❌ Error fetching tests list: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching tests list: {str(e)}")
         return jsonify({'error': 'Failed to fetch tests list', 'details': str(e)}), 500
 
 
@@ -697,13 +2951,16 @@ def get_test(test_id):
 
         # Ensure totalMarks is present, default to 0 if missing
         test_data.setdefault('totalMarks', 0)
-        # Ensure questions array exists
-        test_data.setdefault('questions', [])
+
+        # Legacy tests still embed the array; migrated tests are assembled
+        # from the questions subcollection with a single ordered query
+        if not isinstance(test_data.get('questions'), list):
+            test_data['questions'] = load_test_questions(test_doc.reference)
+        test_data.setdefault('questionCount', len(test_data['questions']))
 
         return jsonify(test_data), 200
     except Exception as e:
-        print(f"❌ Error fetching test details for {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching test details for {test_id}: {str(e)}")
         return jsonify({'error': 'Failed to fetch test details', 'details': str(e)}), 500
 
 
@@ -734,7 +2991,9 @@ def create_test():
             'createdBy': request.uid, # Get admin UID from decorator
             'createdByName': request.admin_data.get('name', 'Admin'), # Get admin name
             'createdAt': firestore.SERVER_TIMESTAMP,
-            'questions': [], # Initialize questions as empty list
+            # Questions are stored in the 'questions' subcollection
+            'questionCount': 0,
+            'nextOrder': 0, # Next 'order' value handed to a new question
             'totalMarks': 0, # Initialize totalMarks to 0
             # 'attempts': 0, # Can be added if you track attempts directly on test doc
             'isActive': True
@@ -745,7 +3004,7 @@ def create_test():
         doc_ref = db.collection('tests').add(test_data)
         new_test_id = doc_ref[1].id
 
-        print(f"✅ Test created: {new_test_id} (Initial Total Marks: 0)")
+        logger.info(f"Test created: {new_test_id} (Initial Total Marks: 0)", extra=SAMPLED)
 
         # Return the ID and a message
         return jsonify({
@@ -754,8 +3013,7 @@ def create_test():
         }), 201
 
     except Exception as e:
-        print(f"❌ Error creating test: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error creating test: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -792,7 +3050,7 @@ def update_test(test_id):
         test_ref = db.collection('tests').document(test_id)
         test_ref.update(update_data)
 
-        print(f"✅ Test metadata updated: {test_id}")
+        logger.info(f"Test metadata updated: {test_id}", extra=SAMPLED)
 
         # Fetch and return updated data
         updated_doc = test_ref.get()
@@ -806,8 +3064,7 @@ def update_test(test_id):
 
 
     except Exception as e:
-        print(f"❌ Error updating test {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error updating test {test_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -824,161 +3081,431 @@ def delete_test(test_id):
 
         test_ref.delete()
 
-        print(f"✅ Test deleted: {test_id}")
+        logger.info(f"Test deleted: {test_id}", extra=SAMPLED)
 
-        # Also consider deleting related testAttempts (optional cleanup)
-        # attempts_query = db.collection('testAttempts').where('testId', '==', test_id)
-        # for attempt_doc in attempts_query.stream():
-        #     attempt_doc.reference.delete()
-        # print(f"🧹 Cleaned up attempts for test: {test_id}")
+        # Questions, attempts and access grants are removed by a background job
+        job_id = cascade_runner.enqueue('test', test_id, request.uid)
 
-
-        return jsonify({'message': f'Test {test_id} deleted successfully'}), 200
+        return jsonify({
+            'message': f'Test {test_id} deleted successfully',
+            'cleanupJobId': job_id
+        }), 200
 
     except Exception as e:
-        print(f"❌ Error deleting test {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error deleting test {test_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
 @app.route('/api/tests/<test_id>/questions', methods=['POST'])
 @require_auth # Your admin auth decorator
 def add_question(test_id):
-    """Add a question to a test's questions array and update total marks."""
+    """Add a question document to a test and update its counters."""
     try:
         question_data = request.json
 
         # --- Basic Validation ---
-        required_fields = ['type', 'question', 'markValue', 'marks', 'negativeMarks', 'difficulty']
-        for field in required_fields:
-            if field not in question_data:
-                return jsonify({'error': f'Missing required question field: {field}'}), 400
+        validation_error = validate_question_data(question_data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
 
-        q_type = question_data.get('type')
         q_marks = question_data.get('marks', 0)
-
-        # Type-specific validation (more robust checks can be added)
-        if q_type in ['mcq', 'msq'] and (not isinstance(question_data.get('options'), dict) or not question_data['options']):
-             return jsonify({'error': 'Missing or invalid options for MCQ/MSQ'}), 400
-        if q_type == 'mcq' and 'correctAnswer' not in question_data:
-             return jsonify({'error': 'Missing correctAnswer for MCQ'}), 400
-        if q_type == 'msq' and (not isinstance(question_data.get('correctAnswers'), list) or not question_data['correctAnswers']):
-             return jsonify({'error': 'Missing or invalid correctAnswers array for MSQ'}), 400
-        if q_type == 'numerical' and 'correctAnswer' not in question_data: # Consider checking type too
-            return jsonify({'error': 'Missing or invalid correctAnswer for Numerical'}), 400
-        if q_type == 'true-false' and not isinstance(question_data.get('correctAnswer'), bool): # Check for boolean
-            return jsonify({'error': 'Missing or invalid boolean correctAnswer for True/False'}), 400
+        question_data.pop('id', None)
+        question_data.pop('order', None)
         # --- End Validation ---
 
         test_ref = db.collection('tests').document(test_id)
+        test_doc = test_ref.get()
+        if not test_doc.exists:
+            return jsonify({'error': 'Test document not found!'}), 404
+        migrate_test_questions(test_ref, test_doc)
 
         # --- Use Firestore Transaction for Atomic Update ---
+        # Only the small parent doc is read, to hand out the next 'order'
         @firestore.transactional
-        def update_test_with_question(transaction, test_ref_in_tx, new_question):
+        def add_question_to_test(transaction, test_ref_in_tx, new_question):
             snapshot = test_ref_in_tx.get(transaction=transaction)
             if not snapshot.exists:
                 raise FileNotFoundError("Test document not found!") # Use specific exception
 
-            current_questions = snapshot.to_dict().get('questions', [])
-            current_questions.append(new_question) # Append the new question data
+            test_data = snapshot.to_dict()
+            order = test_data.get('nextOrder', test_data.get('questionCount', 0))
 
-            # Atomically update questions array and increment totalMarks
+            question_ref = questions_collection(test_ref_in_tx).document()
+            transaction.set(question_ref, {**new_question, 'order': order})
             transaction.update(test_ref_in_tx, {
-                'questions': current_questions,
+                'nextOrder': order + 1,
+                'questionCount': firestore.Increment(1),
                 'totalMarks': firestore.Increment(new_question['marks']) # Increment by the marks of the new question
             })
+            return question_ref.id, order
 
         transaction = db.transaction()
-        update_test_with_question(transaction, test_ref, question_data)
+        question_id, order = add_question_to_test(transaction, test_ref, question_data)
         # --- End Transaction ---
 
-        print(f"✅ Question added to test: {test_id}. Incremented total marks by {q_marks}.")
+        logger.info(f"Question {question_id} added to test: {test_id}. Incremented total marks by {q_marks}.", extra=SAMPLED)
 
-        # Fetch updated test data to return the full state
-        updated_test_doc = test_ref.get()
-        response_data = updated_test_doc.to_dict()
-        response_data['id'] = updated_test_doc.id
-        response_data.setdefault('totalMarks', 0) # Ensure field exists
-        response_data.setdefault('questions', [])
+        response_data = dict(question_data)
+        response_data['id'] = question_id
+        response_data['order'] = order
 
-        return jsonify(response_data), 200 # Return updated test data
+        return jsonify(response_data), 200
 
     except FileNotFoundError as fnf_error: # Catch specific error from transaction
-         print(f"❌ Error adding question (transaction failed): {str(fnf_error)}")
+         logger.error(f"Error adding question (transaction failed): {str(fnf_error)}")
          return jsonify({'error': str(fnf_error)}), 404
     except Exception as e:
-        print(f"❌ Error adding question to test {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error adding question to test {test_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/tests/<test_id>/questions/<question_id>', methods=['PUT'])
+@require_auth # Your admin auth decorator
+def update_question(test_id, question_id):
+    """Replace a question document and adjust the test's total marks."""
+    try:
+        question_data = request.json
+
+        validation_error = validate_question_data(question_data)
+        if validation_error:
+            return jsonify({'error': validation_error}), 400
+
+        question_data.pop('id', None)
+        question_data.pop('order', None)
+
+        test_ref = db.collection('tests').document(test_id)
+        question_ref = questions_collection(test_ref).document(question_id)
+
+        @firestore.transactional
+        def replace_question(transaction, question_ref_in_tx, new_question):
+            snapshot = question_ref_in_tx.get(transaction=transaction)
+            if not snapshot.exists:
+                raise FileNotFoundError("Question not found!")
+
+            old_question = snapshot.to_dict()
+            marks_delta = new_question['marks'] - old_question.get('marks', 0)
+
+            # Keep the question's position
+            transaction.set(question_ref_in_tx, {**new_question, 'order': old_question.get('order', 0)})
+            if marks_delta:
+                transaction.update(test_ref, {'totalMarks': firestore.Increment(marks_delta)})
+            return marks_delta
+
+        transaction = db.transaction()
+        marks_delta = replace_question(transaction, question_ref, question_data)
+
+        logger.info(f"Question {question_id} updated in test: {test_id}. Total marks changed by {marks_delta}.", extra=SAMPLED)
+
+        return jsonify({'id': question_id, 'message': 'Question updated successfully'}), 200
+
+    except FileNotFoundError as fnf_error:
+        logger.error(f"Error updating question (transaction failed): {str(fnf_error)}")
+        return jsonify({'error': str(fnf_error)}), 404
+    except Exception as e:
+        logger.exception(f"Error updating question {question_id} in test {test_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
-@app.route('/api/tests/<test_id>/questions/<int:question_index>', methods=['DELETE'])
+# Own path: under /questions/ an all-digit question ID would be taken for an index
+@app.route('/api/tests/<test_id>/questions-by-index/<int:question_index>', methods=['DELETE'])
 @require_auth # Your admin auth decorator
 def delete_question(test_id, question_index):
-    """Delete a question from a test's questions array and update total marks."""
+    """Delete the question at a display index and update total marks."""
     try:
         test_ref = db.collection('tests').document(test_id)
+        test_doc = test_ref.get()
+        if not test_doc.exists:
+            return jsonify({'error': 'Test document not found!'}), 404
+        migrate_test_questions(test_ref, test_doc)
 
-        # --- Use Firestore Transaction for Atomic Update ---
+        if question_index < 0:
+            raise IndexError("Question index out of bounds!")
+
+        # Resolve the index to a question doc through the ordered query
+        matches = list(questions_collection(test_ref)
+            .order_by('order')
+            .offset(question_index)
+            .limit(1)
+            .stream())
+        if not matches:
+            raise IndexError("Question index out of bounds!")
+
+        transaction = db.transaction()
+        decremented_marks = remove_question_in_transaction(transaction, test_ref, matches[0].reference)
+
+        logger.info(f"Question at index {question_index} deleted from test: {test_id}. Decremented total marks by {decremented_marks}.", extra=SAMPLED)
+
+        return jsonify({'id': matches[0].id, 'message': 'Question deleted successfully'}), 200
+
+    except FileNotFoundError as fnf_error:
+        logger.error(f"Error deleting question (transaction failed): {str(fnf_error)}")
+        return jsonify({'error': str(fnf_error)}), 404
+    except IndexError as idx_error:
+        logger.error(f"Error deleting question (index invalid): {str(idx_error)}")
+        return jsonify({'error': str(idx_error)}), 400 # Bad request due to invalid index
+    except Exception as e:
+        logger.exception(f"Error deleting question {question_index} from test {test_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/tests/<test_id>/questions/<question_id>', methods=['DELETE'])
+@require_auth # Your admin auth decorator
+def delete_question_by_id(test_id, question_id):
+    """Delete a question document by ID and update total marks."""
+    try:
+        test_ref = db.collection('tests').document(test_id)
+        question_ref = questions_collection(test_ref).document(question_id)
+
+        transaction = db.transaction()
+        decremented_marks = remove_question_in_transaction(transaction, test_ref, question_ref)
+
+        logger.info(f"Question {question_id} deleted from test: {test_id}. Decremented total marks by {decremented_marks}.", extra=SAMPLED)
+
+        return jsonify({'id': question_id, 'message': 'Question deleted successfully'}), 200
+
+    except FileNotFoundError as fnf_error:
+        logger.error(f"Error deleting question (transaction failed): {str(fnf_error)}")
+        return jsonify({'error': str(fnf_error)}), 404
+    except Exception as e:
+        logger.exception(f"Error deleting question {question_id} from test {test_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/tests/<test_id>/questions:reorder', methods=['POST'])
+@require_auth # Your admin auth decorator
+def reorder_questions(test_id):
+    """
+    Reorder questions. Body: {"questionIds": [...]} in the new order.
+
+    The listed questions swap the 'order' slots they already occupy, so a
+    subset can be reordered and only docs whose position changed are written.
+    """
+    try:
+        data = request.json or {}
+        question_ids = data.get('questionIds', [])
+
+        if not isinstance(question_ids, list) or not question_ids:
+            return jsonify({'error': 'No question IDs provided'}), 400
+        if not all(isinstance(question_id, str) and question_id for question_id in question_ids):
+            return jsonify({'error': 'questionIds must be a list of non-empty strings'}), 400
+        if len(set(question_ids)) != len(question_ids):
+            return jsonify({'error': 'Duplicate question IDs provided'}), 400
+
+        test_ref = db.collection('tests').document(test_id)
+        questions_ref = questions_collection(test_ref)
+        refs = [questions_ref.document(question_id) for question_id in question_ids]
+
+        # One batched read for all listed questions
+        current_orders = {}
+        for snapshot in db.get_all(refs, field_paths=['order']):
+            if snapshot.exists:
+                current_orders[snapshot.id] = snapshot.to_dict().get('order', 0)
+
+        missing = [question_id for question_id in question_ids if question_id not in current_orders]
+        if missing:
+            return jsonify({'error': f'Question(s) not found: {", ".join(missing)}'}), 404
+
+        slots = sorted(current_orders.values())
+        batch = db.batch()
+        changed = 0
+        for ref, new_order in zip(refs, slots):
+            if current_orders[ref.id] != new_order:
+                batch.update(ref, {'order': new_order})
+                changed += 1
+        if changed:
+            batch.update(test_ref, {'updatedAt': firestore.SERVER_TIMESTAMP})
+            batch.commit()
+
+        logger.info(f"Reordered questions in test: {test_id} ({changed} moved)", extra=SAMPLED)
+
+        return jsonify({'message': 'Questions reordered successfully', 'moved': changed}), 200
+
+    except Exception as e:
+        logger.exception(f"Error reordering questions in test {test_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/tests/<test_id>/questions:bulkImport', methods=['POST'])
+@require_auth # Your admin auth decorator
+def bulk_import_questions(test_id):
+    """
+    Import many questions in one request.
+
+    Accepts a JSON array (or {"questions": [...]}) or a CSV upload
+    ('file' form field or text/csv body). Every row is validated with the
+    same rules as add_question, then all valid rows and the totalMarks
+    delta are committed in a single transaction. Invalid rows are
+    reported back and skipped.
+    """
+    try:
+        # --- Parse rows ---
+        if 'file' in request.files or request.mimetype == 'text/csv':
+            if 'file' in request.files:
+                raw_csv = request.files['file'].read().decode('utf-8-sig')
+            else:
+                raw_csv = request.get_data(as_text=True)
+            rows = [coerce_csv_question(row) for row in csv.DictReader(io.StringIO(raw_csv))]
+        else:
+            payload = request.get_json(silent=True)
+            rows = payload.get('questions') if isinstance(payload, dict) else payload
+            if not isinstance(rows, list):
+                return jsonify({'error': 'Expected a JSON array of questions or a CSV file'}), 400
+
+        if not rows:
+            return jsonify({'error': 'No questions provided'}), 400
+        if len(rows) > BULK_IMPORT_MAX_QUESTIONS:
+            return jsonify({'error': f'Too many questions, maximum is {BULK_IMPORT_MAX_QUESTIONS} per import'}), 400
+
+        # --- Validate all rows in one pass ---
+        valid_questions = []
+        errors = []
+        for row_number, question_data in enumerate(rows, start=1):
+            validation_error = validate_question_data(question_data)
+            if validation_error:
+                errors.append({'row': row_number, 'error': validation_error})
+                continue
+            question_data.pop('id', None)
+            question_data.pop('order', None)
+            valid_questions.append(question_data)
+
+        if not valid_questions:
+            return jsonify({
+                'error': 'No valid questions to import',
+                'imported': 0,
+                'failed': len(errors),
+                'errors': errors
+            }), 400
+
+        test_ref = db.collection('tests').document(test_id)
+        test_doc = test_ref.get()
+        if not test_doc.exists:
+            return jsonify({'error': 'Test document not found!'}), 404
+        migrate_test_questions(test_ref, test_doc)
+
+        marks_delta = sum(question['marks'] for question in valid_questions)
+
+        # --- One atomic write for all valid questions plus the counters ---
         @firestore.transactional
-        def update_test_remove_question(transaction, test_ref_in_tx, index_to_delete):
+        def add_questions_to_test(transaction, test_ref_in_tx, new_questions):
             snapshot = test_ref_in_tx.get(transaction=transaction)
             if not snapshot.exists:
                 raise FileNotFoundError("Test document not found!")
 
             test_data = snapshot.to_dict()
-            current_questions = test_data.get('questions', [])
-
-            if not isinstance(current_questions, list) or index_to_delete < 0 or index_to_delete >= len(current_questions):
-                raise IndexError("Question index out of bounds or questions format invalid!")
+            first_order = test_data.get('nextOrder', test_data.get('questionCount', 0))
 
-            # Remove the question and get its marks
-            question_to_delete = current_questions.pop(index_to_delete)
-            marks_to_decrement = question_to_delete.get('marks', 0)
+            questions_ref = questions_collection(test_ref_in_tx)
+            question_ids = []
+            for offset, question in enumerate(new_questions):
+                question_ref = questions_ref.document()
+                transaction.set(question_ref, {**question, 'order': first_order + offset})
+                question_ids.append(question_ref.id)
 
-            # Atomically update questions array and decrement totalMarks
             transaction.update(test_ref_in_tx, {
-                'questions': current_questions,
-                'totalMarks': firestore.Increment(-marks_to_decrement) # Decrement by the marks of the deleted question
+                'nextOrder': first_order + len(new_questions),
+                'questionCount': firestore.Increment(len(new_questions)),
+                'totalMarks': firestore.Increment(marks_delta)
             })
-            return marks_to_decrement # Return the value decremented for logging
+            return question_ids
 
         transaction = db.transaction()
-        decremented_marks = update_test_remove_question(transaction, test_ref, question_index)
-        # --- End Transaction ---
-
-        print(f"✅ Question at index {question_index} deleted from test: {test_id}. Decremented total marks by {decremented_marks}.")
+        question_ids = add_questions_to_test(transaction, test_ref, valid_questions)
 
-        # Fetch updated test data to return the full state
-        updated_test_doc = test_ref.get()
-        response_data = updated_test_doc.to_dict()
-        response_data['id'] = updated_test_doc.id
-        response_data.setdefault('totalMarks', 0)
-        response_data.setdefault('questions', [])
+        logger.info(f"Bulk imported {len(question_ids)} question(s) into test: {test_id} ({len(errors)} rejected). Incremented total marks by {marks_delta}.", extra=SAMPLED)
 
-
-        return jsonify(response_data), 200 # Return updated test data
+        return jsonify({
+            'message': f'Imported {len(question_ids)} question(s)',
+            'imported': len(question_ids),
+            'failed': len(errors),
+            'errors': errors,
+            'questionIds': question_ids,
+            'totalMarksAdded': marks_delta
+        }), 200
 
     except FileNotFoundError as fnf_error:
-        print(f"❌ Error deleting question (transaction failed): {str(fnf_error)}")
+        logger.error(f"Error importing questions (transaction failed): {str(fnf_error)}")
         return jsonify({'error': str(fnf_error)}), 404
-    except IndexError as idx_error:
-        print(f"❌ Error deleting question (index invalid): {str(idx_error)}")
-        return jsonify({'error': str(idx_error)}), 400 # Bad request due to invalid index
+    except UnicodeDecodeError:
+        return jsonify({'error': 'CSV file must be UTF-8 encoded'}), 400
+    except Exception as e:
+        logger.exception(f"Error bulk importing questions into test {test_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/admin/migrations/test-questions', methods=['POST'])
+@require_auth
+def migrate_all_test_questions():
+    """Move every test's embedded questions array into its subcollection"""
+    try:
+        tests_migrated = 0
+        questions_moved = 0
+
+        for test_doc in db.collection('tests').stream():
+            moved = migrate_test_questions(test_doc.reference, test_doc)
+            if isinstance(test_doc.to_dict().get('questions'), list):
+                tests_migrated += 1
+                questions_moved += moved
+
+        logger.info(f"Question migration complete: {tests_migrated} test(s), {questions_moved} question(s)", extra=SAMPLED)
+
+        return jsonify({
+            'message': 'Migration complete',
+            'testsMigrated': tests_migrated,
+            'questionsMoved': questions_moved
+        }), 200
+
     except Exception as e:
-        print(f"❌ Error deleting question {question_index} from test {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error migrating test questions: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
 # ============================================
 # QUESTION IMAGE UPLOAD ENDPOINT
 # ============================================
+# Uploads are decoded, resized and re-encoded (WebP + fallback + thumbnail)
+# in a process pool, then stored under a name derived from the original's
+# SHA-256, so identical images are stored once and can be cached forever.
+
+QUESTION_IMAGE_PREFIX = 'question-images'
+QUESTION_IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
+# Complete outputs of image_pipeline.process_image
+QUESTION_IMAGE_VARIANT_SETS = ({'original'}, {'webp', 'fallback', 'thumbnail'})
+QUESTION_IMAGE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+IMAGE_PROCESS_WORKERS = int(os.getenv('IMAGE_PROCESS_WORKERS', 2))
+IMAGE_PROCESS_TIMEOUT = float(os.getenv('IMAGE_PROCESS_TIMEOUT_SECONDS', 60))
+
+_image_pool = None
+_image_pool_pid = None
+_image_pool_lock = threading.Lock()
+
+
+def get_image_pool():
+    """Lazily create this worker's image processing pool"""
+    global _image_pool, _image_pool_pid
+    with _image_pool_lock:
+        if _image_pool is None or _image_pool_pid != os.getpid():
+            # 'spawn' children only import image_pipeline, never this module's
+            # Firebase clients or threads
+            _image_pool = ProcessPoolExecutor(
+                max_workers=IMAGE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            _image_pool_pid = os.getpid()
+        return _image_pool
+
+
+def _shutdown_image_pool():
+    if _image_pool is not None and _image_pool_pid == os.getpid():
+        _image_pool.shutdown(wait=False, cancel_futures=True)
+
+
+atexit.register(_shutdown_image_pool)
+
 
 @app.route('/api/admin/upload-question-image', methods=['POST'])
 @require_auth  # Your admin auth decorator
 def upload_question_image():
-    """Upload a question image to Firebase Storage and return the URL."""
+    """Optimize a question image, store its variants and return their URLs."""
     if not bucket:
         return jsonify({'error': 'Storage service unavailable'}), 503
     
@@ -988,47 +3515,69 @@ def upload_question_image():
             return jsonify({'error': 'No image file provided'}), 400
         
         image_file = request.files['image']
-        storage_path = request.form.get('path')  # Get the desired storage path
-        
-        if not storage_path:
-            return jsonify({'error': 'Storage path not provided'}), 400
         
         # Validate file type
-        allowed_extensions = {'png', 'jpg', 'jpeg', 'gif', 'webp', 'svg'}
         file_extension = image_file.filename.rsplit('.', 1)[1].lower() if '.' in image_file.filename else ''
         
-        if file_extension not in allowed_extensions:
-            return jsonify({'error': f'Invalid file type. Allowed: {", ".join(allowed_extensions)}'}), 400
-        
-        print(f"📤 Uploading question image to: {storage_path}")
+        if file_extension not in QUESTION_IMAGE_EXTENSIONS:
+            return jsonify({'error': f'Invalid file type. Allowed: {", ".join(QUESTION_IMAGE_EXTENSIONS)}'}), 400
         
-        # Upload to Firebase Storage
-        blob = bucket.blob(storage_path)
-        blob.upload_from_file(
-            image_file,
-            content_type=image_file.content_type
-        )
+        image_bytes = image_file.read()
+        digest = image_pipeline.content_digest(image_bytes)
+        prefix = f"{QUESTION_IMAGE_PREFIX}/{digest}"
         
-        # Make the blob publicly readable
-        blob.make_public()
+        # Same content already stored: reuse its variants, skip processing
+        # (names look like question-images/<digest>-<variant>.<ext>)
+        variant_blobs = {
+            blob.name[len(prefix) + 1:].split('.', 1)[0]: blob
+            for blob in bucket.list_blobs(prefix=f"{prefix}-")
+        }
+        if set(variant_blobs) in QUESTION_IMAGE_VARIANT_SETS:
+            logger.info(f"Question image already stored: {digest[:12]}")
+        else:
+            # Nothing stored, or a partial set left by a failed upload:
+            # process again and overwrite
+            variant_blobs = {}
+            logger.info(f"Processing question image {digest[:12]} ({len(image_bytes)} bytes)")
+            
+            future = get_image_pool().submit(image_pipeline.process_image, image_bytes, file_extension)
+            processed = future.result(timeout=IMAGE_PROCESS_TIMEOUT)
+            
+            for variant_name, (variant_bytes, variant_extension) in processed.items():
+                blob = bucket.blob(f"{prefix}-{variant_name}.{variant_extension}")
+                blob.cache_control = QUESTION_IMAGE_CACHE_CONTROL
+                blob.upload_from_string(
+                    variant_bytes,
+                    content_type=image_pipeline.CONTENT_TYPES[variant_extension]
+                )
+                # Make the blob publicly readable
+                blob.make_public()
+                variant_blobs[variant_name] = blob
         
-        # Get public URL
-        image_url = blob.public_url
+        # Main image: optimized WebP when available, else the untouched original
+        main_blob = variant_blobs.get('webp') or variant_blobs.get('original')
+        image_url = main_blob.public_url
         
-        print(f"✅ Question image uploaded successfully: {image_url}")
+        logger.info(f"Question image uploaded successfully: {image_url}", extra=SAMPLED)
         
         return jsonify({
             'success': True,
             'imageUrl': image_url,
-            'storagePath': storage_path
+            'storagePath': main_blob.name,
+            'variants': {name: blob.public_url for name, blob in variant_blobs.items()},
+            'contentHash': digest
         }), 200
         
+    except FuturesTimeoutError:
+        logger.warning("Timeout processing question image")
+        return jsonify({'error': 'Image processing timed out'}), 504
+    except UnidentifiedImageError:
+        return jsonify({'error': 'File is not a valid image'}), 400
     except Exception as e:
-        print(f"❌ Error uploading question image: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error uploading question image: {str(e)}")
         return jsonify({'error': f'Failed to upload image: {str(e)}'}), 500       
 
+
 # ===================================
 # STUDY MATERIALS ENDPOINTS
 # ===================================
@@ -1049,9 +3598,205 @@ def get_materials():
         return jsonify(materials), 200
         
     except Exception as e:
-        print(f"❌ Error fetching materials: {str(e)}")
+        logger.error(f"Error fetching materials: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+# ===================================
+# CONTENT-ADDRESSED MATERIAL STORAGE
+# ===================================
+# Material files are stored once per SHA-256 at materials/by-hash/<digest>.
+# materialBlobs/<digest> counts how many materials reference the object;
+# the object is only deleted when the last reference goes away.
+
+MATERIAL_BLOBS_COLLECTION = 'materialBlobs'
+MATERIAL_HASH_PREFIX = 'materials/by-hash'
+HASH_READ_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_stream(file_obj):
+    """SHA-256 and size of a file-like object, read block by block"""
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        block = file_obj.read(HASH_READ_BLOCK_SIZE)
+        if not block:
+            break
+        digest.update(block)
+        size += len(block)
+    return digest.hexdigest(), size
+
+
+def material_blob_path(digest):
+    return f"{MATERIAL_HASH_PREFIX}/{digest}"
+
+
+@firestore.transactional
+def _acquire_material_blob(transaction, blob_ref):
+    snapshot = blob_ref.get(transaction=transaction)
+    blob_data = snapshot.to_dict() if snapshot.exists else {}
+    already_stored = blob_data.get('refCount', 0) > 0 and blob_data.get('uploaded', False)
+
+    transaction.set(blob_ref, {
+        'refCount': firestore.Increment(1),
+        'storagePath': material_blob_path(blob_ref.id),
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    }, merge=True)
+    return not already_stored
+
+
+def acquire_material_blob(digest):
+    """Add a reference to a content hash, returns True if the caller must upload it"""
+    blob_ref = db.collection(MATERIAL_BLOBS_COLLECTION).document(digest)
+    return _acquire_material_blob(db.transaction(), blob_ref)
+
+
+def record_material_blob_upload(digest, blob, size, content_type):
+    """Mark a content hash as stored, remembering the object generation"""
+    db.collection(MATERIAL_BLOBS_COLLECTION).document(digest).update({
+        'uploaded': True,
+        'generation': blob.generation,
+        'size': size,
+        'contentType': content_type,
+        'updatedAt': firestore.SERVER_TIMESTAMP
+    })
+
+
+def release_material_blob(digest, generation):
+    """Delete an unreferenced object unless it was re-uploaded meanwhile"""
+    try:
+        # A concurrent re-upload creates a new generation, which this skips
+        bucket.blob(material_blob_path(digest)).delete(if_generation_match=generation)
+        logger.info(f"Deleted unreferenced material object: {digest[:12]}")
+    except (NotFound, PreconditionFailed):
+        pass
+
+    @firestore.transactional
+    def drop_if_unreferenced(transaction, blob_ref):
+        snapshot = blob_ref.get(transaction=transaction)
+        if snapshot.exists and snapshot.to_dict().get('refCount', 0) <= 0:
+            transaction.delete(blob_ref)
+
+    drop_if_unreferenced(db.transaction(), db.collection(MATERIAL_BLOBS_COLLECTION).document(digest))
+
+
+@firestore.transactional
+def _abandon_material_blob(transaction, blob_ref):
+    snapshot = blob_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        return None
+
+    blob_data = snapshot.to_dict()
+    remaining = max(0, blob_data.get('refCount', 0) - 1)
+    if remaining == 0 and not blob_data.get('uploaded', False):
+        transaction.delete(blob_ref)  # Nothing was ever stored under this hash
+        return None
+    transaction.update(blob_ref, {'refCount': remaining, 'updatedAt': firestore.SERVER_TIMESTAMP})
+    return blob_data.get('generation') if remaining == 0 else None
+
+
+def abandon_material_blob(digest):
+    """Drop the reference taken by acquire_material_blob after a failed upload or copy"""
+    try:
+        unreferenced_generation = _abandon_material_blob(
+            db.transaction(), db.collection(MATERIAL_BLOBS_COLLECTION).document(digest)
+        )
+        if unreferenced_generation is not None:
+            release_material_blob(digest, unreferenced_generation)
+    except Exception as e:
+        logger.exception(f"Could not release material reference {digest[:12]}: {e}")
+
+
+def store_material_content(file_obj, content_type):
+    """
+    Hash a seekable file and store it under its digest unless it already
+    exists. Returns (digest, storage_path, uploaded).
+    """
+    digest, size = hash_stream(file_obj)
+    file_obj.seek(0)
+
+    storage_path = material_blob_path(digest)
+    if not acquire_material_blob(digest):
+        logger.info(f"Material content already stored, skipping upload: {digest[:12]}")
+        return digest, storage_path, False
+
+    blob = bucket.blob(storage_path)
+    try:
+        blob.upload_from_file(file_obj, content_type=content_type, size=size)
+        record_material_blob_upload(digest, blob, size, content_type)
+    except Exception:
+        abandon_material_blob(digest)
+        raise
+    return digest, storage_path, True
+
+
+def adopt_staged_material(staged_blob):
+    """
+    Move an object uploaded to a staging path to its content address.
+    The digest is computed by streaming the object once; storage copies
+    are server-side. Returns (digest, storage_path).
+    """
+    with staged_blob.open('rb', chunk_size=HASH_READ_BLOCK_SIZE) as staged_file:
+        digest, size = hash_stream(staged_file)
+
+    storage_path = material_blob_path(digest)
+    if acquire_material_blob(digest):
+        try:
+            new_blob = bucket.copy_blob(staged_blob, bucket, storage_path)
+            record_material_blob_upload(digest, new_blob, size, staged_blob.content_type)
+        except Exception:
+            abandon_material_blob(digest)
+            raise
+    else:
+        logger.info(f"Material content already stored, dropping staged copy: {digest[:12]}")
+
+    staged_blob.delete()
+    return digest, storage_path
+
+
+@firestore.transactional
+def _delete_material_in_transaction(transaction, material_ref):
+    snapshot = material_ref.get(transaction=transaction)
+    if not snapshot.exists:
+        raise FileNotFoundError("Material not found")
+
+    digest = snapshot.to_dict().get('contentHash')
+    unreferenced = None
+    if digest:
+        blob_ref = db.collection(MATERIAL_BLOBS_COLLECTION).document(digest)
+        blob_snapshot = blob_ref.get(transaction=transaction)
+        if blob_snapshot.exists:
+            blob_data = blob_snapshot.to_dict()
+            remaining = max(0, blob_data.get('refCount', 0) - 1)
+            transaction.update(blob_ref, {'refCount': remaining, 'updatedAt': firestore.SERVER_TIMESTAMP})
+            if remaining == 0:
+                unreferenced = (digest, blob_data.get('generation'))
+
+    transaction.delete(material_ref)
+    return unreferenced
+
+
+MATERIAL_REQUIRED_FIELDS = ['title', 'subject', 'type', 'access', 'size']
+
+
+def build_material_record(metadata, filename, content_type, storage_path, uploaded_by, admin_name):
+    """Build the Firestore document for a material from its upload metadata"""
+    return {
+        'title': metadata['title'],
+        'subject': metadata['subject'],
+        'type': metadata['type'],
+        'description': metadata.get('description', ''),
+        'access': metadata['access'],
+        'size': metadata['size'], # Use size from JS metadata
+        'filename': filename, # Original filename
+        'contentType': content_type,
+        'uploadedAt': firestore.SERVER_TIMESTAMP,
+        'uploadedBy': uploaded_by,
+        'uploadedByName': metadata.get('uploadedByName', admin_name), # Use name from metadata or admin data
+        'downloads': 0,
+        'storageUrl': storage_path # Store the FULL PATH used in Storage
+    }
+
+
 @app.route('/api/materials', methods=['POST'])
 @require_auth
 def create_material():
@@ -1076,100 +3821,530 @@ def create_material():
         uploaded_file = request.files['file']
 
         # Validate required fields *within the parsed metadata*
-        required_fields = ['title', 'subject', 'type', 'access', 'size']
-        for field in required_fields:
+        for field in MATERIAL_REQUIRED_FIELDS:
+            if field not in metadata:
+                return jsonify({'error': f'Missing required field in metadata: {field}'}), 400
+
+        # --- Upload File to Firebase Storage ---
+        filename = uploaded_file.filename
+
+        logger.info(f"Storing file '{filename}' by content hash...")
+
+        # Stored at materials/by-hash/<sha256>; identical content is uploaded once
+        content_hash, storage_path, uploaded = store_material_content(
+            uploaded_file.stream,
+            uploaded_file.content_type
+        )
+
+        logger.info(f"File stored at '{storage_path}' ({'uploaded' if uploaded else 'deduplicated'}).", extra=SAMPLED)
+        # --- End Upload ---
+
+        # Prepare data for Firestore, merging metadata and file info
+        data_to_save = build_material_record(
+            metadata,
+            filename,
+            uploaded_file.content_type,
+            storage_path,
+            request.uid,
+            request.admin_data.get('name', 'Admin')
+        )
+        data_to_save['contentHash'] = content_hash
+
+        # Save metadata to Firestore
+        doc_ref = db.collection('materials').add(data_to_save)
+
+        logger.info(f"Material metadata saved to Firestore: {doc_ref[1].id}", extra=SAMPLED)
+
+        return jsonify({
+            'id': doc_ref[1].id,
+            'message': 'Material uploaded and metadata saved successfully'
+        }), 201
+
+    except Exception as e:
+        logger.exception(f"Error creating material: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@app.route('/api/materials/<material_id>', methods=['PUT'])
+@require_auth
+def update_material(material_id):
+    """Update a study material"""
+    try:
+        data = request.json
+        
+        # Remove fields that shouldn't be updated
+        data.pop('id', None)
+        data.pop('uploadedAt', None)
+        data.pop('uploadedBy', None)
+        data.pop('storageUrl', None)  # Storage references are reference-counted
+        data.pop('contentHash', None)
+        
+        # Update in Firestore
+        db.collection('materials').document(material_id).update(data)
+        
+        logger.info(f"Material updated: {material_id}", extra=SAMPLED)
+        
+        return jsonify({'message': 'Material updated successfully'}), 200
+        
+    except Exception as e:
+        logger.error(f"Error updating material: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/materials/<material_id>', methods=['DELETE'])
+@require_auth
+def delete_material(material_id):
+    """Delete a study material (and its file once no other material uses it)"""
+    try:
+        material_ref = db.collection('materials').document(material_id)
+        unreferenced = _delete_material_in_transaction(db.transaction(), material_ref)
+        
+        if unreferenced:
+            release_material_blob(*unreferenced)
+        
+        logger.info(f"Material deleted: {material_id}", extra=SAMPLED)
+        
+        return jsonify({'message': 'Material deleted successfully'}), 200
+        
+    except FileNotFoundError as fnf_error:
+        return jsonify({'error': str(fnf_error)}), 404
+    except Exception as e:
+        logger.error(f"Error deleting material: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ===================================
+# CHUNKED MATERIAL UPLOADS (RESUMABLE)
+# ===================================
+# init -> append chunks -> finalize. Each chunk request body is piped
+# straight into a Cloud Storage resumable upload session, so the worker
+# never holds more than one chunk (and in practice one socket buffer).
+# Session state lives in Firestore, so any worker can serve any chunk.
+# Set STORAGE_EMULATOR_HOST to run against a local fake GCS server.
+
+UPLOAD_SESSIONS_COLLECTION = 'uploadSessions'
+GCS_CHUNK_ALIGNMENT = 256 * 1024  # Non-final chunks must be multiples of this
+UPLOAD_CHUNK_SIZE = int(os.getenv('UPLOAD_CHUNK_SIZE_MB', 8)) * 1024 * 1024
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv('UPLOAD_MAX_CHUNK_SIZE_MB', 32)) * 1024 * 1024
+
+
+def _parse_gcs_committed_offset(gcs_response):
+    """Return the next byte offset from a 308 'Range: bytes=0-N' header"""
+    range_header = gcs_response.headers.get('Range')
+    if not range_header:
+        return 0
+    return int(range_header.rsplit('-', 1)[1]) + 1
+
+
+@app.route('/api/materials/uploads', methods=['POST'])
+@require_auth
+def init_material_upload():
+    """Start a chunked material upload and open a resumable storage session"""
+    if not bucket:
+        return jsonify({'error': 'Firebase Storage not initialized'}), 500
+
+    try:
+        data = request.json or {}
+        filename = data.get('filename')
+        content_type = data.get('contentType') or 'application/octet-stream'
+        metadata = data.get('metadata') or {}
+
+        try:
+            total_size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Missing or invalid file size'}), 400
+
+        if not filename:
+            return jsonify({'error': 'Missing filename'}), 400
+        if total_size <= 0:
+            return jsonify({'error': 'File is empty'}), 400
+        for field in MATERIAL_REQUIRED_FIELDS:
             if field not in metadata:
                 return jsonify({'error': f'Missing required field in metadata: {field}'}), 400
 
-        # --- Upload File to Firebase Storage ---
-        filename = uploaded_file.filename
-        # Define the path in Storage (e.g., "materials/filename.pdf")
-        # Make sure this matches the path your *other* backend expects
-        storage_path = f"materials/{filename}"
+        # Staged under a unique path, moved to its content address on finalize
+        storage_path = f"materials/staging/{uuid.uuid4().hex}"
+        blob = bucket.blob(storage_path)
+        session_url = blob.create_resumable_upload_session(content_type=content_type, size=total_size)
+
+        _, session_ref = db.collection(UPLOAD_SESSIONS_COLLECTION).add({
+            'sessionUrl': session_url,
+            'storagePath': storage_path,
+            'filename': filename,
+            'contentType': content_type,
+            'totalSize': total_size,
+            'offset': 0,
+            'status': 'uploading',
+            'metadata': metadata,
+            'createdBy': request.uid,
+            'createdByName': request.admin_data.get('name', 'Admin'),
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+
+        logger.info(f"Upload session started: {session_ref.id} -> '{storage_path}' ({total_size} bytes)")
+
+        return jsonify({
+            'uploadId': session_ref.id,
+            'chunkSize': UPLOAD_CHUNK_SIZE,
+            'chunkAlignment': GCS_CHUNK_ALIGNMENT,
+            'offset': 0,
+            'totalSize': total_size
+        }), 201
+
+    except Exception as e:
+        logger.exception(f"Error starting material upload: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/materials/uploads/<upload_id>', methods=['GET'])
+@require_auth
+def get_material_upload(upload_id):
+    """Get the committed offset of an upload session (to resume)"""
+    try:
+        session_doc = db.collection(UPLOAD_SESSIONS_COLLECTION).document(upload_id).get()
+        if not session_doc.exists:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        session = session_doc.to_dict()
+        return jsonify({
+            'uploadId': upload_id,
+            'offset': session.get('offset', 0),
+            'totalSize': session.get('totalSize'),
+            'status': session.get('status')
+        }), 200
+
+    except Exception as e:
+        logger.error(f"Error fetching upload session {upload_id}: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
 
-        blob = bucket.blob(storage_path)
+@app.route('/api/materials/uploads/<upload_id>', methods=['PUT'])
+@require_auth
+def append_material_upload_chunk(upload_id):
+    """
+    Append one chunk. The body is the raw chunk, the 'Upload-Offset' header
+    (or ?offset=) must equal the session's committed offset.
+    """
+    try:
+        session_ref = db.collection(UPLOAD_SESSIONS_COLLECTION).document(upload_id)
+        session_doc = session_ref.get()
+        if not session_doc.exists:
+            return jsonify({'error': 'Upload session not found'}), 404
 
-        print(f"📤 Uploading file '{filename}' to Storage path: '{storage_path}'...")
+        session = session_doc.to_dict()
+        if session.get('status') != 'uploading':
+            return jsonify({'error': f"Upload session is {session.get('status')}"}), 409
 
-        # Upload the file from the request stream
-        blob.upload_from_file(
-            uploaded_file,
-            content_type=uploaded_file.content_type
+        committed = session.get('offset', 0)
+        total_size = session['totalSize']
+        try:
+            offset = int(request.headers.get('Upload-Offset', request.args.get('offset')))
+        except (TypeError, ValueError):
+            offset = None
+        chunk_size = request.content_length
+
+        if offset != committed:
+            return jsonify({'error': 'Offset mismatch', 'offset': committed}), 409
+        if not chunk_size:
+            return jsonify({'error': 'Content-Length required'}), 411
+        if chunk_size > UPLOAD_MAX_CHUNK_SIZE:
+            return jsonify({'error': f'Chunk too large, maximum is {UPLOAD_MAX_CHUNK_SIZE} bytes'}), 413
+
+        end = committed + chunk_size
+        if end > total_size:
+            return jsonify({'error': 'Chunk exceeds declared file size', 'offset': committed}), 400
+        if end < total_size and chunk_size % GCS_CHUNK_ALIGNMENT:
+            return jsonify({'error': f'Non-final chunks must be a multiple of {GCS_CHUNK_ALIGNMENT} bytes'}), 400
+
+        # Stream the request body straight into the resumable session
+        # A consumed body stream cannot be replayed, so no automatic retry:
+        # transient failures surface as 502 and the client resends the chunk
+        gcs_response = http_client.put(
+            session['sessionUrl'],
+            retry=False,
+            data=BoundedStream(request.stream, chunk_size),
+            headers={
+                'Content-Length': str(chunk_size),
+                'Content-Range': f'bytes {committed}-{end - 1}/{total_size}'
+            },
+            timeout=300
         )
 
-        print(f"✅ File uploaded successfully.")
-        # --- End Upload ---
+        if gcs_response.status_code == 308:
+            new_offset = _parse_gcs_committed_offset(gcs_response)
+            complete = False
+        elif gcs_response.status_code in (200, 201):
+            new_offset = total_size
+            complete = True
+        else:
+            logger.error(f"Storage rejected chunk for {upload_id}: {gcs_response.status_code} {gcs_response.text[:200]}")
+            return jsonify({'error': 'Storage rejected the chunk', 'offset': committed}), 502
 
-        # Prepare data for Firestore, merging metadata and file info
-        data_to_save = {
-            'title': metadata['title'],
-            'subject': metadata['subject'],
-            'type': metadata['type'],
-            'description': metadata.get('description', ''),
-            'access': metadata['access'],
-            'size': metadata['size'], # Use size from JS metadata
-            'filename': filename, # Original filename
-            'contentType': uploaded_file.content_type,
-            'uploadedAt': firestore.SERVER_TIMESTAMP,
-            'uploadedBy': request.uid,
-            'uploadedByName': metadata.get('uploadedByName', request.admin_data.get('name', 'Admin')), # Use name from metadata or admin data
-            'downloads': 0,
-            'storageUrl': storage_path # Store the FULL PATH used in Storage
-        }
+        session_ref.update({
+            'offset': new_offset,
+            'status': 'uploaded' if complete else 'uploading',
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
 
-        # Save metadata to Firestore
-        doc_ref = db.collection('materials').add(data_to_save)
+        return jsonify({
+            'uploadId': upload_id,
+            'offset': new_offset,
+            'totalSize': total_size,
+            'complete': complete
+        }), 200
+
+    except requests.exceptions.Timeout:
+        logger.warning(f"Timeout streaming chunk for upload {upload_id}")
+        return jsonify({'error': 'Upload timeout'}), 504
+    except Exception as e:
+        logger.exception(f"Error appending upload chunk {upload_id}: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+
+@app.route('/api/materials/uploads/<upload_id>/finalize', methods=['POST'])
+@require_auth
+def finalize_material_upload(upload_id):
+    """Verify the uploaded object and write the materials document"""
+    try:
+        session_ref = db.collection(UPLOAD_SESSIONS_COLLECTION).document(upload_id)
+        session_doc = session_ref.get()
+        if not session_doc.exists:
+            return jsonify({'error': 'Upload session not found'}), 404
+
+        session = session_doc.to_dict()
+        if session.get('status') == 'finalized':
+            return jsonify({'id': session.get('materialId'), 'message': 'Upload already finalized'}), 200
+        if session.get('status') != 'uploaded':
+            return jsonify({'error': 'Upload is not complete', 'offset': session.get('offset', 0)}), 409
+
+        blob = bucket.get_blob(session['storagePath'])
+        if blob is None or blob.size != session['totalSize']:
+            return jsonify({'error': 'Uploaded object is missing or has the wrong size'}), 409
+
+        content_hash, storage_path = adopt_staged_material(blob)
+
+        data_to_save = build_material_record(
+            session['metadata'],
+            session['filename'],
+            session['contentType'],
+            storage_path,
+            session['createdBy'],
+            session.get('createdByName', 'Admin')
+        )
+        data_to_save['contentHash'] = content_hash
+
+        # Material doc and session status change commit together
+        material_ref = db.collection('materials').document()
+        batch = db.batch()
+        batch.set(material_ref, data_to_save)
+        batch.update(session_ref, {
+            'status': 'finalized',
+            'materialId': material_ref.id,
+            'storagePath': storage_path,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        batch.commit()
 
-        print(f"✅ Material metadata saved to Firestore: {doc_ref[1].id}")
+        logger.info(f"Material metadata saved to Firestore: {material_ref.id} (upload {upload_id})", extra=SAMPLED)
 
         return jsonify({
-            'id': doc_ref[1].id,
+            'id': material_ref.id,
             'message': 'Material uploaded and metadata saved successfully'
         }), 201
 
     except Exception as e:
-        print(f"❌ Error creating material: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error finalizing upload {upload_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-@app.route('/api/materials/<material_id>', methods=['PUT'])
+# ===================================
+# DIRECT-TO-STORAGE UPLOADS (V4 SIGNED URLS)
+# ===================================
+# The browser uploads file bytes straight to Cloud Storage with a short
+# lived signed URL; this API only signs the request and, on /complete,
+# verifies the object and writes the Firestore document.
+
+SIGNED_UPLOAD_TTL = timedelta(minutes=int(os.getenv('SIGNED_UPLOAD_TTL_MINUTES', 15)))
+SIGNED_UPLOAD_MAX_BYTES = {
+    'material': app.config['MAX_CONTENT_LENGTH'],
+    'questionImage': int(os.getenv('MAX_QUESTION_IMAGE_SIZE_MB', 10)) * 1024 * 1024
+}
+
+
+def _safe_storage_filename(filename):
+    """Strip directories and unusual characters from a client filename"""
+    name = os.path.basename(filename or '').strip()
+    name = re.sub(r'[^A-Za-z0-9._-]+', '_', name)
+    return name or 'file'
+
+
+@app.route('/api/admin/uploads/sign', methods=['POST'])
 @require_auth
-def update_material(material_id):
-    """Update a study material"""
+def sign_upload():
+    """
+    Issue a V4 signed URL for uploading directly to Storage.
+
+    Body: {"kind": "material" | "questionImage", "filename", "contentType",
+    "size", "resumable" (optional), "metadata" (materials) or "testId"
+    (question images)}. The storage path is generated here, never taken
+    from the client.
+    """
+    if not bucket:
+        return jsonify({'error': 'Storage service unavailable'}), 503
+
     try:
-        data = request.json
-        
-        # Remove fields that shouldn't be updated
-        data.pop('id', None)
-        data.pop('uploadedAt', None)
-        data.pop('uploadedBy', None)
-        
-        # Update in Firestore
-        db.collection('materials').document(material_id).update(data)
-        
-        print(f"✅ Material updated: {material_id}")
-        
-        return jsonify({'message': 'Material updated successfully'}), 200
-        
+        data = request.json or {}
+        kind = data.get('kind')
+        filename = _safe_storage_filename(data.get('filename'))
+        content_type = data.get('contentType')
+        resumable = bool(data.get('resumable', False))
+        metadata = data.get('metadata') or {}
+
+        try:
+            size = int(data.get('size'))
+        except (TypeError, ValueError):
+            return jsonify({'error': 'Missing or invalid file size'}), 400
+
+        if kind not in SIGNED_UPLOAD_MAX_BYTES:
+            return jsonify({'error': 'Invalid upload kind'}), 400
+        if not content_type:
+            return jsonify({'error': 'Missing contentType'}), 400
+        if size <= 0 or size > SIGNED_UPLOAD_MAX_BYTES[kind]:
+            return jsonify({'error': f'File size must be between 1 and {SIGNED_UPLOAD_MAX_BYTES[kind]} bytes'}), 400
+
+        upload_key = uuid.uuid4().hex
+        if kind == 'material':
+            for field in MATERIAL_REQUIRED_FIELDS:
+                if field not in metadata:
+                    return jsonify({'error': f'Missing required field in metadata: {field}'}), 400
+            storage_path = f"materials/uploads/{upload_key}/{filename}"
+        else:
+            extension = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+            if extension not in QUESTION_IMAGE_EXTENSIONS:
+                return jsonify({'error': f'Invalid file type. Allowed: {", ".join(QUESTION_IMAGE_EXTENSIONS)}'}), 400
+            test_id = _safe_storage_filename(data.get('testId') or 'unassigned')
+            storage_path = f"test-questions/{test_id}/{upload_key}.{extension}"
+
+        blob = bucket.blob(storage_path)
+        if resumable:
+            # Client POSTs with 'x-goog-resumable: start' to open a session
+            upload_url = blob.generate_signed_url(
+                version='v4',
+                expiration=SIGNED_UPLOAD_TTL,
+                method='POST',
+                content_type=content_type,
+                headers={'x-goog-resumable': 'start'}
+            )
+            upload_method = 'POST'
+            upload_headers = {'Content-Type': content_type, 'x-goog-resumable': 'start'}
+        else:
+            upload_url = blob.generate_signed_url(
+                version='v4',
+                expiration=SIGNED_UPLOAD_TTL,
+                method='PUT',
+                content_type=content_type
+            )
+            upload_method = 'PUT'
+            upload_headers = {'Content-Type': content_type}
+
+        _, session_ref = db.collection(UPLOAD_SESSIONS_COLLECTION).add({
+            'kind': kind,
+            'storagePath': storage_path,
+            'filename': data.get('filename') or filename,
+            'contentType': content_type,
+            'totalSize': size,
+            'status': 'signed',
+            'metadata': metadata,
+            'createdBy': request.uid,
+            'createdByName': request.admin_data.get('name', 'Admin'),
+            'expiresAt': datetime.now() + SIGNED_UPLOAD_TTL,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+
+        logger.info(f"Signed {upload_method} upload URL issued: {session_ref.id} -> '{storage_path}'")
+
+        return jsonify({
+            'uploadId': session_ref.id,
+            'uploadUrl': upload_url,
+            'method': upload_method,
+            'headers': upload_headers,
+            'storagePath': storage_path,
+            'expiresInSeconds': int(SIGNED_UPLOAD_TTL.total_seconds())
+        }), 201
+
     except Exception as e:
-        print(f"❌ Error updating material: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.exception(f"Error signing upload URL: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
-@app.route('/api/materials/<material_id>', methods=['DELETE'])
+
+@app.route('/api/admin/uploads/complete', methods=['POST'])
 @require_auth
-def delete_material(material_id):
-    """Delete a study material"""
+def complete_signed_upload():
+    """Verify a directly uploaded object and record it. Body: {"uploadId"}"""
+    if not bucket:
+        return jsonify({'error': 'Storage service unavailable'}), 503
+
     try:
-        db.collection('materials').document(material_id).delete()
-        
-        print(f"✅ Material deleted: {material_id}")
-        
-        return jsonify({'message': 'Material deleted successfully'}), 200
-        
+        data = request.json or {}
+        upload_id = data.get('uploadId')
+        if not upload_id:
+            return jsonify({'error': 'Missing uploadId'}), 400
+
+        session_ref = db.collection(UPLOAD_SESSIONS_COLLECTION).document(upload_id)
+        session_doc = session_ref.get()
+        if not session_doc.exists:
+            return jsonify({'error': 'Upload not found'}), 404
+
+        session = session_doc.to_dict()
+        if session.get('status') == 'finalized':
+            return jsonify({**session.get('result', {}), 'message': 'Upload already completed'}), 200
+        if session.get('status') != 'signed':
+            return jsonify({'error': f"Upload is {session.get('status')}"}), 409
+
+        # Verify what actually landed in the bucket
+        blob = bucket.get_blob(session['storagePath'])
+        if blob is None:
+            return jsonify({'error': 'Uploaded object not found in storage'}), 409
+        if blob.content_type != session['contentType'] or blob.size != session['totalSize']:
+            blob.delete()
+            session_ref.update({'status': 'rejected', 'updatedAt': firestore.SERVER_TIMESTAMP})
+            logger.warning(f"Rejected signed upload {upload_id}: {blob.content_type}, {blob.size} bytes")
+            return jsonify({'error': 'Uploaded object does not match the signed content type or size'}), 400
+
+        batch = db.batch()
+        if session['kind'] == 'material':
+            material_ref = db.collection('materials').document()
+            batch.set(material_ref, build_material_record(
+                session['metadata'],
+                session['filename'],
+                session['contentType'],
+                session['storagePath'],
+                session['createdBy'],
+                session.get('createdByName', 'Admin')
+            ))
+            result = {'id': material_ref.id}
+            status_code = 201
+        else:
+            blob.make_public()
+            result = {
+                'success': True,
+                'imageUrl': blob.public_url,
+                'storagePath': session['storagePath']
+            }
+            status_code = 200
+
+        batch.update(session_ref, {
+            'status': 'finalized',
+            'result': result,
+            'updatedAt': firestore.SERVER_TIMESTAMP
+        })
+        batch.commit()
+
+        logger.info(f"Signed upload completed: {upload_id} ({session['kind']})", extra=SAMPLED)
+
+        return jsonify({**result, 'message': 'Upload completed successfully'}), status_code
+
     except Exception as e:
-        print(f"❌ Error deleting material: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+        logger.exception(f"Error completing signed upload: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 # ===================================
 # DOUBTS MANAGEMENT ENDPOINTS
@@ -1191,7 +4366,7 @@ def get_doubts():
         return jsonify(doubts), 200
 
     except Exception as e:
-        print(f"❌ Error fetching doubts: {str(e)}")
+        logger.error(f"Error fetching doubts: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/doubts/<doubt_id>', methods=['GET'])
@@ -1210,7 +4385,7 @@ def get_doubt_details(doubt_id):
         return jsonify(doubt_data), 200
 
     except Exception as e:
-        print(f"❌ Error fetching doubt details: {str(e)}")
+        logger.error(f"Error fetching doubt details: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/doubts/<doubt_id>/reply', methods=['POST'])
@@ -1248,14 +4423,12 @@ def reply_to_doubt(doubt_id):
 
         db.collection('doubts').document(doubt_id).update(update_data)
 
-        print(f"✅ Reply appended to doubt conversation: {doubt_id} by {admin_name}")
+        logger.info(f"Reply appended to doubt conversation: {doubt_id} by {admin_name}", extra=SAMPLED)
 
         return jsonify({'message': 'Reply sent successfully'}), 200
 
     except Exception as e:
-        print(f"❌ Error replying to doubt: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error replying to doubt: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/api/doubts/<doubt_id>', methods=['DELETE'])
@@ -1265,12 +4438,12 @@ def delete_doubt(doubt_id):
     try:
         db.collection('doubts').document(doubt_id).delete()
 
-        print(f"✅ Doubt deleted: {doubt_id}")
+        logger.info(f"Doubt deleted: {doubt_id}", extra=SAMPLED)
 
         return jsonify({'message': 'Doubt deleted successfully'}), 200
 
     except Exception as e:
-        print(f"❌ Error deleting doubt: {str(e)}")
+        logger.error(f"Error deleting doubt: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -1301,7 +4474,7 @@ def get_users():
         return jsonify(users), 200
         
     except Exception as e:
-        print(f"❌ Error fetching users: {str(e)}")
+        logger.error(f"Error fetching users: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<user_id>', methods=['GET'])
@@ -1327,7 +4500,7 @@ def get_user_details(user_id):
         return jsonify(user_data), 200
         
     except Exception as e:
-        print(f"❌ Error fetching user details: {str(e)}")
+        logger.error(f"Error fetching user details: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<user_id>', methods=['PUT'])
@@ -1344,13 +4517,14 @@ def update_user(user_id):
         
         # Update in Firestore
         db.collection('users').document(user_id).update(data)
+        invalidate_principal('users', user_id)
         
-        print(f"✅ User updated: {user_id}")
+        logger.info(f"User updated: {user_id}", extra=SAMPLED)
         
         return jsonify({'message': 'User updated successfully'}), 200
         
     except Exception as e:
-        print(f"❌ Error updating user: {str(e)}")
+        logger.error(f"Error updating user: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<user_id>', methods=['DELETE'])
@@ -1370,104 +4544,203 @@ def delete_user(user_id):
         # Delete from Firebase Auth if UID exists
         if firebase_uid:
             try:
-                auth.delete_user(firebase_uid)
-                print(f"✅ User deleted from Firebase Auth: {firebase_uid}")
+                auth.delete_user(firebase_uid, app=get_firebase_app())
+                logger.info(f"User deleted from Firebase Auth: {firebase_uid}", extra=SAMPLED)
             except Exception as e:
-                print(f"⚠️ Firebase Auth deletion failed: {str(e)}")
+                logger.warning(f"Firebase Auth deletion failed: {str(e)}")
         
         # Delete from Firestore
         db.collection('users').document(user_id).delete()
+        invalidate_principal('users', user_id, firebase_uid)
+        
+        logger.info(f"User deleted from Firestore: {user_id}", extra=SAMPLED)
         
-        print(f"✅ User deleted from Firestore: {user_id}")
+        # Attempts, doubts and access grants are removed by a background job
+        job_id = cascade_runner.enqueue('user', firebase_uid or user_id, request.uid)
         
-        return jsonify({'message': 'User deleted successfully'}), 200
+        return jsonify({
+            'message': 'User deleted successfully',
+            'cleanupJobId': job_id
+        }), 200
         
     except Exception as e:
-        print(f"❌ Error deleting user: {str(e)}")
+        logger.error(f"Error deleting user: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+# ===================================
+# BACKGROUND JOB STATUS
+# ===================================
+
+@app.route('/api/admin/jobs/<job_id>', methods=['GET'])
+@require_auth
+def get_job_status(job_id):
+    """Get the progress of a background job (polled by the admin UI)"""
+    try:
+        job_doc = db.collection(JOBS_COLLECTION).document(job_id).get()
+
+        if not job_doc.exists:
+            return jsonify({'error': 'Job not found'}), 404
+
+        job_data = expire_stale_job(job_doc)
+        job_data['id'] = job_doc.id
+
+        for field in ['createdAt', 'updatedAt', 'completedAt']:
+            if job_data.get(field) and hasattr(job_data[field], 'isoformat'):
+                job_data[field] = job_data[field].isoformat()
+
+        return jsonify(job_data), 200
+
+    except Exception as e:
+        logger.error(f"Error fetching job {job_id}: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/admin/jobs/reconcile-user-stats', methods=['POST'])
+@require_auth
+def start_stats_reconciliation():
+    """Start a user stats reconciliation job (dry run unless dryRun is false)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        dry_run = bool(data.get('dryRun', True))
+
+        _, job_ref = db.collection(JOBS_COLLECTION).add({
+            'type': 'statsReconciliation',
+            'status': 'pending',
+            'phase': None,
+            'dryRun': dry_run,
+            'report': None,
+            'error': None,
+            'leaseOwner': None,
+            'leaseExpiresAt': time.time() + JOB_LEASE_SECONDS,
+            'createdBy': request.uid,
+            'createdAt': firestore.SERVER_TIMESTAMP,
+            'updatedAt': firestore.SERVER_TIMESTAMP,
+            'completedAt': None
+        })
+
+        threading.Thread(
+            target=run_stats_reconciliation_job,
+            args=(job_ref, dry_run),
+            name='stats-reconciliation',
+            daemon=True
+        ).start()
+
+        logger.info(f"Stats reconciliation job started: {job_ref.id} (dry run: {dry_run})")
+
+        return jsonify({
+            'jobId': job_ref.id,
+            'dryRun': dry_run,
+            'message': 'Stats reconciliation started'
+        }), 202
+
+    except Exception as e:
+        logger.exception(f"Error starting stats reconciliation: {str(e)}")
+        return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+# ===================================
+# ASYNC FIRESTORE FAN-OUT
+# ===================================
+# The analytics endpoints issue many independent queries. They run as
+# coroutines on a per-process event loop thread that owns a
+# firestore.AsyncClient and are awaited together with asyncio.gather, so a
+# request costs roughly its slowest query instead of the sum of all of them.
+# Views stay synchronous (gunicorn sync workers) and block on the result.
+
+ASYNC_FAN_OUT_TIMEOUT_SECONDS = int(os.getenv('ASYNC_FAN_OUT_TIMEOUT_SECONDS', 30))
+
+
+class AsyncFirestoreRunner:
+    """Event loop thread plus AsyncClient, created lazily (and again after a fork)"""
+
+    def __init__(self):
+        self._loop = None
+        self._client = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _ensure_loop(self):
+        if self._loop is not None and self._pid == os.getpid():
+            return self._loop
+        with self._lock:
+            if self._loop is None or self._pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='firestore-async', daemon=True).start()
+                self._client = None
+                self._loop = loop
+                self._pid = os.getpid()
+            return self._loop
+
+    async def _call(self, coroutine_fn, args, trace):
+        current_firestore_trace.set(trace)  # This task's context only; gathered children inherit it
+        if self._client is None:
+            # Built inside the loop so its gRPC channel is bound to it
+            firebase_app = get_firebase_app()
+            self._client = firestore.AsyncClient(
+                project=firebase_app.project_id,
+                credentials=firebase_app.credential.get_credential()
+            )
+        return await coroutine_fn(self._client, *args)
+
+    def run(self, coroutine_fn, *args):
+        """Run coroutine_fn(async_client, *args) on the loop and wait for its result"""
+        future = asyncio.run_coroutine_threadsafe(self._call(coroutine_fn, args, current_firestore_trace.get()), self._ensure_loop())
+        try:
+            return future.result(ASYNC_FAN_OUT_TIMEOUT_SECONDS)
+        except FuturesTimeoutError:
+            future.cancel()
+            raise
+
+
+async_firestore = AsyncFirestoreRunner()
+
+
+async def count_documents(query):
+    """Count matches without transferring fields (names only)"""
+    count = 0
+    async for _ in query.select([]).stream():
+        count += 1
+    return count
+
+
+async def fetch_documents(query):
+    return [doc async for doc in query.stream()]
+
+
+async def get_documents_by_id(client, collection, doc_ids):
+    """{doc_id: snapshot} for existing docs, one batched read"""
+    refs = [client.collection(collection).document(doc_id) for doc_id in set(doc_ids) if doc_id]
+    if not refs:
+        return {}
+    return {snapshot.id: snapshot async for snapshot in client.get_all(refs) if snapshot.exists}
+
 # ===================================
 # DASHBOARD ANALYTICS
 # ===================================
 
 @app.route('/api/dashboard/analytics', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_dashboard_analytics():
     """Get comprehensive dashboard analytics with real data"""
     try:
-        from datetime import datetime, timedelta
-        
-        # ===================================
-        # 1. COUNT TOTAL STUDENTS
-        # ===================================
-        students_ref = db.collection('users')
-        students_count = len(list(students_ref.stream()))
-        
-        # ===================================
-        # 2. COUNT VIDEOS
-        # ===================================
-        videos_count = len(list(db.collection('videos').stream()))
-        
-        # ===================================
-        # 3. COUNT TESTS
-        # ===================================
-        tests_count = len(list(db.collection('tests').stream()))
-        
-        # ===================================
-        # 4. COUNT PENDING DOUBTS
-        # ===================================
-        doubts_ref = db.collection('doubts').where('status', '==', 'pending')
-        pending_doubts = len(list(doubts_ref.stream()))
-        
-        # ===================================
-        # 5. CALCULATE ACTIVE USERS (last 7 days)
-        # ===================================
-        seven_days_ago = datetime.now() - timedelta(days=7)
-        active_users_ref = db.collection('users').where('updatedAt', '>=', seven_days_ago)
-        active_users = len(list(active_users_ref.stream()))
-        
-        # ===================================
-        # 6. NEW STUDENTS THIS MONTH
-        # ===================================
-        start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-        new_students_ref = db.collection('users').where('createdAt', '>=', start_of_month)
-        new_students_this_month = len(list(new_students_ref.stream()))
+        dashboard = async_firestore.run(gather_dashboard_data)
         
         # ===================================
-        # 7. REVENUE (Placeholder for now)
+        # REVENUE (Placeholder for now)
         # ===================================
         total_revenue = 0
         revenue_this_month = 0
         
         # ===================================
-        # 8. RECENT ACTIVITY FEED
+        # RECENT ACTIVITY FEED
         # ===================================
         recent_activity = []
         
-        # Get recent test attempts (last 5)
-        recent_attempts = db.collection('testAttempts')\
-            .order_by('submittedAt', direction=firestore.Query.DESCENDING)\
-            .limit(5)\
-            .stream()
-        
-        for attempt_doc in recent_attempts:
+        for attempt_doc in dashboard['recentAttempts']:
             attempt_data = attempt_doc.to_dict()
-            user_id = attempt_data.get('userId')
-            test_id = attempt_data.get('testId')
-            
-            # Get user name
-            try:
-                user_doc = db.collection('users').document(user_id).get()
-                user_name = user_doc.to_dict().get('name', 'Unknown') if user_doc.exists else 'Unknown'
-            except:
-                user_name = 'Unknown'
-            
-            # Get test name
-            try:
-                test_doc = db.collection('tests').document(test_id).get()
-                test_name = test_doc.to_dict().get('name', 'Test') if test_doc.exists else 'Test'
-            except:
-                test_name = 'Test'
+            user_doc = dashboard['users'].get(attempt_data.get('userId'))
+            test_doc = dashboard['tests'].get(attempt_data.get('testId'))
+            user_name = user_doc.to_dict().get('name', 'Unknown') if user_doc else 'Unknown'
+            test_name = test_doc.to_dict().get('name', 'Test') if test_doc else 'Test'
             
             recent_activity.append({
                 'type': 'test',
@@ -1476,13 +4749,7 @@ def get_dashboard_analytics():
                 'icon': '📝'
             })
         
-        # Get recent doubts (last 3)
-        recent_doubts = db.collection('doubts')\
-            .order_by('createdAt', direction=firestore.Query.DESCENDING)\
-            .limit(3)\
-            .stream()
-        
-        for doubt_doc in recent_doubts:
+        for doubt_doc in dashboard['recentDoubts']:
             doubt_data = doubt_doc.to_dict()
             user_name = doubt_data.get('userName', 'Unknown')
             subject = doubt_data.get('subject', 'General')
@@ -1494,13 +4761,7 @@ def get_dashboard_analytics():
                 'icon': '💬'
             })
         
-        # Get recent user signups (last 3)
-        recent_users = db.collection('users')\
-            .order_by('createdAt', direction=firestore.Query.DESCENDING)\
-            .limit(3)\
-            .stream()
-        
-        for user_doc in recent_users:
+        for user_doc in dashboard['recentUsers']:
             user_data = user_doc.to_dict()
             user_name = user_data.get('name', 'New User')
             
@@ -1523,41 +4784,90 @@ def get_dashboard_analytics():
                 activity['timestamp'] = activity['timestamp'].isoformat()
         
         return jsonify({
-            'totalStudents': students_count,
+            'totalStudents': dashboard['studentsCount'],
             'totalRevenue': total_revenue,
-            'totalVideos': videos_count,
-            'totalTests': tests_count,
-            'pendingDoubts': pending_doubts,
-            'activeUsers': active_users,
-            'newStudentsThisMonth': new_students_this_month,
+            'totalVideos': dashboard['videosCount'],
+            'totalTests': dashboard['testsCount'],
+            'pendingDoubts': dashboard['pendingDoubts'],
+            'activeUsers': dashboard['activeUsers'],
+            'newStudentsThisMonth': dashboard['newStudentsThisMonth'],
             'revenueThisMonth': revenue_this_month,
             'recentActivity': recent_activity
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching dashboard analytics: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error fetching dashboard analytics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+
+async def gather_dashboard_data(client):
+    """All dashboard reads: nine independent queries, then one batched name lookup"""
+    seven_days_ago = datetime.now() - timedelta(days=7)
+    start_of_month = datetime.now().replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    
+    (students_count, videos_count, tests_count, pending_doubts, active_users,
+     new_students_this_month, recent_attempts, recent_doubts, recent_users) = await asyncio.gather(
+        count_documents(client.collection('users')),
+        count_documents(client.collection('videos')),
+        count_documents(client.collection('tests')),
+        count_documents(client.collection('doubts').where('status', '==', 'pending')),
+        count_documents(client.collection('users').where('updatedAt', '>=', seven_days_ago)),
+        count_documents(client.collection('users').where('createdAt', '>=', start_of_month)),
+        fetch_documents(client.collection('testAttempts').order_by('submittedAt', direction=firestore.Query.DESCENDING).limit(5)),
+        fetch_documents(client.collection('doubts').order_by('createdAt', direction=firestore.Query.DESCENDING).limit(3)),
+        fetch_documents(client.collection('users').order_by('createdAt', direction=firestore.Query.DESCENDING).limit(3))
+    )
+    
+    # Names for the recent attempts (previously two reads per attempt)
+    attempts = [doc.to_dict() for doc in recent_attempts]
+    users, tests = await asyncio.gather(
+        get_documents_by_id(client, 'users', [attempt.get('userId') for attempt in attempts]),
+        get_documents_by_id(client, 'tests', [attempt.get('testId') for attempt in attempts])
+    )
+    
+    return {
+        'studentsCount': students_count,
+        'videosCount': videos_count,
+        'testsCount': tests_count,
+        'pendingDoubts': pending_doubts,
+        'activeUsers': active_users,
+        'newStudentsThisMonth': new_students_this_month,
+        'recentAttempts': recent_attempts,
+        'recentDoubts': recent_doubts,
+        'recentUsers': recent_users,
+        'users': users,
+        'tests': tests
+    }
+
 # ===================================
 # ADVANCED ANALYTICS ENDPOINTS
 # ===================================
 
 @app.route('/api/analytics/test-performance', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_test_performance_analytics():
     """Get detailed test performance analytics"""
     try:
-        from datetime import datetime, timedelta
-        
         # Get date range from query params (optional)
         days = request.args.get('days', default=30, type=int)
         cutoff_date = datetime.now() - timedelta(days=days)
         
+        # Tests and attempts are fetched concurrently
+        async def fetch_tests_and_attempts(client):
+            attempts_query = client.collection('testAttempts')
+            if days < 365:  # Only filter if not "all time"
+                attempts_query = attempts_query.where('submittedAt', '>=', cutoff_date)
+            return await asyncio.gather(
+                fetch_documents(client.collection('tests')),
+                fetch_documents(attempts_query.select(['testId', 'score', 'percentage']))
+            )
+        
+        test_docs, attempt_docs = async_firestore.run(fetch_tests_and_attempts)
+        
         # Get all tests
         tests = {}
-        for test_doc in db.collection('tests').stream():
+        for test_doc in test_docs:
             test_data = test_doc.to_dict()
             tests[test_doc.id] = {
                 'id': test_doc.id,
@@ -1574,12 +4884,8 @@ def get_test_performance_analytics():
                 'passRate': 0
             }
         
-        # Get all test attempts within date range
-        attempts_query = db.collection('testAttempts')
-        if days < 365:  # Only filter if not "all time"
-            attempts_query = attempts_query.where('submittedAt', '>=', cutoff_date)
-        
-        for attempt_doc in attempts_query.stream():
+        # Tally test attempts within date range
+        for attempt_doc in attempt_docs:
             attempt_data = attempt_doc.to_dict()
             test_id = attempt_data.get('testId')
             
@@ -1631,33 +4937,39 @@ def get_test_performance_analytics():
         return jsonify(test_performance), 200
         
     except Exception as e:
-        print(f"❌ Error fetching test performance: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error fetching test performance: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/analytics/engagement-metrics', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_engagement_metrics():
     """Get user engagement metrics"""
     try:
-        from datetime import datetime, timedelta
-        
         days = request.args.get('days', default=30, type=int)
         cutoff_date = datetime.now() - timedelta(days=days)
         
+        async def fetch_engagement(client):
+            return await asyncio.gather(
+                fetch_documents(client.collection('videos').order_by('views', direction=firestore.Query.DESCENDING).limit(5)),
+                count_documents(client.collection('users').where('updatedAt', '>=', datetime.now() - timedelta(days=7))),
+                count_documents(client.collection('videos')),
+                count_documents(client.collection('tests')),
+                count_documents(client.collection('materials')),
+                count_documents(client.collection('testAttempts').where('submittedAt', '>=', cutoff_date))
+            )
+        
+        (top_video_docs, active_users_7d, total_videos, total_tests,
+         total_materials, recent_attempts) = async_firestore.run(fetch_engagement)
+        
         # ===================================
-        # 1. MOST WATCHED VIDEOS
+        # MOST WATCHED VIDEOS
         # ===================================
-        videos_ref = db.collection('videos')\
-            .order_by('views', direction=firestore.Query.DESCENDING)\
-            .limit(5)
-        
         most_watched = []
         total_views = 0
         
-        for video_doc in videos_ref.stream():
+        for video_doc in top_video_docs:
             video_data = video_doc.to_dict()
             views = video_data.get('views', 0)
             total_views += views
@@ -1668,27 +4980,6 @@ def get_engagement_metrics():
                 'views': views
             })
         
-        # ===================================
-        # 2. ACTIVE LEARNERS
-        # ===================================
-        active_users_7d = len(list(
-            db.collection('users').where('updatedAt', '>=', datetime.now() - timedelta(days=7)).stream()
-        ))
-        
-        # ===================================
-        # 3. CONTENT STATS
-        # ===================================
-        total_videos = len(list(db.collection('videos').stream()))
-        total_tests = len(list(db.collection('tests').stream()))
-        total_materials = len(list(db.collection('materials').stream()))
-        
-        # ===================================
-        # 4. TEST ATTEMPTS (within date range)
-        # ===================================
-        recent_attempts = len(list(
-            db.collection('testAttempts').where('submittedAt', '>=', cutoff_date).stream()
-        ))
-        
         return jsonify({
             'mostWatchedVideos': most_watched,
             'totalVideoViews': total_views,
@@ -1702,35 +4993,32 @@ def get_engagement_metrics():
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching engagement metrics: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error fetching engagement metrics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/analytics/doubt-metrics', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_doubt_metrics():
     """Get doubt resolution metrics"""
     try:
-        from datetime import datetime, timedelta
-        
-        # Count by status
-        pending = len(list(db.collection('doubts').where('status', '==', 'pending').stream()))
-        answered = len(list(db.collection('doubts').where('status', '==', 'answered').stream()))
-        resolved = len(list(db.collection('doubts').where('status', '==', 'resolved').stream()))
-        
-        # Doubts answered today
         today_start = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
-        answered_today = len(list(
-            db.collection('doubts')
-            .where('status', 'in', ['answered', 'resolved'])
-            .where('updatedAt', '>=', today_start)
-            .stream()
-        ))
         
-        # Calculate average response time (for resolved doubts)
-        resolved_doubts = db.collection('doubts').where('status', '==', 'resolved').limit(50).stream()
+        async def fetch_doubt_metrics(client):
+            doubts = client.collection('doubts')
+            return await asyncio.gather(
+                # Count by status
+                count_documents(doubts.where('status', '==', 'pending')),
+                count_documents(doubts.where('status', '==', 'answered')),
+                count_documents(doubts.where('status', '==', 'resolved')),
+                # Doubts answered today
+                count_documents(doubts.where('status', 'in', ['answered', 'resolved']).where('updatedAt', '>=', today_start)),
+                # Sample for average response time (resolved doubts)
+                fetch_documents(doubts.where('status', '==', 'resolved').select(['createdAt', 'updatedAt']).limit(50))
+            )
+        
+        pending, answered, resolved, answered_today, resolved_doubts = async_firestore.run(fetch_doubt_metrics)
         
         response_times = []
         for doubt_doc in resolved_doubts:
@@ -1759,14 +5047,13 @@ def get_doubt_metrics():
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching doubt metrics: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error fetching doubt metrics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/analytics/signup-trends', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_signup_trends():
     """Get user signup trends over time"""
     try:
@@ -1827,13 +5114,12 @@ def get_signup_trends():
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching signup trends: {str(e)}")
-        import traceback
-        traceback.print_exc()
+        logger.exception(f"Error fetching signup trends: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/analytics/revenue', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_revenue_analytics():
     """Get revenue analytics"""
     try:
@@ -1846,11 +5132,12 @@ def get_revenue_analytics():
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching revenue analytics: {str(e)}")
+        logger.error(f"Error fetching revenue analytics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/analytics/engagement', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_engagement_analytics():
     """Get user engagement analytics"""
     try:
@@ -1863,11 +5150,12 @@ def get_engagement_analytics():
         }), 200
         
     except Exception as e:
-        print(f"❌ Error fetching engagement analytics: {str(e)}")
+        logger.error(f"Error fetching engagement analytics: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/analytics/popular-content', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_popular_content():
     """Get popular content"""
     try:
@@ -1885,11 +5173,12 @@ def get_popular_content():
         return jsonify(popular), 200
         
     except Exception as e:
-        print(f"❌ Error fetching popular content: {str(e)}")
+        logger.error(f"Error fetching popular content: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/analytics/transactions', methods=['GET'])
 @require_auth
+@coalesce_requests(admin_scope)
 def get_recent_transactions():
     """Get recent transactions"""
     try:
@@ -1897,7 +5186,7 @@ def get_recent_transactions():
         return jsonify([]), 200
         
     except Exception as e:
-        print(f"❌ Error fetching transactions: {str(e)}")
+        logger.error(f"Error fetching transactions: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -1928,7 +5217,7 @@ def get_pricing():
         return jsonify(doc.to_dict()), 200
         
     except Exception as e:
-        print(f"❌ Error fetching pricing: {str(e)}")
+        logger.error(f"Error fetching pricing: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/settings/pricing', methods=['PUT'])
@@ -1940,12 +5229,12 @@ def update_pricing():
         
         db.collection('settings').document('pricing').set(data, merge=True)
         
-        print(f"✅ Pricing updated")
+        logger.info(f"Pricing updated", extra=SAMPLED)
         
         return jsonify({'message': 'Pricing updated successfully'}), 200
         
     except Exception as e:
-        print(f"❌ Error updating pricing: {str(e)}")
+        logger.error(f"Error updating pricing: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/settings/subjects', methods=['GET'])
@@ -1970,7 +5259,7 @@ def get_subjects():
         return jsonify(doc.to_dict().get('subjects', [])), 200
         
     except Exception as e:
-        print(f"❌ Error fetching subjects: {str(e)}")
+        logger.error(f"Error fetching subjects: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -1998,12 +5287,7 @@ def request_entity_too_large(error):
         'maxSizeMB': max_size_mb
     })
     
-    # Explicitly add CORS headers
-    origin = request.headers.get('Origin')
-    if origin:
-        response.headers['Access-Control-Allow-Origin'] = origin
-        response.headers['Access-Control-Allow-Credentials'] = 'true'
-    
+    # CORS headers are added by after_request (only for allowed origins)
     return response, 413
 
 # ===================================
@@ -2014,10 +5298,7 @@ def require_student_auth(f):
     """Decorator to require student authentication"""
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        # Allow OPTIONS requests without authentication
-        if request.method == 'OPTIONS':
-            return '', 204
-        
+        # OPTIONS preflights never get here - see answer_cors_preflight
         auth_header = request.headers.get('Authorization')
         
         if not auth_header:
@@ -2025,25 +5306,35 @@ def require_student_auth(f):
         
         try:
             token = auth_header.split('Bearer ')[1] if 'Bearer ' in auth_header else auth_header
-            decoded_token = auth.verify_id_token(token)
+            decoded_token = verify_id_token_cached(token)
             uid = decoded_token['uid']
-            
-            # Get user document from Firestore
-            user_ref = db.collection('users').document(uid)
-            user_doc = user_ref.get()
-            
-            if not user_doc.exists:
-                return jsonify({'error': 'User not found'}), 404
-            
-            # Attach user info to request
-            request.uid = uid
-            request.user_data = user_doc.to_dict()
-            
-            return f(*args, **kwargs)
-            
         except Exception as e:
-            print(f"Student auth error: {str(e)}")
+            logger.warning(f"Student auth error: {str(e)}")
+            record_auth_failure()
             return jsonify({'error': 'Invalid or expired token'}), 401
+        
+        try:
+            # Get user document from Firestore (cached briefly)
+            user_data = get_principal('users', uid)
+        except Exception as e:
+            # Firestore trouble is not the caller's fault: no auth-failure charge
+            logger.exception(f"Student lookup failed for {uid}: {str(e)}")
+            return jsonify({'error': 'Authentication service unavailable'}), 503
+        
+        if user_data is None:
+            record_auth_failure()
+            return jsonify({'error': 'User not found'}), 404
+        
+        # Attach user info to request
+        request.uid = uid
+        request.user_data = user_data
+        
+        limited = rate_limit_response(f'uid:{uid}', 'student')
+        if limited is not None:
+            return limited
+        
+        # Outside the try blocks: view errors are the view's to handle
+        return f(*args, **kwargs)
     
     return decorated_function
 
@@ -2086,6 +5377,7 @@ def check_user_access(user_data, content_subject, content_access='premium'):
 
 @app.route('/api/student/videos', methods=['GET'])
 @require_student_auth
+@coalesce_requests(student_entitlement_scope)
 def get_student_videos():
     """Get all videos accessible to the student"""
     try:
@@ -2129,12 +5421,13 @@ def get_student_videos():
         return jsonify(videos), 200
         
     except Exception as e:
-        print(f"❌ Error fetching student videos: {str(e)}")
+        logger.error(f"Error fetching student videos: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
 @app.route('/api/student/videos/<video_id>', methods=['GET'])
 @require_student_auth
+@coalesce_requests(student_entitlement_scope)
 def get_student_video(video_id):
     """Get single video with full details"""
     try:
@@ -2163,7 +5456,7 @@ def get_student_video(video_id):
         return jsonify(video_data), 200
         
     except Exception as e:
-        print(f"❌ Error fetching video: {str(e)}")
+        logger.error(f"Error fetching video: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2172,23 +5465,30 @@ def get_student_video(video_id):
 def update_video_views(video_id):
     """Track video views and update user progress"""
     try:
-        # Update video view count
-        video_ref = db.collection('videos').document(video_id)
-        video_ref.update({
-            'views': firestore.Increment(1)
+        data = request.get_json(silent=True) or {}
+        watch_time = data.get('watchTime', 0) if isinstance(data, dict) else 0
+        
+        # Validate before queueing anything, so a bad body records nothing
+        if (isinstance(watch_time, bool) or not isinstance(watch_time, (int, float))
+                or not math.isfinite(watch_time) or watch_time < 0):
+            return jsonify({'error': 'watchTime must be a non-negative number'}), 400
+        
+        # Counters are coalesced in the write-behind buffer and flushed
+        # in batches, so the request returns without touching Firestore.
+        telemetry_buffer.increment('videos', video_id, {
+            'views': 1
         })
         
         # Update user progress
-        user_ref = db.collection('users').document(request.uid)
-        user_ref.update({
-            'progress.videosWatched': firestore.Increment(1),
-            'progress.totalWatchTime': firestore.Increment(request.json.get('watchTime', 0))
+        telemetry_buffer.increment('users', request.uid, {
+            'progress.videosWatched': 1,
+            'progress.totalWatchTime': watch_time
         })
         
         return jsonify({'message': 'View recorded'}), 200
         
     except Exception as e:
-        print(f"❌ Error updating views: {str(e)}")
+        logger.error(f"Error updating views: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -2204,25 +5504,35 @@ def get_test_attempts_for_admin(test_id):
             .where('testId', '==', test_id) \
             .order_by('submittedAt', direction=firestore.Query.DESCENDING)
 
+        attempt_docs = list(attempts_query.stream())
+
+        # 🔥 FETCH USER NAMES - one batched read for all distinct students
+        user_refs = {
+            user_id: db.collection('users').document(user_id)
+            for user_id in {doc.to_dict().get('userId') for doc in attempt_docs} if user_id
+        }
+        users = {}
+        if user_refs:
+            try:
+                users = {
+                    user_doc.id: user_doc.to_dict()
+                    for user_doc in db.get_all(list(user_refs.values()), field_paths=['name', 'email'])
+                    if user_doc.exists
+                }
+            except Exception as e:
+                logger.warning(f"Error fetching users for attempts: {e}")
+
         attempts = []
-        for doc in attempts_query.stream():
+        for doc in attempt_docs:
             attempt_data = doc.to_dict()
             attempt_data['id'] = doc.id
 
-            # 🔥 FETCH USER NAME
             user_id = attempt_data.get('userId')
-            if user_id:
-                try:
-                    user_doc = db.collection('users').document(user_id).get()
-                    if user_doc.exists:
-                        user_data = user_doc.to_dict()
-                        attempt_data['userName'] = user_data.get('name', 'Unknown User')
-                        attempt_data['userEmail'] = user_data.get('email', '')
-                    else:
-                        attempt_data['userName'] = f'User {user_id[:8]}...'
-                except Exception as e:
-                    print(f"⚠️ Error fetching user {user_id}: {e}")
-                    attempt_data['userName'] = f'User {user_id[:8]}...'
+            if user_id in users:
+                attempt_data['userName'] = users[user_id].get('name', 'Unknown User')
+                attempt_data['userEmail'] = users[user_id].get('email', '')
+            elif user_id:
+                attempt_data['userName'] = f'User {user_id[:8]}...'
             else:
                 attempt_data['userName'] = 'Unknown User'
 
@@ -2232,13 +5542,12 @@ def get_test_attempts_for_admin(test_id):
 
             attempts.append(attempt_data)
 
-        print(f"✅ Fetched {len(attempts)} attempts for test: {test_id}")
+        logger.info(f"Fetched {len(attempts)} attempts for test: {test_id}", extra=SAMPLED)
 
         return jsonify(attempts), 200
 
     except Exception as e:
-        print(f"❌ Error fetching attempts for test {test_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching attempts for test {test_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 @app.route('/api/admin/test-attempts/<attempt_id>', methods=['DELETE'])
@@ -2281,13 +5590,12 @@ def reset_test_attempt(attempt_id):
                 'stats.avgScore': avg_score
             })
         
-        print(f"✅ Attempt {attempt_id} reset successfully for user {user_id}")
+        logger.info(f"Attempt {attempt_id} reset successfully for user {user_id}", extra=SAMPLED)
         
         return jsonify({'message': 'Attempt reset successfully'}), 200
         
     except Exception as e:
-        print(f"❌ Error resetting attempt {attempt_id}: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error resetting attempt {attempt_id}: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 # ===================================
@@ -2361,7 +5669,7 @@ def grant_test_access(test_id):
                 })
                 grants_created += 1
         
-        print(f"✅ Access granted: {grants_created} new, {grants_updated} updated for test {test_id}")
+        logger.info(f"Access granted: {grants_created} new, {grants_updated} updated for test {test_id}", extra=SAMPLED)
         
         return jsonify({
             'message': f'Access granted to {len(user_ids)} user(s)',
@@ -2370,8 +5678,7 @@ def grant_test_access(test_id):
         }), 200
         
     except Exception as e:
-        print(f"❌ Error granting test access: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error granting test access: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -2399,7 +5706,7 @@ def revoke_test_access(test_id):
                 grant_doc.reference.delete()
                 revoked_count += 1
         
-        print(f"✅ Access revoked: {revoked_count} grant(s) for test {test_id}")
+        logger.info(f"Access revoked: {revoked_count} grant(s) for test {test_id}", extra=SAMPLED)
         
         return jsonify({
             'message': f'Access revoked from {len(user_ids)} user(s)',
@@ -2407,8 +5714,7 @@ def revoke_test_access(test_id):
         }), 200
         
     except Exception as e:
-        print(f"❌ Error revoking test access: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error revoking test access: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
 
@@ -2433,21 +5739,60 @@ def get_test_access_list(test_id):
             
             grants.append(grant_data)
         
-        print(f"✅ Fetched {len(grants)} access grants for test {test_id}")
+        logger.info(f"Fetched {len(grants)} access grants for test {test_id}", extra=SAMPLED)
         
         return jsonify(grants), 200
         
     except Exception as e:
-        print(f"❌ Error fetching access list: {str(e)}")
-        traceback.print_exc()
+        logger.exception(f"Error fetching access list: {str(e)}")
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
 
+# ===================================
+# SIGNED DOWNLOAD URLS
+# ===================================
+# Expiries are aligned to fixed windows, so every request in the same
+# window asks for the same (path, expiry) pair and gets the cached URL.
+# Signing uses the service account key already loaded by firebase-admin.
+
+DOWNLOAD_URL_TTL_SECONDS = int(os.getenv('DOWNLOAD_URL_TTL_MINUTES', 60)) * 60
+DOWNLOAD_URL_WINDOW_SECONDS = int(os.getenv('DOWNLOAD_URL_WINDOW_MINUTES', 10)) * 60
+DOWNLOAD_URL_CACHE_SIZE = int(os.getenv('DOWNLOAD_URL_CACHE_SIZE', 4096))
+
+_signing_credentials = None
+
+
+def get_signing_credentials():
+    """Google credentials of the initialized Firebase app, resolved once"""
+    global _signing_credentials
+    if _signing_credentials is None:
+        _signing_credentials = get_firebase_app().credential.get_credential()
+    return _signing_credentials
+
+
+@lru_cache(maxsize=DOWNLOAD_URL_CACHE_SIZE)
+def _signed_download_url(storage_path, filename, expires_at):
+    return bucket.blob(storage_path).generate_signed_url(
+        version='v4',
+        expiration=datetime.utcfromtimestamp(expires_at),
+        method='GET',
+        credentials=get_signing_credentials(),
+        response_disposition=f'inline; filename="{filename.replace(chr(34), "")}"' if filename else None
+    )
+
+
+def get_download_url(storage_path, filename=None):
+    """Return (signed URL, expiry datetime) valid for at least the TTL"""
+    window_start = int(time.time()) // DOWNLOAD_URL_WINDOW_SECONDS * DOWNLOAD_URL_WINDOW_SECONDS
+    expires_at = window_start + DOWNLOAD_URL_WINDOW_SECONDS + DOWNLOAD_URL_TTL_SECONDS
+    return _signed_download_url(storage_path, filename, expires_at), datetime.utcfromtimestamp(expires_at)
+
 # ===================================
 # MATERIALS ENDPOINTS
 # ===================================
 
 @app.route('/api/student/materials', methods=['GET'])
 @require_student_auth
+@coalesce_requests(student_entitlement_scope)
 def get_student_materials():
     """Get all study materials accessible to the student"""
     try:
@@ -2490,7 +5835,7 @@ def get_student_materials():
         return jsonify(materials), 200
         
     except Exception as e:
-        print(f"❌ Error fetching student materials: {str(e)}")
+        logger.error(f"Error fetching student materials: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2521,6 +5866,13 @@ def get_student_material(material_id):
                 'message': f'Subscribe to {material_data.get("subject")} to access this material'
             }), 403
         
+        # Time-limited download link (cached per material and expiry window)
+        storage_path = material_data.get('storageUrl')
+        if storage_path and bucket:
+            download_url, expires_at = get_download_url(storage_path, material_data.get('filename'))
+            material_data['downloadUrl'] = download_url
+            material_data['downloadUrlExpiresAt'] = expires_at.isoformat() + 'Z'
+        
         # Update download count
         material_ref.update({
             'downloads': firestore.Increment(1)
@@ -2529,7 +5881,7 @@ def get_student_material(material_id):
         return jsonify(material_data), 200
         
     except Exception as e:
-        print(f"❌ Error fetching material: {str(e)}")
+        logger.error(f"Error fetching material: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -2554,7 +5906,7 @@ def get_my_doubts():
         return jsonify(doubts), 200
         
     except Exception as e:
-        print(f"❌ Error fetching doubts: {str(e)}")
+        logger.error(f"Error fetching doubts: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2586,10 +5938,9 @@ def submit_doubt():
         
         doc_ref = db.collection('doubts').add(doubt_data)
         
-        # Update user progress
-        user_ref = db.collection('users').document(request.uid)
-        user_ref.update({
-            'progress.doubtsAsked': firestore.Increment(1)
+        # Update user progress (buffered)
+        telemetry_buffer.increment('users', request.uid, {
+            'progress.doubtsAsked': 1
         })
         
         return jsonify({
@@ -2598,7 +5949,7 @@ def submit_doubt():
         }), 201
         
     except Exception as e:
-        print(f"❌ Error submitting doubt: {str(e)}")
+        logger.error(f"Error submitting doubt: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
@@ -2622,7 +5973,7 @@ def get_my_profile():
         return jsonify(user_data), 200
         
     except Exception as e:
-        print(f"❌ Error fetching profile: {str(e)}")
+        logger.error(f"Error fetching profile: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2644,11 +5995,12 @@ def update_my_profile():
         
         user_ref = db.collection('users').document(request.uid)
         user_ref.update(update_data)
+        invalidate_principal('users', request.uid)
         
         return jsonify({'message': 'Profile updated successfully'}), 200
         
     except Exception as e:
-        print(f"❌ Error updating profile: {str(e)}")
+        logger.error(f"Error updating profile: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 
@@ -2663,7 +6015,7 @@ def get_my_subscriptions():
         return jsonify(subscriptions), 200
         
     except Exception as e:
-        print(f"❌ Error fetching subscriptions: {str(e)}")
+        logger.error(f"Error fetching subscriptions: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/users/<user_id>/attempts', methods=['GET'])
@@ -2686,11 +6038,11 @@ def get_user_test_attempts(user_id):
                 
             attempts.append(attempt_data)
 
-        print(f"✅ Fetched {len(attempts)} attempts for user: {user_id}")
+        logger.info(f"Fetched {len(attempts)} attempts for user: {user_id}", extra=SAMPLED)
         return jsonify(attempts), 200
 
     except Exception as e:
-        print(f"❌ Error fetching user test attempts: {str(e)}")
+        logger.error(f"Error fetching user test attempts: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 @app.route('/api/student/progress', methods=['GET'])
@@ -2709,29 +6061,63 @@ def get_my_progress():
         return jsonify(progress), 200
         
     except Exception as e:
-        print(f"❌ Error fetching progress: {str(e)}")
+        logger.error(f"Error fetching progress: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
 # ===================================
 # RUN SERVER
 # ===================================
 
+# ===================================
+# APP FACTORY & WORKER WARM-UP
+# ===================================
+# Procfile runs gunicorn "backend:create_app()" with gunicorn.conf.py,
+# which resets clients in post_fork and warms each worker in post_worker_init.
+
+MODULE_LOAD_MS = (time.perf_counter() - _module_started_at) * 1000
+
+
+def create_app():
+    """Return the configured app; Firebase clients stay lazy until a worker uses them"""
+    return app
+
+
+def warm_up():
+    """Open this worker's Firestore channel and prime signing keys and background runners"""
+    started = time.perf_counter()
+    try:
+        list(db.collection('admins').select([]).limit(1).stream())
+        bucket.resolve()
+        id_token_verifier.ensure_started()
+        cascade_runner.ensure_started()
+    except Exception as e:
+        logger.warning(f"Worker warm-up incomplete: {e}")
+
+    try:
+        import resource
+        max_rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+    except ImportError:
+        max_rss_mb = None  # Not available on Windows
+    logger.info(f"Worker {os.getpid()} warm in {(time.perf_counter() - started) * 1000:.0f}ms "
+                f"(module load {MODULE_LOAD_MS:.0f}ms, max RSS {f'{max_rss_mb:.0f}MB' if max_rss_mb else 'n/a'})")
+
+
+def start_warm_up():
+    """Warm up in the background so the worker accepts requests immediately"""
+    threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+
 if __name__ == '__main__':
     host = os.getenv('FLASK_HOST', '0.0.0.0')
     port = int(os.getenv('FLASK_PORT', 5000))
     debug = os.getenv('FLASK_DEBUG', 'False').lower() == 'true'
     
-    print(f"\n{'='*60}")
-    print(f"🚀 GeoCatalyst Admin API Server")
-    print(f"{'='*60}")
-    print(f"📍 Host: {host}")
-    print(f"🔌 Port: {port}")
-    print(f"🐛 Debug: {debug}")
-    print(f"📦 Max Upload Size: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB")
-    print(f"🔥 Firebase Project: {os.getenv('FIREBASE_PROJECT_ID', 'Not set')}")
-    print(f"☁️  Cloudflare Account: {CLOUDFLARE_ACCOUNT_ID or 'Not set'}")
-    print(f"🌐 CORS Enabled: ✅")
-    print(f"📤 TUS Proxy Endpoint: /api/tus-upload-endpoint")
-    print(f"{'='*60}\n")
+    logger.info(
+        f"GeoCatalyst Admin API Server starting on {host}:{port} (debug: {debug}, "
+        f"max upload: {app.config['MAX_CONTENT_LENGTH'] // (1024*1024)}MB, "
+        f"Firebase project: {os.getenv('FIREBASE_PROJECT_ID', 'Not set')}, "
+        f"Cloudflare account: {CLOUDFLARE_ACCOUNT_ID or 'Not set'}, "
+        f"TUS proxy: /api/tus-upload-endpoint)"
+    )
     
-    app.run(host=host, port=port, debug=debug)
\ No newline at end of file
+    create_app().run(host=host, port=port, debug=debug)
\ No newline at end of file
@@ -0,0 +1,530 @@
+# ===================================
+# GEOCATALYST - BACKEND BENCHMARK HARNESS
+# ===================================
+# Seeds the Firebase emulators with a synthetic GATE dataset, runs the backend
+# under gunicorn against them and drives its routes with concurrent clients.
+# Each run reports p50/p95/p99 latency, throughput and Firestore reads per
+# request (X-Firestore-Reads), for every dataset size requested, and writes a
+# JSON baseline (benchmarks/baselines/<label>.json) meant to be committed so
+# regressions show up as diffs.
+#
+#   firebase emulators:start --only firestore,auth
+#   python benchmarks/bench.py --scales 1000,10000,100000 --label main
+#   python benchmarks/bench.py --scales 1000 --label my-branch --compare benchmarks/baselines/main.json
+#
+# Routes that delete data, upload files or call external services (TUS proxy,
+# question images, material uploads, YouTube import/enrichment, migrations,
+# background jobs) are not driven; everything else is.
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import subprocess
+import threading
+from datetime import datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from google.auth.credentials import AnonymousCredentials
+from google.cloud import firestore
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINES_DIR = os.path.join(REPO_ROOT, 'benchmarks', 'baselines')
+
+FIRESTORE_EMULATOR_HOST = os.getenv('FIRESTORE_EMULATOR_HOST', 'localhost:8080')
+AUTH_EMULATOR_HOST = os.getenv('FIREBASE_AUTH_EMULATOR_HOST', 'localhost:9099')
+
+SUBJECTS = ['Remote Sensing', 'GIS', 'Image Processing', 'Geomatics']
+PACKAGES = SUBJECTS + ['Master Package', 'Test Series']
+CHAPTERS = [f'Chapter {number}' for number in range(1, 13)]
+QUESTIONS_PER_TEST = 65
+BATCH_LIMIT = 500
+AUTH_STUDENTS = 50  # Students with real emulator accounts (the rest exist only in Firestore)
+REGRESSION_THRESHOLD = 0.20  # --compare flags routes whose p95 grew by more than this
+
+
+# ===================================
+# EMULATOR HELPERS
+# ===================================
+
+def wipe_emulators(project_id):
+    """Drop every document and auth account in the emulator project"""
+    requests.delete(
+        f'http://{FIRESTORE_EMULATOR_HOST}/emulator/v1/projects/{project_id}/databases/(default)/documents'
+    ).raise_for_status()
+    requests.delete(
+        f'http://{AUTH_EMULATOR_HOST}/emulator/v1/projects/{project_id}/accounts'
+    ).raise_for_status()
+
+
+def create_auth_user(email):
+    """Sign up an emulator account, returns (uid, id_token)"""
+    response = requests.post(
+        f'http://{AUTH_EMULATOR_HOST}/identitytoolkit.googleapis.com/v1/accounts:signUp?key=emulator',
+        json={'email': email, 'password': 'benchmark-password', 'returnSecureToken': True}
+    )
+    response.raise_for_status()
+    body = response.json()
+    return body['localId'], body['idToken']
+
+
+def dummy_service_account(project_id):
+    """Well-formed service account JSON; the emulators never check the key"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    return json.dumps({
+        'type': 'service_account',
+        'project_id': project_id,
+        'private_key_id': 'benchmark',
+        'private_key': private_key.private_bytes(
+            serialization.Encoding.PEM,
+            serialization.PrivateFormat.PKCS8,
+            serialization.NoEncryption()
+        ).decode('utf-8'),
+        'client_email': f'benchmark@{project_id}.iam.gserviceaccount.com',
+        'client_id': '0',
+        'token_uri': 'https://oauth2.googleapis.com/token'
+    })
+
+
+# ===================================
+# SYNTHETIC DATASET
+# ===================================
+
+class BatchWriter:
+    """Buffers sets into 500-operation batch commits"""
+
+    def __init__(self, client):
+        self.client = client
+        self.batch = client.batch()
+        self.pending = 0
+        self.written = 0
+
+    def set(self, ref, data):
+        self.batch.set(ref, data)
+        self.pending += 1
+        if self.pending == BATCH_LIMIT:
+            self.flush()
+
+    def flush(self):
+        if self.pending:
+            self.batch.commit()
+            self.written += self.pending
+            self.batch = self.client.batch()
+            self.pending = 0
+
+
+def make_question(rng, order):
+    q_type = rng.choice(['mcq', 'mcq', 'msq', 'numerical'])
+    marks = rng.choice([1, 2])
+    question = {
+        'type': q_type,
+        'question': f'Synthetic question {order + 1}: ' + ' '.join(rng.choice(CHAPTERS) for _ in range(6)),
+        'markValue': marks,
+        'marks': marks,
+        'negativeMarks': 0 if q_type == 'numerical' else round(marks / 3, 2),
+        'difficulty': rng.choice(['easy', 'medium', 'hard']),
+        'order': order
+    }
+    if q_type == 'numerical':
+        question['correctAnswer'] = round(rng.uniform(0, 100), 2)
+    else:
+        question['options'] = {key: f'Option {key}' for key in 'ABCD'}
+        if q_type == 'mcq':
+            question['correctAnswer'] = rng.choice('ABCD')
+        else:
+            question['correctAnswers'] = sorted(rng.sample('ABCD', 2))
+    return question
+
+
+def seed_dataset(client, project_id, users, rng, attempts_per_user):
+    """Seed one dataset size, returns the ids and tokens the scenarios need"""
+    now = datetime.now(timezone.utc)
+    writer = BatchWriter(client)
+
+    # --- Admin and students with real emulator accounts ---
+    admin_uid, admin_token = create_auth_user('admin@benchmark.test')
+    writer.set(client.collection('admins').document(admin_uid), {
+        'name': 'Benchmark Admin', 'email': 'admin@benchmark.test', 'isActive': True
+    })
+    students = [create_auth_user(f'student{index}@benchmark.test') for index in range(min(AUTH_STUDENTS, users))]
+
+    # --- Users ---
+    user_ids = [uid for uid, _ in students] + [f'user-{index:06d}' for index in range(len(students), users)]
+    for index, user_id in enumerate(user_ids):
+        created_at = now - timedelta(days=rng.randint(0, 365))
+        subscriptions = []
+        if index < len(students) or rng.random() < 0.3:
+            subscriptions = [{
+                'subject': rng.choice(PACKAGES),
+                'isActive': True,
+                'startDate': created_at,
+                'endDate': created_at + timedelta(days=365)
+            }]
+        writer.set(client.collection('users').document(user_id), {
+            'uid': user_id,
+            'name': f'Student {index}',
+            'displayName': f'Student {index}',
+            'email': f'student{index}@benchmark.test',
+            'subscriptions': subscriptions,
+            'stats': {'testsAttempted': 0, 'totalPercentageSum': 0},
+            'progress': {'videosWatched': 0, 'doubtsAsked': 0},
+            'createdAt': created_at,
+            'updatedAt': created_at + timedelta(days=rng.randint(0, 30))
+        })
+
+    # --- Tests with 65 questions each ---
+    test_ids = []
+    for index in range(max(20, users // 200)):
+        test_ref = client.collection('tests').document()
+        questions = [make_question(rng, order) for order in range(QUESTIONS_PER_TEST)]
+        for question in questions:
+            writer.set(test_ref.collection('questions').document(), question)
+        writer.set(test_ref, {
+            'name': f'Mock Test {index + 1}',
+            'subject': rng.choice(SUBJECTS),
+            'type': rng.choice(['mock', 'chapter', 'pyq']),
+            'duration': 180,
+            'access': rng.choice(['free', 'premium']),
+            'isActive': True,
+            'totalMarks': sum(question['marks'] for question in questions),
+            'questionCount': QUESTIONS_PER_TEST,
+            'nextOrder': QUESTIONS_PER_TEST,
+            'createdAt': now - timedelta(days=rng.randint(0, 365))
+        })
+        test_ids.append(test_ref.id)
+
+    # --- Attempts ---
+    for _ in range(users * attempts_per_user):
+        percentage = round(rng.uniform(5, 95), 2)
+        writer.set(client.collection('testAttempts').document(), {
+            'userId': rng.choice(user_ids),
+            'testId': rng.choice(test_ids),
+            'score': round(percentage, 2),
+            'percentage': percentage,
+            'submittedAt': now - timedelta(days=rng.randint(0, 90), minutes=rng.randint(0, 1440))
+        })
+
+    # --- Doubts with conversation logs ---
+    doubt_ids = []
+    for _ in range(max(10, users // 5)):
+        created_at = now - timedelta(days=rng.randint(0, 60))
+        user_index = rng.randrange(len(user_ids))
+        conversation = [{
+            'senderId': user_ids[user_index] if turn % 2 == 0 else admin_uid,
+            'senderName': f'Student {user_index}' if turn % 2 == 0 else 'Benchmark Admin',
+            'senderType': 'student' if turn % 2 == 0 else 'admin',
+            'text': f'Message {turn} about {rng.choice(CHAPTERS)}',
+            'timestamp': created_at + timedelta(hours=turn)
+        } for turn in range(rng.randint(0, 4))]
+        doubt_ref = client.collection('doubts').document()
+        writer.set(doubt_ref, {
+            'userId': user_ids[user_index],
+            'userName': f'Student {user_index}',
+            'subject': rng.choice(SUBJECTS),
+            'chapter': rng.choice(CHAPTERS),
+            'question': 'Synthetic doubt',
+            'status': rng.choice(['pending', 'answered', 'resolved']),
+            'conversationLog': conversation,
+            'createdAt': created_at,
+            'updatedAt': created_at + timedelta(hours=len(conversation))
+        })
+        doubt_ids.append(doubt_ref.id)
+
+    # --- Access grants ---
+    for _ in range(users // 10):
+        writer.set(client.collection('testAccessGrants').document(), {
+            'userId': rng.choice(user_ids),
+            'testId': rng.choice(test_ids),
+            'isActive': True,
+            'grantedBy': admin_uid,
+            'grantedAt': now
+        })
+
+    # --- Videos ---
+    video_ids = []
+    for index in range(max(100, users // 100)):
+        video_ref = client.collection('videos').document()
+        writer.set(video_ref, {
+            'youtubeId': f'{index:011d}',
+            'youtubeUrl': f'https://www.youtube.com/watch?v={index:011d}',
+            'title': f'Lecture {index + 1}',
+            'subject': rng.choice(SUBJECTS),
+            'chapter': rng.choice(CHAPTERS),
+            'order': index,
+            'access': rng.choice(['free', 'premium']),
+            'views': rng.randint(0, 5000),
+            'isActive': True,
+            'uploadedAt': now - timedelta(days=rng.randint(0, 365)),
+            'createdAt': now - timedelta(days=rng.randint(0, 365))
+        })
+        video_ids.append(video_ref.id)
+
+    writer.flush()
+    return {
+        'adminToken': admin_token,
+        'studentTokens': [token for _, token in students],
+        'userIds': user_ids,
+        'testIds': test_ids,
+        'doubtIds': doubt_ids,
+        'videoIds': video_ids,
+        'documents': writer.written
+    }
+
+
+# ===================================
+# SCENARIOS
+# ===================================
+# (name, method, path(dataset, rng), role, body(dataset, rng) or None)
+
+SCENARIOS = [
+    ('health', 'GET', lambda d, r: '/api/health', None, None),
+    ('admin.tests', 'GET', lambda d, r: '/api/tests', 'admin', None),
+    ('admin.test', 'GET', lambda d, r: f"/api/tests/{r.choice(d['testIds'])}", 'admin', None),
+    ('admin.videos', 'GET', lambda d, r: '/api/videos', 'admin', None),
+    ('admin.materials', 'GET', lambda d, r: '/api/materials', 'admin', None),
+    ('admin.doubts', 'GET', lambda d, r: '/api/doubts', 'admin', None),
+    ('admin.doubt', 'GET', lambda d, r: f"/api/doubts/{r.choice(d['doubtIds'])}", 'admin', None),
+    ('admin.users', 'GET', lambda d, r: '/api/users', 'admin', None),
+    ('admin.user', 'GET', lambda d, r: f"/api/users/{r.choice(d['userIds'])}", 'admin', None),
+    ('admin.userAttempts', 'GET', lambda d, r: f"/api/users/{r.choice(d['userIds'])}/attempts", 'admin', None),
+    ('admin.testAttempts', 'GET', lambda d, r: f"/api/admin/tests/{r.choice(d['testIds'])}/attempts", 'admin', None),
+    ('admin.accessList', 'GET', lambda d, r: f"/api/admin/tests/{r.choice(d['testIds'])}/access-list", 'admin', None),
+    ('admin.dashboard', 'GET', lambda d, r: '/api/dashboard/analytics', 'admin', None),
+    ('analytics.testPerformance', 'GET', lambda d, r: '/api/analytics/test-performance', 'admin', None),
+    ('analytics.engagementMetrics', 'GET', lambda d, r: '/api/analytics/engagement-metrics', 'admin', None),
+    ('analytics.doubtMetrics', 'GET', lambda d, r: '/api/analytics/doubt-metrics', 'admin', None),
+    ('analytics.signupTrends', 'GET', lambda d, r: '/api/analytics/signup-trends', 'admin', None),
+    ('analytics.popularContent', 'GET', lambda d, r: '/api/analytics/popular-content', 'admin', None),
+    ('settings.pricing', 'GET', lambda d, r: '/api/settings/pricing', 'admin', None),
+    ('settings.subjects', 'GET', lambda d, r: '/api/settings/subjects', 'admin', None),
+    ('admin.doubtReply', 'POST', lambda d, r: f"/api/doubts/{r.choice(d['doubtIds'])}/reply", 'admin',
+     lambda d, r: {'text': 'Benchmark reply'}),
+    ('admin.grantAccess', 'POST', lambda d, r: f"/api/admin/tests/{r.choice(d['testIds'])}/grant-access", 'admin',
+     lambda d, r: {'userIds': r.sample(d['userIds'], min(10, len(d['userIds'])))}),
+    ('student.videos', 'GET', lambda d, r: '/api/student/videos', 'student', None),
+    ('student.video', 'GET', lambda d, r: f"/api/student/videos/{r.choice(d['videoIds'])}", 'student', None),
+    ('student.videoView', 'POST', lambda d, r: f"/api/student/videos/{r.choice(d['videoIds'])}/view", 'student',
+     lambda d, r: {'watchTime': r.randint(30, 3600)}),
+    ('student.materials', 'GET', lambda d, r: '/api/student/materials', 'student', None),
+    ('student.doubts', 'GET', lambda d, r: '/api/student/doubts', 'student', None),
+    ('student.submitDoubt', 'POST', lambda d, r: '/api/student/doubts', 'student',
+     lambda d, r: {'question': 'Benchmark doubt', 'chapter': r.choice(CHAPTERS)}),
+    ('student.profile', 'GET', lambda d, r: '/api/student/profile', 'student', None),
+    ('student.subscriptions', 'GET', lambda d, r: '/api/student/subscriptions', 'student', None),
+    ('student.progress', 'GET', lambda d, r: '/api/student/progress', 'student', None)
+]
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an ascending list"""
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+def run_scenario(base_url, scenario, dataset, requests_per_route, concurrency, seed):
+    name, method, path_fn, role, body_fn = scenario
+    local = threading.local()
+
+    def one_request(index):
+        rng = random.Random(f'{seed}-{name}-{index}')
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+        headers = {}
+        if role == 'admin':
+            headers['Authorization'] = f"Bearer {dataset['adminToken']}"
+        elif role == 'student':
+            headers['Authorization'] = f"Bearer {rng.choice(dataset['studentTokens'])}"
+        started = time.perf_counter()
+        response = local.session.request(
+            method, base_url + path_fn(dataset, rng), headers=headers,
+            json=body_fn(dataset, rng) if body_fn else None, timeout=120
+        )
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        reads = response.headers.get('X-Firestore-Reads')
+        return elapsed_ms, response.status_code, int(reads) if reads is not None else None
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        samples = list(pool.map(one_request, range(requests_per_route)))
+    wall_seconds = time.perf_counter() - started
+
+    latencies = sorted(sample[0] for sample in samples)
+    reads = [sample[2] for sample in samples if sample[2] is not None]
+    errors = sum(1 for sample in samples if sample[1] >= 400)
+    return {
+        'requests': len(samples),
+        'errors': errors,
+        'throughputRps': round(len(samples) / wall_seconds, 1),
+        'p50Ms': round(percentile(latencies, 0.50), 1),
+        'p95Ms': round(percentile(latencies, 0.95), 1),
+        'p99Ms': round(percentile(latencies, 0.99), 1),
+        'meanMs': round(sum(latencies) / len(latencies), 1),
+        'firestoreReadsPerRequest': round(sum(reads) / len(reads), 1) if reads else None
+    }
+
+
+# ===================================
+# SERVER UNDER TEST
+# ===================================
+
+def start_server(project_id, port, workers, threads):
+    env = dict(
+        os.environ,
+        FIRESTORE_EMULATOR_HOST=FIRESTORE_EMULATOR_HOST,
+        FIREBASE_AUTH_EMULATOR_HOST=AUTH_EMULATOR_HOST,
+        FIREBASE_PROJECT_ID=project_id,
+        FIREBASE_CREDENTIALS=dummy_service_account(project_id),
+        GUNICORN_THREADS=str(threads),
+        MAX_IN_FLIGHT_REQUESTS=str(threads),  # Measure latency, not load shedding
+        RATE_LIMIT_ENABLED='false',
+        LOG_LEVEL=os.getenv('LOG_LEVEL', 'WARNING'),
+        LOG_SUCCESS_SAMPLE_RATE='0'
+    )
+    server = subprocess.Popen(
+        ['gunicorn', 'backend:create_app()', '--bind', f'127.0.0.1:{port}',
+         '--workers', str(workers), '--threads', str(threads)],
+        cwd=REPO_ROOT, env=env
+    )
+    base_url = f'http://127.0.0.1:{port}'
+    deadline = time.time() + 60
+    while time.time() < deadline:
+        try:
+            if requests.get(base_url + '/api/health', timeout=2).status_code == 200:
+                return server, base_url
+        except requests.ConnectionError:
+            pass
+        if server.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        time.sleep(0.5)
+    server.terminate()
+    raise RuntimeError('Server did not become healthy within 60s')
+
+
+# ===================================
+# BASELINES
+# ===================================
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_scaling_table(results):
+    scales = sorted(results['scales'], key=int)
+    print(f"\n{'route':32}" + ''.join(f'{"p95@" + scale:>14}' for scale in scales) + f'{"reads/req":>12}')
+    for name, *_ in SCENARIOS:
+        row = f'{name:32}'
+        for scale in scales:
+            route = results['scales'][scale]['routes'].get(name)
+            row += f"{route['p95Ms'] if route else '-':>14}"
+        last = results['scales'][scales[-1]]['routes'].get(name) or {}
+        row += f"{last.get('firestoreReadsPerRequest') or '-':>12}"
+        print(row)
+
+
+def compare_baselines(current, previous_path):
+    """Print p95 and reads changes against a previous baseline; returns True if any route regressed"""
+    with open(previous_path, 'r', encoding='utf-8') as baseline_file:
+        previous = json.load(baseline_file)
+
+    regressed = False
+    print(f"\nComparison with {previous.get('label')} ({previous.get('gitRevision')}):")
+    for scale, scale_results in sorted(current['scales'].items(), key=lambda item: int(item[0])):
+        previous_routes = previous.get('scales', {}).get(scale, {}).get('routes', {})
+        for name, route in scale_results['routes'].items():
+            before = previous_routes.get(name)
+            if not before or not before.get('p95Ms'):
+                continue
+            change = (route['p95Ms'] - before['p95Ms']) / before['p95Ms']
+            flag = ''
+            if change > REGRESSION_THRESHOLD:
+                flag = '  <-- regression'
+                regressed = True
+            print(f"  {scale:>7} {name:32} p95 {before['p95Ms']:>8} -> {route['p95Ms']:>8} ms ({change:+.0%}), "
+                  f"reads {before.get('firestoreReadsPerRequest')} -> {route.get('firestoreReadsPerRequest')}{flag}")
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the GeoCatalyst backend against the Firebase emulators')
+    parser.add_argument('--scales', default='1000', help='Comma-separated user counts, e.g. 1000,10000,100000')
+    parser.add_argument('--label', default=datetime.now().strftime('%Y%m%d-%H%M%S'), help='Baseline file name')
+    parser.add_argument('--compare', help='Previous baseline JSON to diff against (exit 1 on regression)')
+    parser.add_argument('--project', default='demo-geocatalyst', help='Emulator project id (demo-* needs no login)')
+    parser.add_argument('--requests', type=int, default=200, help='Requests per route per scale')
+    parser.add_argument('--concurrency', type=int, default=8, help='Concurrent clients')
+    parser.add_argument('--attempts-per-user', type=int, default=3)
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers')
+    parser.add_argument('--threads', type=int, default=4, help='gunicorn threads per worker')
+    parser.add_argument('--port', type=int, default=5099)
+    parser.add_argument('--seed', type=int, default=42, help='Random seed for data and request mix')
+    args = parser.parse_args()
+
+    os.environ['FIRESTORE_EMULATOR_HOST'] = FIRESTORE_EMULATOR_HOST
+    client = firestore.Client(project=args.project, credentials=AnonymousCredentials())
+
+    results = {
+        'label': args.label,
+        'createdAt': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'gitRevision': git_revision(),
+        'config': {
+            'requestsPerRoute': args.requests,
+            'concurrency': args.concurrency,
+            'attemptsPerUser': args.attempts_per_user,
+            'gunicornWorkers': args.workers,
+            'gunicornThreads': args.threads,
+            'seed': args.seed
+        },
+        'scales': {}
+    }
+
+    for scale in (int(value) for value in args.scales.split(',')):
+        print(f'🌱 Seeding {scale} users...')
+        wipe_emulators(args.project)
+        seed_started = time.perf_counter()
+        dataset = seed_dataset(client, args.project, scale, random.Random(args.seed), args.attempts_per_user)
+        seed_seconds = round(time.perf_counter() - seed_started, 1)
+        print(f"   {dataset['documents']} documents in {seed_seconds}s")
+
+        server, base_url = start_server(args.project, args.port, args.workers, args.threads)
+        try:
+            routes = {}
+            for scenario in SCENARIOS:
+                routes[scenario[0]] = run_scenario(base_url, scenario, dataset, args.requests, args.concurrency, args.seed)
+                route = routes[scenario[0]]
+                print(f"   {scenario[0]:32} p50 {route['p50Ms']:>8}  p95 {route['p95Ms']:>8}  p99 {route['p99Ms']:>8} ms"
+                      f"  {route['throughputRps']:>7} rps  reads/req {route['firestoreReadsPerRequest']}"
+                      f"{'  errors ' + str(route['errors']) if route['errors'] else ''}")
+        finally:
+            server.terminate()
+            server.wait(timeout=30)
+
+        results['scales'][str(scale)] = {
+            'documents': dataset['documents'],
+            'seedSeconds': seed_seconds,
+            'routes': routes
+        }
+
+    os.makedirs(BASELINES_DIR, exist_ok=True)
+    output_path = os.path.join(BASELINES_DIR, f'{args.label}.json')
+    with open(output_path, 'w', encoding='utf-8') as output_file:
+        json.dump(results, output_file, indent=2, sort_keys=True)
+        output_file.write('\n')
+    print(f'\n📄 Baseline written to {os.path.relpath(output_path, REPO_ROOT)}')
+
+    print_scaling_table(results)
+
+    if args.compare and compare_baselines(results, args.compare):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
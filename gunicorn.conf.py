@@ -0,0 +1,47 @@
+# ===================================
+# GEOCATALYST ADMIN PANEL - GUNICORN CONFIG
+# ===================================
+# Picked up automatically by gunicorn from the working directory.
+# With preload the app is imported once in the master; Firebase clients are
+# created lazily per worker, so nothing holding a gRPC channel crosses the fork.
+import os
+import sys
+
+preload_app = os.getenv('GUNICORN_PRELOAD', 'true').lower() == 'true'
+# More than one thread per worker selects the gthread worker. Single-flight
+# coalescing in backend.py only shares work between threads of one process,
+# so GUNICORN_THREADS=1 turns it off in practice.
+threads = int(os.getenv('GUNICORN_THREADS', 4))
+# backend.py sizes its outbound HTTP pool from the same variable
+os.environ.setdefault('GUNICORN_THREADS', str(threads))
+
+
+def on_starting(server):
+    """Start each deploy with an empty Prometheus multiprocess directory"""
+    metrics_dir = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+    if metrics_dir:
+        os.makedirs(metrics_dir, exist_ok=True)
+        for name in os.listdir(metrics_dir):
+            if name.endswith('.db'):
+                os.remove(os.path.join(metrics_dir, name))
+
+
+def child_exit(server, worker):
+    """Drop a dead worker's live gauges from the aggregated metrics"""
+    if os.getenv('PROMETHEUS_MULTIPROC_DIR'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def post_fork(server, worker):
+    """Drop any client the master built before forking (only loaded with preload)"""
+    backend = sys.modules.get('backend')
+    if backend is not None:
+        backend.reset_firebase_clients()
+
+
+def post_worker_init(worker):
+    """Warm the worker's Firestore channel and caches once the app is loaded"""
+    import backend
+    backend.start_warm_up()
+
@@ -0,0 +1,75 @@
+# ===================================
+# GEOCATALYST - QUESTION IMAGE PIPELINE
+# ===================================
+# Pure image processing, kept out of backend.py so process-pool workers
+# can import it without initializing Firebase or Flask.
+import io
+import hashlib
+
+from PIL import Image, ImageOps
+
+MAX_DIMENSION = 1600
+THUMBNAIL_DIMENSION = 320
+WEBP_QUALITY = 80
+JPEG_QUALITY = 85
+
+CONTENT_TYPES = {
+    'webp': 'image/webp',
+    'png': 'image/png',
+    'jpg': 'image/jpeg',
+    'gif': 'image/gif',
+    'svg': 'image/svg+xml'
+}
+
+
+def content_digest(data):
+    """SHA-256 hex digest of the original upload, used to name variants"""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _encode(image, fmt, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, **options)
+    return buffer.getvalue()
+
+
+def _has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (image.mode == 'P' and 'transparency' in image.info)
+
+
+def process_image(data, extension):
+    """
+    Build the variants for one uploaded question image.
+
+    Returns {variant_name: (bytes, file_extension)} with:
+      'webp'      - capped to MAX_DIMENSION, WebP
+      'fallback'  - same size, PNG if the image has transparency else JPEG
+      'thumbnail' - capped to THUMBNAIL_DIMENSION, WebP
+    SVGs and animated images (GIF, WebP, APNG) are returned untouched as
+    'original', keeping their own extension.
+    """
+    if extension == 'svg':
+        return {'original': (data, 'svg')}
+
+    with Image.open(io.BytesIO(data)) as source:
+        if getattr(source, 'is_animated', False):
+            return {'original': (data, 'jpg' if extension == 'jpeg' else extension)}
+
+        image = ImageOps.exif_transpose(source)
+        image.thumbnail((MAX_DIMENSION, MAX_DIMENSION), Image.LANCZOS)
+
+        if _has_alpha(image):
+            image = image.convert('RGBA')
+            fallback = (_encode(image, 'PNG', optimize=True), 'png')
+        else:
+            image = image.convert('RGB')
+            fallback = (_encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True), 'jpg')
+
+        thumbnail = image.copy()
+        thumbnail.thumbnail((THUMBNAIL_DIMENSION, THUMBNAIL_DIMENSION), Image.LANCZOS)
+
+        return {
+            'webp': (_encode(image, 'WEBP', quality=WEBP_QUALITY, method=6), 'webp'),
+            'fallback': fallback,
+            'thumbnail': (_encode(thumbnail, 'WEBP', quality=WEBP_QUALITY, method=6), 'webp')
+        }
@@ -0,0 +1,69 @@
+# ===================================
+# GEOCATALYST - AUTH DECORATOR TESTS
+# ===================================
+# Token verification and principal lookups are stubbed; the decorators are
+# applied to throwaway views and called inside a test request context.
+import pytest
+
+import backend
+
+
+@pytest.fixture
+def auth_failures(monkeypatch):
+    failures = []
+    monkeypatch.setattr(backend, 'verify_id_token_cached', lambda token: {'uid': token})
+    monkeypatch.setattr(backend, 'get_principal', lambda collection, uid: (
+        {'isActive': True} if collection == 'admins' else {'subscriptions': []}
+    ) if uid != 'unknown' else None)
+    monkeypatch.setattr(backend, 'record_auth_failure', lambda: failures.append(1))
+    monkeypatch.setattr(backend, 'RATE_LIMIT_ENABLED', False)
+    return failures
+
+
+def call(decorator, view, token='user-1'):
+    with backend.app.test_request_context('/api/test', headers={'Authorization': f'Bearer {token}'}):
+        return backend.app.make_response(decorator(view)())
+
+
+@pytest.mark.parametrize('decorator', [backend.require_auth, backend.require_student_auth])
+def test_view_errors_propagate_and_are_not_auth_failures(auth_failures, decorator):
+    def view():
+        raise RuntimeError('view bug')
+
+    with pytest.raises(RuntimeError):
+        call(decorator, view)
+    assert auth_failures == []
+
+
+@pytest.mark.parametrize('decorator', [backend.require_auth, backend.require_student_auth])
+def test_valid_token_reaches_view(auth_failures, decorator):
+    response = call(decorator, lambda: ('ok', 200))
+    assert response.status_code == 200
+    assert auth_failures == []
+
+
+def test_invalid_token_is_an_auth_failure(auth_failures, monkeypatch):
+    def reject(token):
+        raise ValueError('bad token')
+    monkeypatch.setattr(backend, 'verify_id_token_cached', reject)
+    assert call(backend.require_auth, lambda: ('ok', 200)).status_code == 401
+    assert auth_failures == [1]
+
+
+def test_unknown_student_is_an_auth_failure(auth_failures):
+    assert call(backend.require_student_auth, lambda: ('ok', 200), token='unknown').status_code == 404
+    assert auth_failures == [1]
+
+
+def test_principal_lookup_outage_is_not_charged_to_the_caller(auth_failures, monkeypatch):
+    def outage(collection, uid):
+        raise RuntimeError('Firestore unavailable')
+    monkeypatch.setattr(backend, 'get_principal', outage)
+    assert call(backend.require_student_auth, lambda: ('ok', 200)).status_code == 503
+    assert auth_failures == []
+
+
+@pytest.mark.skipif('MAX_IN_FLIGHT_REQUESTS' in backend.os.environ, reason='explicitly configured')
+def test_load_shedding_is_off_unless_configured():
+    assert backend.MAX_IN_FLIGHT_REQUESTS == 0
+    assert backend.admission_slots is None
@@ -0,0 +1,132 @@
+# ===================================
+# GEOCATALYST - ID TOKEN VERIFIER TESTS
+# ===================================
+# Tokens are signed with a locally generated RSA key whose self-signed
+# certificate is installed through id_token_verifier.set_keys(), so no
+# request ever reaches Google's securetoken endpoint.
+import time
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import pytest
+from cryptography import x509
+from cryptography.hazmat.primitives import hashes, serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from cryptography.x509.oid import NameOID
+
+import backend
+
+PROJECT_ID = 'geocatalyst-test'
+KEY_ID = 'test-key'
+SKEW = backend.ID_TOKEN_CLOCK_SKEW_SECONDS
+
+
+def generate_signing_key():
+    """RSA private key plus a self-signed PEM certificate for its public half"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, 'securetoken.test')])
+    now = datetime.now(timezone.utc)
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(private_key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(days=1))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(private_key, hashes.SHA256())
+    )
+    return private_key, certificate.public_bytes(serialization.Encoding.PEM).decode('utf-8')
+
+
+SIGNING_KEY, SIGNING_CERT = generate_signing_key()
+OTHER_KEY, _ = generate_signing_key()
+
+
+@pytest.fixture
+def verifier(monkeypatch):
+    monkeypatch.delenv('FIREBASE_AUTH_EMULATOR_HOST', raising=False)
+    verifier = backend.id_token_verifier
+    monkeypatch.setattr(verifier, '_project_id', PROJECT_ID)
+    monkeypatch.setattr(verifier, 'ensure_started', lambda: None)  # No background fetches
+    verifier.set_keys({KEY_ID: SIGNING_CERT})
+    return verifier
+
+
+def make_claims(**overrides):
+    now = int(time.time())
+    claims = {
+        'aud': PROJECT_ID,
+        'iss': f'https://securetoken.google.com/{PROJECT_ID}',
+        'sub': 'student-uid-123',
+        'iat': now - 60,
+        'exp': now + 3600,
+        'auth_time': now - 120
+    }
+    claims.update(overrides)
+    return {name: value for name, value in claims.items() if value is not None}
+
+
+def sign(claims, key=SIGNING_KEY, algorithm='RS256', kid=KEY_ID):
+    return jwt.encode(claims, key, algorithm=algorithm, headers={'kid': kid})
+
+
+def test_valid_token_returns_uid_equal_to_sub(verifier):
+    claims = verifier.verify(sign(make_claims()))
+    assert claims['uid'] == 'student-uid-123'
+    assert claims['sub'] == claims['uid']
+
+
+def test_iat_and_auth_time_within_clock_skew_are_accepted(verifier):
+    now = int(time.time())
+    claims = verifier.verify(sign(make_claims(iat=now + SKEW // 2, auth_time=now + SKEW // 2)))
+    assert claims['uid'] == 'student-uid-123'
+
+
+@pytest.mark.parametrize('overrides', [
+    pytest.param({'aud': 'another-project'}, id='wrong-aud'),
+    pytest.param({'iss': 'https://securetoken.google.com/another-project'}, id='wrong-iss'),
+    pytest.param({'iss': f'https://accounts.google.com/{PROJECT_ID}'}, id='wrong-issuer-host'),
+    pytest.param({'exp': int(time.time()) - SKEW - 60}, id='expired'),
+    pytest.param({'iat': int(time.time()) + SKEW + 60}, id='iat-in-future'),
+    pytest.param({'auth_time': int(time.time()) + SKEW + 60}, id='auth-time-in-future'),
+    pytest.param({'sub': ''}, id='empty-sub'),
+    pytest.param({'sub': 'x' * 129}, id='sub-over-128-chars'),
+    pytest.param({'sub': None}, id='missing-sub'),
+    pytest.param({'exp': None}, id='missing-exp'),
+    pytest.param({'iat': None}, id='missing-iat'),
+])
+def test_invalid_claims_are_rejected(verifier, overrides):
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(sign(make_claims(**overrides)))
+
+
+def test_sub_of_exactly_128_chars_is_accepted(verifier):
+    assert verifier.verify(sign(make_claims(sub='x' * 128)))['uid'] == 'x' * 128
+
+
+def test_alg_none_is_rejected(verifier):
+    token = jwt.encode(make_claims(), None, algorithm='none', headers={'kid': KEY_ID})
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token)
+
+
+def test_hs256_is_rejected(verifier):
+    token = sign(make_claims(), key='shared-secret-that-is-long-enough-for-hs256', algorithm='HS256')
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(token)
+
+
+def test_rs512_is_rejected(verifier):
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(sign(make_claims(), algorithm='RS512'))
+
+
+def test_unknown_kid_is_rejected(verifier):
+    with pytest.raises(jwt.InvalidTokenError):
+        verifier.verify(sign(make_claims(), kid='rotated-away'))
+
+
+def test_signature_from_another_key_is_rejected(verifier):
+    with pytest.raises(jwt.InvalidSignatureError):
+        verifier.verify(sign(make_claims(), key=OTHER_KEY))
@@ -0,0 +1,113 @@
+# ===================================
+# GEOCATALYST - SINGLE-FLIGHT COALESCING TESTS
+# ===================================
+# Callers run on their own threads, each inside its own request context, the
+# way gthread workers serve them. The leader's fetch blocks until every
+# follower has arrived, so the overlap does not depend on scheduling luck.
+import threading
+import time
+
+import pytest
+from flask import jsonify
+
+import backend
+
+FOLLOWERS = 4
+
+
+@pytest.fixture(autouse=True)
+def enabled(monkeypatch):
+    monkeypatch.setattr(backend, 'SINGLE_FLIGHT_ENABLED', True)
+
+
+class SlowFetch:
+    """A view whose body counts its calls and waits to be released"""
+
+    def __init__(self, error=None):
+        self.calls = 0
+        self.entered = threading.Event()
+        self.release = threading.Event()
+        self.error = error
+        self.arrivals = 0
+        self._lock = threading.Lock()
+
+    def scope(self):
+        with self._lock:
+            self.arrivals += 1
+        return 'admin'
+
+    def view(self):
+        with self._lock:
+            self.calls += 1
+        self.entered.set()
+        assert self.release.wait(5)
+        if self.error is not None:
+            raise self.error
+        return jsonify({'success': True, 'calls': self.calls})
+
+
+def call(view, path, results, index):
+    with backend.app.test_request_context(path):
+        try:
+            response = backend.app.make_response(view())
+            results[index] = (response.status_code, response.get_json())
+        except Exception as e:
+            results[index] = e
+
+
+def run_concurrently(fetch, paths):
+    """Start the first path as leader, the rest once its fetch is under way"""
+    view = backend.coalesce_requests(fetch.scope)(fetch.view)
+    results = [None] * len(paths)
+    threads = [threading.Thread(target=call, args=(view, path, results, i)) for i, path in enumerate(paths)]
+    threads[0].start()
+    assert fetch.entered.wait(5)
+    for thread in threads[1:]:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while fetch.arrivals < len(paths) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    time.sleep(0.1)  # Arrived followers reach the flight table
+    fetch.release.set()
+    for thread in threads:
+        thread.join(5)
+    return results
+
+
+def test_concurrent_callers_share_one_fetch():
+    fetch = SlowFetch()
+    results = run_concurrently(fetch, ['/api/admin/dashboard'] * (1 + FOLLOWERS))
+    assert fetch.calls == 1
+    assert results == [(200, {'success': True, 'calls': 1})] * (1 + FOLLOWERS)
+
+
+def test_query_args_are_normalized_into_the_key():
+    fetch = SlowFetch()
+    paths = ['/api/analytics/overview?b=2&a=1', '/api/analytics/overview?a=1&b=2&c=']
+    results = run_concurrently(fetch, paths)
+    assert fetch.calls == 1
+    assert results[0] == results[1]
+
+
+def test_different_queries_fetch_separately():
+    fetch = SlowFetch()
+    fetch.release.set()
+    results = run_concurrently(fetch, ['/api/analytics/overview?days=7', '/api/analytics/overview?days=30'])
+    assert fetch.calls == 2
+    assert all(status == 200 for status, _ in results)
+
+
+def test_leader_error_is_raised_in_followers():
+    fetch = SlowFetch(error=RuntimeError('firestore unavailable'))
+    results = run_concurrently(fetch, ['/api/admin/dashboard'] * (1 + FOLLOWERS))
+    assert fetch.calls == 1
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+def test_nothing_is_kept_after_the_leader_finishes():
+    fetch = SlowFetch()
+    fetch.release.set()
+    run_concurrently(fetch, ['/api/admin/dashboard'])
+    run_concurrently(fetch, ['/api/admin/dashboard'])
+    assert fetch.calls == 2
+    assert backend.single_flight._flights == {}
@@ -0,0 +1,44 @@
+# ===================================
+# GEOCATALYST - YOUTUBE ID VALIDATION TESTS
+# ===================================
+# youtubeId values end up as cache file names, so only bare 11-character
+# IDs may reach YouTubeMetadataCache or the enrichment queue.
+import pytest
+
+import backend
+
+
+@pytest.mark.parametrize('value, expected', [
+    ('dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://youtu.be/dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', 'dQw4w9WgXcQ'),
+    ('../../etc/passwd', None),
+    ('', None),
+    (None, None),
+])
+def test_extract_youtube_id(value, expected):
+    assert backend.extract_youtube_id(value) == expected
+
+
+@pytest.mark.parametrize('youtube_id', ['../../../tmp/evil', 'dQw4w9WgXcQ\n', '/abs/path', '', None])
+def test_cache_rejects_ids_that_are_not_bare_ids(tmp_path, youtube_id):
+    cache = backend.YouTubeMetadataCache(str(tmp_path / 'youtube'), ttl_seconds=60)
+    assert cache.get(youtube_id) is None
+    with pytest.raises(ValueError):
+        cache.set(youtube_id, {'title': 'x'})
+    assert not list(tmp_path.rglob('*.json'))
+
+
+def test_cache_round_trip(tmp_path):
+    cache = backend.YouTubeMetadataCache(str(tmp_path), ttl_seconds=60)
+    cache.set('dQw4w9WgXcQ', {'title': 'x'})
+    assert cache.get('dQw4w9WgXcQ') == {'title': 'x'}
+
+
+def test_invalid_ids_are_not_enqueued(monkeypatch):
+    worker = backend.YouTubeEnrichmentWorker(cache=None)
+    monkeypatch.setattr(worker, '_ensure_thread', lambda: None)
+    worker.enqueue('video-1', '../../x')
+    worker.enqueue('video-2', 'dQw4w9WgXcQ')
+    assert worker._queue.qsize() == 1